@@ -1,16 +1,98 @@
 import os
 os.environ["HF_DATASETS_NO_PROGRESS_BAR"] = "1"
 
+import re
 import json
-from datasets import load_dataset, concatenate_datasets
-from transformers import (AutoTokenizer, AutoModelForCausalLM, DataCollatorForLanguageModeling, TrainingArguments, Trainer,)
-from peft import get_peft_model, LoraConfig, TaskType
+import shutil
+import hashlib
+import tempfile
+from math import ceil
+import numpy as np
+from lazy_imports import LazyModule
+from corpus_writer import document_name
+
+# Heavy dependencies are imported on first use, so importing this module (e.g. for DataPreparer options) stays fast.
+torch = LazyModule("torch")
+datasets = LazyModule("datasets")
+transformers = LazyModule("transformers")
+peft = LazyModule("peft")
+
+
+def available_cores():
+
+    """
+    Number of CPU cores this process may run on: its scheduler affinity where the OS reports it, else the CPU count.
+    """
+
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+_token_counting_trainer = None
+
+
+
+def token_counting_trainer_class():
+
+    """
+    Return the TokenCountingTrainer class. It subclasses transformers.Trainer, so it is only defined when first
+    needed instead of when this module is imported.
+    """
+
+    global _token_counting_trainer
+    if _token_counting_trainer is None:
+
+        class TokenCountingTrainer(transformers.Trainer):
+
+            """
+            Trainer that counts the real (attended) and padded tokens of every training batch, so throughput can be
+            compared between batching strategies.
+            """
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.real_tokens = 0
+                self.padded_tokens = 0
+
+
+            def training_step(self, model, inputs, *args, **kwargs):
+                attention_mask = inputs.get("attention_mask")
+                if attention_mask is not None:
+                    self.real_tokens += int(attention_mask.sum())
+                    self.padded_tokens += attention_mask.numel()
+                return super().training_step(model, inputs, *args, **kwargs)
+
+
+            def report_throughput(self, runtime):
+
+                """
+                Print tokens/sec over the training run.
+
+                Parameters:
+                    runtime (float): Training wall time in seconds (the train_runtime metric).
+                """
+
+                if not runtime or not self.padded_tokens:
+                    return
+                sampler = "length-grouped" if self.args.group_by_length else "random"
+                print(f"{sampler} batches: {self.real_tokens / runtime:.1f} tokens/sec "
+                      f"({self.padded_tokens / runtime:.1f} incl. padding, "
+                      f"padding {1 - self.real_tokens / self.padded_tokens:.1%})")
+
+        _token_counting_trainer = TokenCountingTrainer
+    return _token_counting_trainer
+
+
+def __getattr__(name):
+    if name == "TokenCountingTrainer":
+        return token_counting_trainer_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 
 class DataPreparer:
 
-    def __init__(self, json_dir, test_size=0.05, seed=42, max_length=512, use_lora=True):
+    def __init__(self, json_dir, test_size=0.05, seed=42, max_length=512, use_lora=True, corpus_dir=None,
+                 cache_dir="./tokenized_cache", num_proc=None, packing=False):
 
         """
         Initialize the DataPreparer with dataset parameters and model tokenization settings.
@@ -21,13 +103,22 @@ class DataPreparer:
             seed (int): Seed for random operations.
             max_length (int): Maximum sequence length for tokenization.
             use_lora (bool): Whether to enable LoRA fine-tuning.
+            corpus_dir (str): Optional directory of consolidated corpus shards written by main.py; when set,
+                the corpus is loaded in one load_dataset call instead of one call per JSON file.
+            cache_dir (str): Directory for tokenized datasets reused across runs, or None to disable the cache.
+            num_proc (int): Worker processes for tokenization. Defaults to the number of available cores.
+            packing (bool): Whether to pack tokenized records into max_length blocks instead of one padded example each.
         """
 
         self.json_dir = json_dir
+        self.corpus_dir = corpus_dir
         self.test_size = test_size
         self.seed = seed
         self.max_length = max_length
         self.use_lora = use_lora
+        self.cache_dir = cache_dir
+        self.packing = packing
+        self.num_proc = num_proc if num_proc is not None else available_cores()
         
         self.train_dataset = None
         self.test_dataset = None
@@ -35,7 +126,7 @@ class DataPreparer:
         self.test_dataset_tokenized = None
         
         # Load the GPT-2 tokenizer and add special tokens for padding and separation.
-        self.tokenizer = AutoTokenizer.from_pretrained("./GPT-2", local_files_only=True)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained("./GPT-2", local_files_only=True)
 
         special_tokens = ["<PAD>", "<SEP>"]
         self.tokenizer.add_tokens(special_tokens)
@@ -49,11 +140,15 @@ class DataPreparer:
         """
         Iterates over JSON files in self.json_dir, loads each file as a dataset, extracts the document name,
         and groups data by 'Section'. Each section is split into training and test sets based on test_size.
+        If self.corpus_dir is set, the consolidated corpus is loaded instead (see load_corpus).
         
         Returns:
             dict: A dictionary with keys 'train' and 'test' containing the corresponding datasets.
         """
 
+        if self.corpus_dir:
+            return self.load_corpus()
+
         train_list = []
         test_list = []
 
@@ -62,38 +157,15 @@ class DataPreparer:
                 file_path = os.path.join(self.json_dir, file)
                 print(f"loading {file_path}...")
 
-                ds = load_dataset("json", data_files=file_path)["train"] # Load the JSON file as a dataset.
-
-                file_name_full = os.path.basename(file_path)               # e.g., "Pracitcal Advice Note - Domestic Abuse.json"
-                file_name_no_ext = file_name_full.replace(".json", "")       # "Pracitcal Advice Note - Domestic Abuse"
-                if "-" in file_name_no_ext:
-                    document_name = file_name_no_ext.split("-")[-1].strip()  # "Domestic Abuse"
-                else:
-                    document_name = file_name_no_ext
+                ds = datasets.load_dataset("json", data_files=file_path)["train"] # Load the JSON file as a dataset.
 
-                ds = ds.map(lambda x: {"Document": document_name}) # Add the document name to each record.
+                document = document_name(file_path)      # "Pracitcal Advice Note - Domestic Abuse.json" -> "Domestic Abuse"
+                ds = ds.map(lambda x: {"Document": document, "Source": file}) # Add the document name and source file to each record.
 
                 if "Section" not in ds.column_names:
                     raise ValueError(f"'Section' key not found in {file_path}")
 
-                # Group data by Section
-                unique_sections = set(ds["Section"])
-                file_train_groups = []
-                file_test_groups = []
-
-
-                for section in unique_sections:
-                    ds_section = ds.filter(lambda x: x["Section"] == section)
-                    if len(ds_section) < 2:
-                        file_train_groups.append(ds_section)
-
-                    else:
-                        split_ds = ds_section.train_test_split(test_size=self.test_size, seed=self.seed)
-                        file_train_groups.append(split_ds["train"])
-                        file_test_groups.append(split_ds["test"])
-
-                file_train = concatenate_datasets(file_train_groups)
-                file_test = concatenate_datasets(file_test_groups)
+                file_train, file_test = self.split_sections(ds)
                 train_list.append(file_train)
                 test_list.append(file_test)
                 
@@ -101,8 +173,8 @@ class DataPreparer:
         if not train_list:
             raise ValueError("No JSON file found in the specified directory")
 
-        self.train_dataset = concatenate_datasets(train_list)
-        self.test_dataset = concatenate_datasets(test_list)
+        self.train_dataset = datasets.concatenate_datasets(train_list)
+        self.test_dataset = datasets.concatenate_datasets(test_list)
 
         #Optional: Save the datasets for review.
         #self.train_dataset.to_json("train_dataset_review.json", orient="records", lines=True)
@@ -111,40 +183,363 @@ class DataPreparer:
         return {"train": self.train_dataset, "test": self.test_dataset}
 
 
+    def load_corpus(self):
+
+        """
+        Load the sharded JSONL or Parquet corpus in self.corpus_dir with a single load_dataset call. The Document
+        column is already filled in. Every section of every Source document is split in one pass over the whole
+        corpus, with the same membership load_json_files gives when splitting each file on its own.
+
+        Returns:
+            dict: A dictionary with keys 'train' and 'test' containing the corresponding datasets.
+        """
+
+        shards = sorted(os.listdir(self.corpus_dir)) if os.path.isdir(self.corpus_dir) else []
+        parquet_files = [os.path.join(self.corpus_dir, f) for f in shards if f.startswith("corpus-") and f.endswith(".parquet")]
+        jsonl_files = [os.path.join(self.corpus_dir, f) for f in shards if f.startswith("corpus-") and f.endswith(".jsonl")]
+
+        if parquet_files and jsonl_files:
+            raise ValueError(f"{self.corpus_dir} holds both JSONL and Parquet corpus shards; remove the stale ones")
+        if parquet_files:
+            ds = datasets.load_dataset("parquet", data_files=parquet_files)["train"]
+        elif jsonl_files:
+            ds = datasets.load_dataset("json", data_files=jsonl_files)["train"]
+        else:
+            raise ValueError(f"No corpus shards found in {self.corpus_dir}")
+        print(f"loaded corpus of {len(ds)} rows from {self.corpus_dir}")
+
+        if "Section" not in ds.column_names or "Source" not in ds.column_names:
+            raise ValueError(f"'Section' and 'Source' columns are required in the corpus at {self.corpus_dir}")
+
+        # A section is split within its own document, so the whole corpus is split at once on (Source, Section).
+        self.train_dataset, self.test_dataset = self.split_sections(ds, group_by=("Source", "Section"))
+
+        return {"train": self.train_dataset, "test": self.test_dataset}
+
+
+    def split_sections(self, ds, group_by=("Section",)):
+
+        """
+        Split one document's dataset into training and test sets per 'Section', based on test_size.
+        Sections with fewer than two rows go entirely to the training set.
+
+        The rows are grouped in one pass (section ids, then a stable argsort) and each section is split
+        with the same permutation Dataset.train_test_split(test_size, seed) would use, so the membership
+        of both sets is unchanged. Only two select calls touch the dataset.
+
+        Parameters:
+            ds (Dataset): The rows of a single document, or of many when group_by includes the document column.
+            group_by (tuple): Columns whose combined values identify a section, e.g. ("Source", "Section").
+
+        Returns:
+            tuple: (train Dataset, test Dataset)
+        """
+
+        # Assign each section an id in order of first appearance (None is a section too).
+        columns = [ds[column] for column in group_by]
+        keys = columns[0] if len(columns) == 1 else zip(*columns)
+        section_ids = {}
+        ids = np.fromiter((section_ids.setdefault(key, len(section_ids)) for key in keys), dtype=np.int64, count=len(ds))
+
+        order = np.argsort(ids, kind="stable")
+        boundaries = np.flatnonzero(np.diff(ids[order])) + 1
+
+        train_indices = []
+        test_indices = []
+        for group in np.split(order, boundaries):
+            if len(group) < 2:
+                train_indices.append(group)
+                continue
+
+            n_test = ceil(self.test_size * len(group))
+            n_train = len(group) - n_test
+            if n_train == 0:
+                raise ValueError(f"test_size={self.test_size} leaves no training rows for a section of {len(group)} rows")
+
+            permutation = np.random.default_rng(self.seed).permutation(len(group))
+            test_indices.append(group[permutation[:n_test]])
+            train_indices.append(group[permutation[n_test:]])
+
+        train_indices = np.concatenate(train_indices) if train_indices else np.array([], dtype=np.int64)
+        test_indices = np.concatenate(test_indices) if test_indices else np.array([], dtype=np.int64)
+        return ds.select(train_indices), ds.select(test_indices)
+    
+
+    def build_texts(self, example):
+
+        """
+        Combine the 'Document', 'Section', 'Subsection', and 'Content' fields of a batch into one string per example.
+
+        Parameters:
+            example (dict): A batch of examples (lists of column values).
+
+        Returns:
+            list: The combined text of each example.
+        """
+
+        combined_text = []
+        # Combine fields for each example.
+        for sec, subsec, content, doc in zip(example["Section"], example["Subsection"], example["Content"], example["Document"]):
+
+            sec = sec if sec is not None else ""
+            subsec = subsec if subsec is not None else ""
+            content = content if content is not None else ""
+            doc = doc if doc is not None else ""
+            combined_text.append(doc + " " + sec + " " + subsec + " " + content)
+        return combined_text
+
+
     def tokenize_data(self):
 
         """
         Tokenize the training and test datasets.
 
         Combines the 'Document', 'Section', 'Subsection', and 'Content' fields into a single string for each example,
-        then tokenizes the text with truncation to self.max_length.
+        then tokenizes the text with truncation to self.max_length. If self.packing is set, the records are then
+        packed into blocks (see pack_data).
+
+        When self.cache_dir is set, tokenized rows are saved per source document under a key made of the tokenizer
+        vocabulary hash and max_length. A rerun with an unchanged corpus loads the whole split from disk, and when
+        only some source files changed only their rows are tokenized again. Entries the run does not use are
+        then deleted (see prune_tokenized_cache).
 
         Returns:
             dict: A dictionary with tokenized 'train' and 'test' datasets formatted as PyTorch tensors.
         """
 
         def tokenize_function(example):
-            combined_text = []
-            # Combine fields for each example.
-            for sec, subsec, content, doc in zip(example["Section"], example["Subsection"], example["Content"], example["Document"]):
-
-                sec = sec if sec is not None else ""
-                subsec = subsec if subsec is not None else ""
-                content = content if content is not None else ""
-                doc = doc if doc is not None else ""
-                combined_text.append(doc + " " + sec + " " + subsec + " " + content)
-                
-            return self.tokenizer(combined_text, truncation=True, max_length= self.max_length)
+            tokenized = self.tokenizer(self.build_texts(example), truncation=True, max_length= self.max_length)
+            tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]  # used by group_by_length batching
+            return tokenized
+
+        if self.cache_dir:
+            cache_root = os.path.join(self.cache_dir, self.tokenizer_fingerprint())
+            self.train_dataset_tokenized = self.tokenize_cached(self.train_dataset, tokenize_function, cache_root)
+            self.test_dataset_tokenized = self.tokenize_cached(self.test_dataset, tokenize_function, cache_root)
+            self.prune_tokenized_cache(cache_root, [self.train_dataset_tokenized, self.test_dataset_tokenized])
+        else:
+            #Apply tokenization on training and testing datasets using multiprocessing.
+            self.train_dataset_tokenized = self.train_dataset.map(tokenize_function, batched=True, num_proc=self.map_num_proc(len(self.train_dataset)))
+            self.test_dataset_tokenized = self.test_dataset.map(tokenize_function, batched=True, num_proc=self.map_num_proc(len(self.test_dataset)))
 
-        #Apply tokenization on training and testing datasets using multiprocessing.
-        self.train_dataset_tokenized = self.train_dataset.map(tokenize_function, batched=True, num_proc=4)
-        self.test_dataset_tokenized = self.test_dataset.map(tokenize_function, batched=True, num_proc=4)
+        if self.packing:
+            self.pack_data()
 
-        # Format the datasets to return PyTorch tensors.
-        self.train_dataset_tokenized.set_format(type="torch", columns=["input_ids", "attention_mask"])
-        self.test_dataset_tokenized.set_format(type="torch", columns=["input_ids", "attention_mask"])
+        # Format the datasets to return PyTorch tensors. Trainer drops the length column before the forward pass.
+        self.train_dataset_tokenized.set_format(type="torch", columns=["input_ids", "attention_mask", "length"])
+        self.test_dataset_tokenized.set_format(type="torch", columns=["input_ids", "attention_mask", "length"])
 
         return {"train": self.train_dataset_tokenized, "test": self.test_dataset_tokenized}
+
+
+    def pack_data(self, block_size=None, batch_size=4):
+
+        """
+        Pack the tokenized train and test records into fixed-length blocks for causal-LM training.
+
+        Records are concatenated with an EOS token (or <SEP> if the tokenizer has no EOS) after each one and cut
+        into blocks of block_size tokens; every token in a block is attended to and used as a label, so only the
+        final short block of each map batch needs padding. The padding ratio before and after packing is printed.
+
+        This is standard concatenate-and-chunk packing, as in GPT-2's own pretraining: positions run on across
+        the whole block and every token attends to everything before it in the block, so a record can see the
+        records before it, separated by the boundary token. Per-record masking would need block-diagonal 4D
+        masks, which GPT-2 training through DataCollatorForLanguageModeling does not support; restarting only
+        the positions would mix the two schemes, with earlier records visible at overlapping positions.
+
+        Parameters:
+            block_size (int): Tokens per block. Defaults to self.max_length.
+            batch_size (int): Per-device batch size used to estimate the padding ratio.
+
+        Returns:
+            dict: A dictionary with the packed 'train' and 'test' datasets.
+        """
+
+        block_size = block_size or self.max_length
+        boundary_id = self.tokenizer.eos_token_id
+        if boundary_id is None:
+            boundary_id = self.tokenizer.convert_tokens_to_ids("<SEP>")
+
+        def pack_function(batch):
+            ids = []
+            for record in batch["input_ids"]:
+                ids.extend(record)
+                ids.append(boundary_id)
+            blocks = [ids[i:i + block_size] for i in range(0, len(ids), block_size)]
+            return {"input_ids": blocks, "attention_mask": [[1] * len(block) for block in blocks],
+                    "length": [len(block) for block in blocks]}
+
+        packed = {}
+        for name, ds in (("train", self.train_dataset_tokenized), ("test", self.test_dataset_tokenized)):
+            before = self.padding_ratio([len(ids) for ids in ds["input_ids"]], batch_size)
+            packed[name] = ds.map(pack_function, batched=True, remove_columns=ds.column_names,
+                                  num_proc=self.map_num_proc(len(ds)))
+            # An empty split maps to a dataset without columns.
+            after = self.padding_ratio(packed[name]["length"] if len(packed[name]) else [], batch_size)
+            print(f"{name}: packed {len(ds)} records into {len(packed[name])} blocks of {block_size} tokens, "
+                  f"padding ratio {before:.1%} -> {after:.1%}")
+
+        self.train_dataset_tokenized = packed["train"]
+        self.test_dataset_tokenized = packed["test"]
+        return packed
+
+
+    def padding_ratio(self, lengths, batch_size):
+
+        """
+        Estimate the fraction of padding tokens when examples of the given lengths are batched in a seeded
+        random order and each batch is padded to its longest member.
+
+        Parameters:
+            lengths (list): Token count of each example.
+            batch_size (int): Examples per batch.
+
+        Returns:
+            float: Padding tokens divided by total tokens processed.
+        """
+
+        if not lengths:
+            return 0.0
+
+        lengths = np.random.default_rng(self.seed).permutation(np.asarray(lengths))
+        padded = 0
+        for start in range(0, len(lengths), batch_size):
+            padded += int(lengths[start:start + batch_size].max()) * len(lengths[start:start + batch_size])
+        return 1.0 - lengths.sum() / padded if padded else 0.0
+
+
+    def map_num_proc(self, num_rows, rows_per_proc=1000):
+
+        """
+        Number of processes for Dataset.map: all available cores for large inputs, fewer (or None for
+        in-process) when there are too few rows to make extra processes worthwhile.
+        """
+
+        num_proc = min(self.num_proc, num_rows // rows_per_proc)
+        return num_proc if num_proc > 1 else None
+
+
+    def tokenizer_fingerprint(self):
+
+        """
+        Hash the tokenizer vocabulary (including the added <PAD>/<SEP> tokens) together with max_length.
+
+        Returns:
+            str: Hex digest used as the cache key for tokenized datasets.
+        """
+
+        digest = hashlib.sha256()
+        digest.update(type(self.tokenizer).__name__.encode("utf-8"))
+        digest.update(json.dumps(self.tokenizer.get_vocab(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        digest.update(f"max_length={self.max_length}".encode("utf-8"))
+        digest.update(b"columns=input_ids,attention_mask,length")
+        return digest.hexdigest()[:16]
+
+
+    def source_fingerprints(self, ds):
+
+        """
+        Group the rows of a dataset by source document and fingerprint each group's tokenizer input.
+
+        Returns:
+            dict: Mapping of group fingerprint to the list of row indices in that group, in order of first appearance.
+        """
+
+        sources = ds["Source"] if "Source" in ds.column_names else ds["Document"]
+        digests = {}
+        indices = {}
+        for i, (source, text) in enumerate(zip(sources, self.build_texts(ds.to_dict()))):
+            if source not in digests:
+                digests[source] = hashlib.sha256(str(source).encode("utf-8"))
+                indices[source] = []
+            digests[source].update(text.encode("utf-8") + b"\0")
+            indices[source].append(i)
+
+        return {digests[source].hexdigest()[:24]: indices[source] for source in indices}
+
+
+    def tokenize_cached(self, ds, tokenize_function, cache_root):
+
+        """
+        Tokenize a dataset, reusing per-source tokenized rows stored under cache_root.
+
+        Every source document is saved to its own directory, written under a temporary name and renamed into
+        place, so an interrupted run never leaves a partial entry that a later run would load. The split is
+        rebuilt from the memory-mapped source entries on every run rather than saved again.
+
+        Parameters:
+            ds (Dataset): The dataset to tokenize.
+            tokenize_function (callable): Batched tokenization function for Dataset.map.
+            cache_root (str): Cache directory for the current tokenizer and max_length.
+
+        Returns:
+            Dataset: The tokenized dataset, memory-mapped from the cache. Rows are grouped by source document.
+        """
+
+        if len(ds) == 0:
+            return ds.map(tokenize_function, batched=True)
+
+        groups = self.source_fingerprints(ds)
+        missing = [key for key in groups if not os.path.isdir(os.path.join(cache_root, "source-" + key))]
+        print(f"tokenizing {len(missing)} of {len(groups)} source documents ({len(groups) - len(missing)} cached)")
+
+        if missing:
+            os.makedirs(cache_root, exist_ok=True)
+            missing_indices = [i for key in missing for i in groups[key]]
+            tokenized = ds.select(missing_indices).map(tokenize_function, batched=True,
+                                                       num_proc=self.map_num_proc(len(missing_indices)))
+            offset = 0
+            for key in missing:
+                size = len(groups[key])
+                self.save_atomic(tokenized.select(range(offset, offset + size)), os.path.join(cache_root, "source-" + key))
+                offset += size
+
+        parts = [datasets.load_from_disk(os.path.join(cache_root, "source-" + key)) for key in groups]
+        return datasets.concatenate_datasets(parts)
+
+
+    def prune_tokenized_cache(self, cache_root, in_use):
+
+        """
+        Delete tokenized cache entries the current run does not use, so corpus and tokenizer changes do not
+        accumulate on disk: source entries under cache_root that none of the in_use datasets is read from (the
+        old versions of edited or removed documents), whole-split copies written by earlier versions, and the
+        cache roots of other tokenizers or max_length values next to cache_root.
+
+        Parameters:
+            cache_root (str): Cache directory for the current tokenizer and max_length.
+            in_use (list): Datasets returned by tokenize_cached, memory-mapped from the entries to keep.
+        """
+
+        keep = {os.path.dirname(os.path.abspath(cache_file["filename"])) for ds in in_use for cache_file in ds.cache_files}
+        for name in os.listdir(cache_root):
+            path = os.path.join(cache_root, name)
+            if name.startswith("split-") or (name.startswith("source-") and os.path.abspath(path) not in keep):
+                shutil.rmtree(path, ignore_errors=True)
+
+        cache_dir, current = os.path.split(os.path.normpath(cache_root))
+        for name in os.listdir(cache_dir):
+            # Other cache roots are named by tokenizer_fingerprint.
+            if name != current and re.fullmatch(r"[0-9a-f]{16}", name) and os.path.isdir(os.path.join(cache_dir, name)):
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+    def save_atomic(self, ds, path):
+
+        """
+        Save a dataset to path via a temporary directory next to it, renamed into place once complete.
+        If another run saved the same entry first, its copy is kept.
+        """
+
+        tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(path))
+        try:
+            ds.save_to_disk(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
     
 
     def load_model(self):
@@ -159,22 +554,22 @@ class DataPreparer:
             model: The loaded and optionally adapted language model.
         """
 
-        self.model = AutoModelForCausalLM.from_pretrained("./GPT-2", local_files_only=True)
+        self.model = transformers.AutoModelForCausalLM.from_pretrained("./GPT-2", local_files_only=True)
         self.model.resize_token_embeddings(len(self.tokenizer))
         print("model loaded successfully")
 
 
         if self.use_lora:
             # Configure LoRA settings.
-            lora_config = LoraConfig(
-                task_type= TaskType.CAUSAL_LM,
+            lora_config = peft.LoraConfig(
+                task_type= peft.TaskType.CAUSAL_LM,
                 inference_mode=False,
                 r=8,
                 lora_alpha=32,
                 lora_dropout=0.1
             )
             # Apply LoRA adapter to the model.
-            self.model = get_peft_model(self.model, lora_config)
+            self.model = peft.get_peft_model(self.model, lora_config)
             self.model.print_trainable_parameters()
         else:
             print("loRA not used")
@@ -182,7 +577,47 @@ class DataPreparer:
         return self.model
     
 
-    def train_model(self, output_dir="./GPTtrained", num_train_epochs=3, batch_size = 4):
+    def hardware_profile(self, gradient_checkpointing=False):
+
+        """
+        Choose precision and parallelism settings for the machine training runs on.
+
+        On a GPU, fp16 is used as before. On a CPU-only machine, bf16 is used when the CPU has native bf16
+        support (AVX512-BF16 or AMX) and fp32 otherwise. Torch intra-op threads and dataloader workers are
+        set from the cores the process may run on, whatever num_proc is set to for tokenization.
+
+        Parameters:
+            gradient_checkpointing (bool): Whether to recompute activations in the backward pass to save memory.
+
+        Returns:
+            dict: Keyword arguments for TrainingArguments.
+        """
+
+        cores = available_cores()
+        profile = {"gradient_checkpointing": gradient_checkpointing}
+
+        if torch.cuda.is_available():
+            profile.update(fp16=True, dataloader_num_workers=min(4, cores))
+            print("training profile: GPU, fp16")
+            return profile
+
+        bf16_supported = any(
+            getattr(torch.cpu, check, lambda: False)()
+            for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+        )
+        # Leave a few cores to the dataloader workers and give the rest to torch's intra-op pool.
+        workers = min(4, cores // 8)
+        torch.set_num_threads(max(1, cores - workers))
+
+        profile.update(use_cpu=True, fp16=False, bf16=bf16_supported, dataloader_num_workers=workers)
+        print(f"training profile: CPU, {'bf16' if bf16_supported else 'fp32'}, "
+              f"{torch.get_num_threads()} torch threads, {workers} dataloader workers"
+              f"{', gradient checkpointing' if gradient_checkpointing else ''}")
+        return profile
+
+
+    def train_model(self, output_dir="./GPTtrained", num_train_epochs=3, batch_size = 4, group_by_length=False,
+                    gradient_checkpointing=False):
 
         """
         Configures training arguments and data collator for language modeling, initializes a Trainer, and trains the model.
@@ -192,12 +627,22 @@ class DataPreparer:
             output_dir (str): Directory to save the trained model and tokenizer.
             num_train_epochs (int): Number of training epochs.
             batch_size (int): Training batch size.
+            group_by_length (bool): Whether to batch examples of similar length together (length-grouped sampler)
+                so each batch pads to a similar length, instead of random order.
+            gradient_checkpointing (bool): Whether to trade recomputation for activation memory during training.
         """
 
 
-        data_collator = DataCollatorForLanguageModeling(tokenizer=self.tokenizer, mlm=False)
+        data_collator = transformers.DataCollatorForLanguageModeling(tokenizer=self.tokenizer, mlm=False)
+        profile = self.hardware_profile(gradient_checkpointing=gradient_checkpointing)
+
+        if gradient_checkpointing:
+            self.model.config.use_cache = False
+            if self.use_lora:
+                # The frozen embeddings produce no grad, which checkpointed LoRA layers need to backpropagate.
+                self.model.enable_input_require_grads()
 
-        training_args = TrainingArguments(
+        training_args = transformers.TrainingArguments(
             output_dir=output_dir,
             evaluation_strategy="epoch",
             save_strategy="steps", 
@@ -210,10 +655,12 @@ class DataPreparer:
             logging_steps=50,
             save_steps=100,
             save_total_limit=3,
-            fp16=True,
+            group_by_length=group_by_length,
+            length_column_name="length",
+            **profile,
         )
 
-        trainer = Trainer(
+        trainer = token_counting_trainer_class()(
             model=self.model,
             args=training_args,
             train_dataset=self.train_dataset_tokenized,
@@ -222,8 +669,9 @@ class DataPreparer:
         )
 
         print("Starting training...")
-        trainer.train()
+        train_result = trainer.train()
         print("Training complete.")
+        trainer.report_throughput(train_result.metrics.get("train_runtime"))
             
         trainer.save_model(f"{output_dir}/final_model")
         self.tokenizer.save_pretrained(f"{output_dir}/final_model")
@@ -1,159 +1,1201 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
-import torch
-from peft import get_peft_model, LoraConfig, TaskType, PeftModel  # If using LoRA
+import copy
+import threading
+import time
 import json
+import os
 import re
-import difflib
+from collections import OrderedDict
+from lazy_imports import LazyModule, IMPORT_TIMES
+from generation_cache import GenerationCache, checkpoint_fingerprint
+from few_shot_store import FewShotStore
+
+# Heavy dependencies are imported on first use, so importing this module (or building prompts) stays fast.
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+peft = LazyModule("peft")  # If using LoRA
+quantization = LazyModule("quantization")
+shared_weights = LazyModule("shared_weights")
+speculative = LazyModule("speculative")
+
+
+# Text that starts the next few-shot turn or record; decoding stops once the answer reaches one of these.
+ANSWER_DELIMITERS = ["User Question:", "Question:", "<SEP>"]
+
+# Written into a merged checkpoint: the fingerprint of the adapter it was merged from (see merged_checkpoint_current).
+MERGED_ADAPTER_FILE = "merged_from_adapter.txt"
+
+# End of the example part of a few-shot prompt; the user's question follows (see few_shot_prefix).
+FEW_SHOT_QUESTION = "\n\nUser Question:"
+
+# Decoding settings of generate_text and generate_batch when none are given. The result cache is keyed on the
+# settings in full, so the worker pool fills in the same defaults before looking up generate_batch results.
+GENERATION_DEFAULTS = {"max_length": 600, "num_beams": 5, "length_penalty": 2.0, "no_repeat_ngram_size": 3,
+                       "max_new_tokens": None, "stop_at_delimiter": True}
+
+# generate_text settings per prompt category (see detect_category). Definitions are one or two sentences, so they get
+# two beams, a short answer budget and no length bonus. Introductions keep five beams but narrow them once the top
+# beam leads by beam_margin (summed log-probability).
+DECODING_PROFILES = {
+    "Introduction": {"max_length": 600, "num_beams": 5, "length_penalty": 2.0, "no_repeat_ngram_size": 3,
+                     "beam_margin": 4.0},
+    "Definition": {"max_length": 600, "max_new_tokens": 96, "num_beams": 2, "length_penalty": 1.0,
+                   "no_repeat_ngram_size": 3},
+    None: {"max_length": 600, "num_beams": 5, "length_penalty": 2.0, "no_repeat_ngram_size": 3},
+}
+
+
+class AnswerDelimiterCriteria:
+
+    def __init__(self, tokenizer, prompt_length, delimiters=ANSWER_DELIMITERS):
+
+        """
+        Stopping criterion for generate: stop a sequence once its generated tokens contain one of the delimiters.
+        It follows transformers' StoppingCriteria interface without subclassing it, so transformers is not needed
+        to import this module. A sequence stays flagged on every later step, so beam search, which may stop only
+        once all beams are flagged, sees beams that hit a delimiter at different steps as stopped.
+
+        Parameters:
+            tokenizer: The tokenizer used to decode the generated tokens.
+            prompt_length (int): Number of prompt (and padding) tokens at the start of every sequence.
+            delimiters (list): Delimiter strings.
+        """
+
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.delimiters = delimiters
+        # Only the last few tokens are decoded each step: enough to hold the longest delimiter and the token before it.
+        self.window = max(len(tokenizer(d).input_ids) for d in delimiters) + 1
+        # Generated tokens of the sequences seen reaching a delimiter, and their lengths.
+        self.stopped = set()
+        self.stopped_lengths = set()
+
+
+    def __call__(self, input_ids, scores, **kwargs):
+        start = max(self.prompt_length, input_ids.shape[1] - self.window)
+        tails = self.tokenizer.batch_decode(input_ids[:, start:], skip_special_tokens=True)
+        hits = []
+        for generated, tail in zip(input_ids[:, self.prompt_length:].tolist(), tails):
+            # Beams are reordered between steps, so an earlier hit is found by the sequence's tokens, not its row.
+            if any(tuple(generated[:n]) in self.stopped for n in self.stopped_lengths):
+                hits.append(True)
+            elif any(d in tail for d in self.delimiters):
+                self.stopped.add(tuple(generated))
+                self.stopped_lengths.add(len(generated))
+                hits.append(True)
+            else:
+                hits.append(False)
+        return torch.tensor(hits, device=input_ids.device)
+
+
+def cut_stream_at_delimiter(pieces, delimiters=ANSWER_DELIMITERS):
+
+    """
+    Pass streamed pieces of generated text on up to the first answer delimiter, as cut_at_delimiter does for
+    a whole text. Text that may be the start of a delimiter, and the whitespace before it, is held back until
+    the following pieces show whether it is one.
+
+    Yields:
+        str: Text pieces; together they are the generated text cut before the first delimiter.
+    """
+
+    text, sent = "", 0
+    for piece in pieces:
+        text += piece
+        positions = [p for p in (text.find(d) for d in delimiters) if p != -1]
+        if positions:
+            end = len(text[:min(positions)].rstrip())
+            if end > sent:
+                yield text[sent:end]
+            return
+        held = max((k for d in delimiters for k in range(1, len(d)) if text.endswith(d[:k])), default=0)
+        end = len(text[:len(text) - held].rstrip())
+        if end > sent:
+            yield text[sent:end]
+            sent = end
+    if len(text) > sent:
+        yield text[sent:]
+
+
+def stage_time(start, imported):
+
+    """
+    Seconds since start, minus the time spent meanwhile on the first use of lazily imported modules
+    (imported is the IMPORT_TIMES total at start), which startup_report lists separately.
+    """
+
+    return time.perf_counter() - start - (sum(IMPORT_TIMES.values()) - imported)
 
 
 class TextGenerator:
 
-    def __init__(self, model_dir = "./GPTtrained/final_model", base_model_dir="./GPT-2"):
+    def __init__(self, model_dir = "./GPTtrained/final_model", base_model_dir="./GPT-2", merged_model_dir=None, merge=False,
+                 cache_path=None, cache_size=10000, cache_ttl=None, prefix_cache_size=32,
+                 few_shot_dir="./prompt resources", few_shot_poll_interval=2.0, min_new_tokens=64, quantize=False,
+                 lazy_load=False, shared_weights_path=None, draft_layers=4, draft_tokens=4):
 
         """
         Loads the tokenizer from the fine-tuned model, ensuring it contains a PAD token, then loads the base model
         and resizes its token embeddings to match the tokenizer. Finally, it loads the PEFT adapter onto the base model.
 
+        With merge=True the LoRA weights are folded into the base model once, so generation runs plain GPT-2 layers.
+        If merged_model_dir is given, the merged checkpoint is saved there and loaded directly on later starts.
+
         Parameters:
             model_dir (str): Directory containing the fine-tuned model and adapter.
             base_model_dir (str): Directory containing the base language model (e.g., GPT-2).
+            merged_model_dir (str): Directory of the merged checkpoint, loaded if it exists and written otherwise.
+            merge (bool): Whether to merge the adapter into the base model.
+            cache_path (str): SQLite file for caching generated text across runs, or None to disable the cache.
+            cache_size (int): Maximum number of cached results.
+            cache_ttl (float): Seconds a cached result stays valid, or None for no expiry.
+            prefix_cache_size (int): Number of few-shot prefixes whose key/value cache is kept in memory, or 0 to
+                                     encode every prompt in full.
+            few_shot_dir (str): Directory of the few-shot files, loaded once and reloaded when a file changes.
+            few_shot_poll_interval (float): Seconds between checks for changed few-shot files, or None to disable reloading.
+            min_new_tokens (int): Tokens of every max_length budget kept free for the answer; longer prompts are
+                                  trimmed from the start.
+            quantize (bool): Whether to run an int8 dynamically quantised copy of the merged model on the CPU.
+                             It is cached next to the merged checkpoint, so later starts skip the conversion.
+            lazy_load (bool): Whether to defer loading the tokenizer and weights until they are first needed.
+            shared_weights_path (str): File written by shared_weights.save_shared_weights. If given, the model's weights
+                                       are memory-mapped from it, so processes loading the same file share them.
+            draft_layers (int): Transformer blocks of the base model kept in the draft model used by speculative decoding.
+            draft_tokens (int): Tokens the draft model proposes per pass of the fine-tuned model.
         """
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model_dir = model_dir
+        self.base_model_dir = base_model_dir
+        self.merged_model_dir = merged_model_dir
+        self.merge = merge
+        self.quantize = quantize
+        self.shared_weights_path = shared_weights_path
 
-        # Ensure the tokenizer has a PAD token; if not, add it.
-        if self.tokenizer.pad_token is None or self.tokenizer.pad_token != "<PAD>":
-            self.tokenizer.add_special_tokens({"pad_token": "<PAD>"})
-            self.tokenizer.pad_token_id = self.tokenizer.convert_tokens_to_ids("<PAD>")
-            
-        # Load the base model. This should be the same model you started with.
-        self.base_model = AutoModelForCausalLM.from_pretrained(base_model_dir, local_files_only=True)
-        self.base_model.resize_token_embeddings(len(self.tokenizer))
-        
-        # Load the PEFT adapter onto the base model.
-        self.model = PeftModel.from_pretrained(self.base_model, model_dir)
+        self._tokenizer = None
+        self._model = None
+        self.base_model = None
+        self.load_lock = threading.Lock()
+        # Seconds spent loading the tokenizer and weights, and on the first generated token; see startup_report.
+        self.startup_times = {}
+
+        # Generation is deterministic, so results are cached per normalised prompt, decoding params and checkpoint.
+        self.cache = None
+        if cache_path:
+            checkpoint = checkpoint_fingerprint(model_dir if os.path.isdir(model_dir) else merged_model_dir)
+            if quantize:
+                # int8 outputs can differ from fp32, so they are cached separately.
+                checkpoint += ":int8"
+            self.cache = GenerationCache(cache_path, checkpoint=checkpoint, max_entries=cache_size, ttl=cache_ttl)
+
+        # Few-shot prefix text -> (prefix token ids, key/value cache of the prefix), least recently used first.
+        # Filled when prompts are generated, not built; shared by the server's handler threads.
+        self.prefix_cache = OrderedDict()
+        self.prefix_cache_size = prefix_cache_size
+        self.prefix_lock = threading.Lock()
+
+        # Every few-shot category is preloaded, so building a prompt does no disk I/O.
+        self.few_shot_store = FewShotStore(few_shot_dir, poll_interval=few_shot_poll_interval)
+        self.min_new_tokens = min_new_tokens
+
+        # Decoded tokens per request against the new-token budget, for reporting the savings of the delimiter stop.
+        self.decode_stats = {"requests": 0, "new_tokens": 0, "token_budget": 0, "stopped_on_delimiter": 0, "tokens_saved": 0}
+        self.last_decode = None
+
+        # Draft model for speculative decoding, built from base_model_dir on first use.
+        self.draft_layers = draft_layers
+        self.draft_tokens = draft_tokens
+        self._draft_model = None
+        self.speculative_stats = {"requests": 0, "drafted": 0, "accepted": 0, "target_passes": 0, "new_tokens": 0}
+
+        # Decoding steps and beams advanced over them, for adaptive beam search.
+        self.beam_stats = {"requests": 0, "steps": 0, "beam_steps": 0, "narrowed": 0}
+        self.last_beam = None
 
         self.legal_data = None
 
+        if not lazy_load:
+            self.load()
+
 
-    def load_few_shot_examples(self, example_file):
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self.load_tokenizer()
+        return self._tokenizer
 
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+
+    def load_tokenizer(self):
+
+        """
+        Load the tokenizer, once, ensuring it has a PAD token. Prompts can be built without loading the weights.
         """
-        Load few-shot examples from a text file.
 
-        Few-shot examples are expected to be separated by two newlines.
+        with self.load_lock:
+            if self._tokenizer is not None:
+                return
+
+            start, imported = time.perf_counter(), sum(IMPORT_TIMES.values())
+            tokenizer = transformers.AutoTokenizer.from_pretrained(self.model_dir)
+
+            # Ensure the tokenizer has a PAD token; if not, add it.
+            if tokenizer.pad_token is None or tokenizer.pad_token != "<PAD>":
+                tokenizer.add_special_tokens({"pad_token": "<PAD>"})
+                tokenizer.pad_token_id = tokenizer.convert_tokens_to_ids("<PAD>")
+            self.startup_times["tokenizer"] = stage_time(start, imported)
+            self._tokenizer = tokenizer
+
+
+    def load(self):
+
+        """
+        Load the tokenizer and the model weights, once. Called from __init__, or on first use with lazy_load=True.
+
+        Weights are read from safetensors files, which are memory-mapped, with low_cpu_mem_usage so no randomly
+        initialised copy of the model is built first.
+        """
+
+        self.load_tokenizer()
+        tokenizer = self._tokenizer
+        with self.load_lock:
+            if self._model is not None:
+                return
+
+            start, imported = time.perf_counter(), sum(IMPORT_TIMES.values())
+            load_kwargs = {"local_files_only": True, "low_cpu_mem_usage": True}
+            merged_model_dir = self.merged_model_dir
+
+            if self.shared_weights_path:
+                # Read-only views of a file another process wrote; see generation_workers.
+                model = shared_weights.load_shared_model(self.shared_weights_path)
+            elif self.merged_checkpoint_current():
+                # The merged checkpoint already has the resized embeddings and the adapter folded in.
+                load_merged = lambda: transformers.AutoModelForCausalLM.from_pretrained(merged_model_dir, **load_kwargs)
+                if self.quantize:
+                    # The fp32 weights are only read when the int8 cache has to be built.
+                    self.base_model = quantization.load_quantized(merged_model_dir, load_merged)
+                else:
+                    self.base_model = load_merged()
+                model = self.base_model
+            else:
+                # Load the base model. This should be the same model you started with.
+                self.base_model = transformers.AutoModelForCausalLM.from_pretrained(self.base_model_dir, **load_kwargs)
+                self.base_model.resize_token_embeddings(len(tokenizer))
+
+                # Load the PEFT adapter onto the base model.
+                model = peft.PeftModel.from_pretrained(self.base_model, self.model_dir)
+
+                if self.merge or merged_model_dir:
+                    model = model.merge_and_unload()
+                    if merged_model_dir:
+                        if os.path.isdir(merged_model_dir):
+                            print(f"{merged_model_dir} was not merged from the adapter in {self.model_dir}; rebuilding it")
+                        model.save_pretrained(merged_model_dir, safe_serialization=True)
+                        tokenizer.save_pretrained(merged_model_dir)
+                        with open(os.path.join(merged_model_dir, MERGED_ADAPTER_FILE), "w", encoding="utf-8") as f:
+                            f.write(checkpoint_fingerprint(self.model_dir))
+
+                if self.quantize:
+                    # Quantisation works on plain linear layers, so the adapter is folded in first.
+                    if isinstance(model, peft.PeftModel):
+                        model = model.merge_and_unload()
+                    merged = model
+                    if merged_model_dir:
+                        model = quantization.load_quantized(merged_model_dir, lambda: merged)
+                    else:
+                        model = quantization.quantize_int8(merged)
+
+            model.eval()
+            self.startup_times["weights"] = stage_time(start, imported)
+            self._model = model
+
+
+    def merged_checkpoint_current(self):
+
+        """
+        Whether merged_model_dir holds a merged checkpoint built from the adapter now in model_dir. Merging records
+        the adapter's fingerprint there, so a retrained adapter makes load() rebuild the merged checkpoint (and,
+        as their file names fingerprint the merged weights, the int8 and shared-weight files) instead of serving
+        the old weights. Without an adapter in model_dir, an existing merged checkpoint is used as it is.
+        """
+
+        merged_model_dir = self.merged_model_dir
+        if not merged_model_dir or not os.path.isdir(merged_model_dir):
+            return False
+        if not os.path.exists(os.path.join(self.model_dir, "adapter_config.json")):
+            return True
+        try:
+            with open(os.path.join(merged_model_dir, MERGED_ADAPTER_FILE), encoding="utf-8") as f:
+                merged_from = f.read().strip()
+        except FileNotFoundError:
+            merged_from = None
+        return merged_from == checkpoint_fingerprint(self.model_dir)
+
+
+    def unload(self):
+
+        """
+        Release the model weights, keeping the tokenizer. They are loaded again if the model is used.
+        """
+
+        with self.load_lock:
+            self._model = None
+            self.base_model = None
+
+
+    def startup_report(self, prompt="User Question: What is UK law?\nAnswer:"):
+
+        """
+        Measure the time to the first generated token and print the start-up costs: importing the heavy modules,
+        loading the tokenizer and weights, and the first token.
+
+        Returns:
+            dict: Seconds per stage.
+        """
+
+        self.model   # loads the weights if lazy_load deferred them
+        start = time.perf_counter()
+        inputs = self.tokenizer(prompt, return_tensors="pt")
+        with torch.inference_mode():
+            self.model.generate(**inputs, max_new_tokens=1, do_sample=False, pad_token_id=self.tokenizer.pad_token_id)
+        self.startup_times["first_token"] = time.perf_counter() - start
+
+        report = {"import": sum(IMPORT_TIMES.values()), **self.startup_times}
+        imports = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in IMPORT_TIMES.items())
+        print(f"import:      {report['import']:.2f}s ({imports or 'already imported'})")
+        print(f"tokenizer:   {report.get('tokenizer', 0.0):.2f}s")
+        print(f"weights:     {report.get('weights', 0.0):.2f}s")
+        print(f"first token: {report['first_token']:.2f}s")
+        return report
+
+
+    def detect_category(self, prompt):
+
+        """
+        Find the category that the prompt falls under.
 
         Parameters:
-            example_file (str): Path to the text file containing few-shot examples.
+            prompt (str): The prompt provided by the user.
 
         Returns:
-            list: A list of few-shot example strings.
+            str or None: "Introduction", "Definition", or None if neither keyword appears.
         """
 
-        with open(example_file, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
+        lower_prompt = prompt.lower()
+        if "introduction" in lower_prompt:
+            return "Introduction"
+        elif "definition" in lower_prompt:
+            return "Definition"
+        return None
 
-        examples = content.split("\n\n")
-        return examples
-    
 
-    def find_closest_example(self, user_prompt, examples):
+    def decoding_profile(self, category):
 
         """
-        The method extracts the first sentence of the user prompt and compares it with the question part
-        (after "Question:") in each example using a similarity ratio. The example with the highest similarity is returned.
+        Return the generate_text settings for a category from detect_category, as a new dict.
+        Unrecognised categories get the original defaults.
+        """
+
+        return dict(DECODING_PROFILES.get(category, DECODING_PROFILES[None]))
+
+
+    def build_few_shot_prompt(self, prompt, max_length=600, max_examples=3, input_budget=None):
+
+        """
+        Construct the few-shot prompt by packing the closest examples of the prompt's category in front of the user's
+        question, as many as fit the input-token budget. The budget is max_length minus min_new_tokens (or
+        input_budget if that is smaller), so the prompt always leaves room for the answer. Examples are added in
+        order of similarity and placed with the closest one next to the question.
 
         Parameters:
-            user_prompt (str): The prompt provided by the user.
-            examples (list): List of few-shot examples.
+            prompt (str): The prompt provided by the user.
+            max_length (int): The max_length the prompt will be generated with.
+            max_examples (int): Maximum number of examples to include.
+            input_budget (int): Optional tighter limit on the prompt's token count.
 
         Returns:
-            str or None: The closest matching example, or None if no match is found.
+            str: The few-shot prompt ending in "Answer:".
         """
 
-        
-        # Extract the first sentence (everything up to the first period)
-        first_sentence = user_prompt.split(".")[0].strip()
-        best_example = None
-        best_ratio = 0
-        for ex in examples:
-            # Look for the "Question:" line in each example.
-            for line in ex.split("\n"):
-                if line.startswith("Question:"):
-                    question_line = line[len("Question:"):].strip()
-                    # Compare only the first sentence of the user prompt with the example question.
-                    ratio = difflib.SequenceMatcher(None, first_sentence.lower(), question_line.lower()).ratio()
-
-                    if ratio > best_ratio:
-                        best_ratio = ratio
-                        best_example = ex
-                    break  # Only consider the first question line in each example
-        return best_example
-    
-    
-     
-    def few_shot_files(self, category):
+        question = "User Question: " + prompt + "\nAnswer:"
+
+        #Retrieve the preloaded few-shot examples for the prompt's category.
+        category = self.few_shot_store.get(self.detect_category(prompt))
+        if category is None or max_examples < 1:
+            return question
+
+        #Look up the closest examples in the category's index, matching on the prompt's first sentence.
+        first_sentence = prompt.split(".")[0].strip()
+        closest = category.index.closest(first_sentence)
+        if closest is None:
+            return question
+        candidates = [closest] + [ex for ex, _ in category.index.search(first_sentence, k=max_examples + 1)
+                                  if ex != closest][:max_examples - 1]
+
+        budget = max_length - self.min_new_tokens
+        if input_budget is not None:
+            budget = min(budget, input_budget)
+
+        # Token counts of the pieces add up (up to a token at the seams), so pack by the cached counts,
+        # then check the assembled prompt and drop the least similar example while it is over budget.
+        used = self.token_length(question)
+        separator = self.token_length("\n\n")
+        selected = []
+        for ex in candidates:
+            if ex not in category.token_lengths:
+                category.token_lengths[ex] = self.token_length(ex)
+            if used + category.token_lengths[ex] + separator <= budget:
+                selected.append(ex)
+                used += category.token_lengths[ex] + separator
+
+        while selected:
+            prefix = self.few_shot_prefix("\n\n".join(reversed(selected)))
+            few_shot_prompt = prefix + " " + prompt + "\nAnswer:"
+            if self.token_length(few_shot_prompt) <= budget:
+                return few_shot_prompt
+            selected.pop()
+        return question
+
+
+    def token_length(self, text):
 
         """
-        Return the file path for few-shot examples based on the provided category.
+        Return the number of tokens in a text.
+        """
+
+        return len(self.tokenizer(text).input_ids)
+
+
+    def input_limit(self, max_length, max_new_tokens=None):
+
+        """
+        Return the longest prompt, in tokens, that leaves room for the answer: max_length minus min_new_tokens,
+        or with max_new_tokens the model's context size minus max_new_tokens.
+        """
+
+        if max_new_tokens is not None:
+            context = getattr(self.model.config, "n_positions", None) or self.model.config.max_position_embeddings
+            return max(1, context - max_new_tokens)
+        return max(1, max_length - self.min_new_tokens)
+
+
+    def encode_prompt(self, prompt, max_length, max_new_tokens=None):
+
+        """
+        Tokenize a prompt for generation. A prompt longer than input_limit is trimmed from the start,
+        so the question and the trailing "Answer:" are kept.
+
+        Returns:
+            BatchEncoding: input_ids and attention_mask tensors of shape (1, length).
+        """
+
+        inputs = self.tokenizer(prompt, return_tensors="pt")
+        limit = self.input_limit(max_length, max_new_tokens)
+        if inputs.input_ids.shape[1] > limit:
+            inputs["input_ids"] = inputs.input_ids[:, -limit:]
+            inputs["attention_mask"] = inputs.attention_mask[:, -limit:]
+        return inputs
+
+
+    def cut_at_delimiter(self, output_ids, prompt_length):
+
+        """
+        Decode a generated sequence and drop everything from the first answer delimiter after the prompt onwards.
 
         Parameters:
-            category (str): The category of the prompt (e.g., "introduction" or "definition").
+            output_ids (torch.Tensor): One generated sequence, prompt (and padding) included.
+            prompt_length (int): Number of prompt and padding tokens at its start.
 
         Returns:
-            str or None: File path for the corresponding few-shot examples, or None if the category is unrecognized.
+            tuple: (decoded text, True if a delimiter was found and cut)
         """
 
-        if category:
-            if category.lower() == "introduction":
-                return "./prompt resources/Intro-prompts.txt"
-            elif category.lower() == "definition":
-                return"./prompt resources/definition-prompts.txt"       
-            else:
-                return
+        text = self.tokenizer.decode(output_ids, skip_special_tokens=True)
+        prompt_text = self.tokenizer.decode(output_ids[:prompt_length], skip_special_tokens=True)
+        if not text.startswith(prompt_text):
+            return text, False
+
+        positions = [text.find(d, len(prompt_text)) for d in ANSWER_DELIMITERS]
+        positions = [p for p in positions if p != -1]
+        if not positions:
+            return text, False
+        return text[:min(positions)].rstrip(), True
+
+
+    def record_decode(self, new_tokens, token_budget, stopped):
+
+        """
+        Count the tokens decoded for one request. When the delimiter stop ended decoding, the rest of the
+        new-token budget is counted as saved (an upper bound: the model might have emitted EOS sooner).
+        """
+
+        saved = token_budget - new_tokens if stopped else 0
+        self.last_decode = {"new_tokens": new_tokens, "token_budget": token_budget,
+                            "stopped_on_delimiter": stopped, "tokens_saved": saved}
+        self.decode_stats["requests"] += 1
+        self.decode_stats["new_tokens"] += new_tokens
+        self.decode_stats["token_budget"] += token_budget
+        self.decode_stats["stopped_on_delimiter"] += int(stopped)
+        self.decode_stats["tokens_saved"] += saved
+
+
+    def few_shot_prefix(self, example):
+
+        """
+        Return the part of a few-shot prompt that depends only on the example. It ends right after
+        "User Question:" so that the space before the user's question starts the first token of the suffix.
+        """
+
+        return example + FEW_SHOT_QUESTION
+
+
+    def cache_prefix(self, prefix, prefix_ids):
+
+        """
+        Run a few-shot prefix through the model once and keep its key/value cache, so later prompts starting
+        with this prefix only need the user-question suffix encoded. The least recently used prefix is dropped
+        once prefix_cache_size are kept.
+
+        Parameters:
+            prefix (str): The prefix text, usually from few_shot_prefix.
+            prefix_ids (torch.Tensor): Token ids of the prefix, shape (length,).
+
+        Returns:
+            tuple: (prefix token ids, key/value cache of the prefix)
+        """
+
+        # The forward pass runs outside the lock; two threads may encode the same new prefix, which is harmless.
+        with torch.inference_mode():
+            outputs = self.model(input_ids=prefix_ids[None, :], past_key_values=transformers.DynamicCache(), use_cache=True)
+
+        entry = (prefix_ids, outputs.past_key_values)
+        with self.prefix_lock:
+            self.prefix_cache[prefix] = entry
+            self.prefix_cache.move_to_end(prefix)
+            while len(self.prefix_cache) > self.prefix_cache_size:
+                self.prefix_cache.popitem(last=False)
+        return entry
+
+
+    def prefix_past(self, prompt, input_ids, num_beams=1):
+
+        """
+        Return a private copy of the key/value cache of the prompt's few-shot prefix (everything up to the
+        "User Question:" before the user's question), repeated once per beam, to pass to generate as
+        past_key_values. The prefix is encoded and cached the first time a prompt with it is generated.
+
+        The cache is only used when the prompt's token ids start with the prefix's token ids, so the
+        output is the same as encoding the whole prompt.
+
+        Parameters:
+            prompt (str): The full prompt.
+            input_ids (torch.Tensor): Token ids of the full prompt, shape (1, length).
+            num_beams (int): Number of beams generate will run.
+
+        Returns:
+            DynamicCache or None: The prefix cache, or None if the prompt has no usable prefix.
+        """
+
+        end = prompt.rfind(FEW_SHOT_QUESTION)
+        # Nothing is encoded for a generator whose weights are not loaded, e.g. one that only builds prompts.
+        if end == -1 or not self.prefix_cache_size or self._model is None:
+            return None
+        prefix = prompt[:end + len(FEW_SHOT_QUESTION)]
+
+        with self.prefix_lock:
+            entry = self.prefix_cache.get(prefix)
+            if entry is not None:
+                self.prefix_cache.move_to_end(prefix)
+        prefix_ids = entry[0] if entry is not None else self.tokenizer(prefix, return_tensors="pt").input_ids[0]
+
+        length = prefix_ids.shape[0]
+        # At least one token has to be left for generate to encode. A prompt trimmed from the start by
+        # encode_prompt, or one whose tokens merge across the boundary, does not match.
+        if input_ids.shape[1] <= length or not torch.equal(input_ids[0, :length], prefix_ids):
+            return None
+
+        if entry is None:
+            entry = self.cache_prefix(prefix, prefix_ids)
+        # generate extends the cache in place, so the stored one is copied.
+        past = copy.deepcopy(entry[1])
+        if num_beams > 1:
+            past.batch_repeat_interleave(num_beams)
+        return past
 
                 
-    def generate_text(self, prompt, max_length=600, num_beams=5, length_penalty=2.0, no_repeat_ngram_size=3):
+    @property
+    def draft_model(self):
+        if self._draft_model is None:
+            with self.load_lock:
+                if self._draft_model is None:
+                    vocab_size = self.model.get_input_embeddings().num_embeddings
+                    self._draft_model = speculative.build_draft_model(self.base_model_dir, self.draft_layers, vocab_size)
+        return self._draft_model
+
+
+    def generate_speculative(self, input_ids, max_new_tokens, no_repeat_ngram_size=3, stopping_criteria=None,
+                             past_key_values=None):
+
+        """
+        Greedy decoding with the draft model proposing tokens and the fine-tuned model verifying them, see
+        speculative.speculative_greedy. The output matches greedy generate; acceptance counts are added to
+        self.speculative_stats.
+
+        Returns:
+            torch.Tensor: The output ids, prompt included, shape (1, length).
+        """
+
+        logits_processor = transformers.LogitsProcessorList()
+        if no_repeat_ngram_size:
+            logits_processor.append(transformers.NoRepeatNGramLogitsProcessor(no_repeat_ngram_size))
+        with torch.inference_mode():
+            output_ids, stats = speculative.speculative_greedy(
+                self.model, self.draft_model, input_ids, max_new_tokens, num_draft_tokens=self.draft_tokens,
+                logits_processor=logits_processor, stopping_criteria=stopping_criteria,
+                eos_token_id=self.model.generation_config.eos_token_id, past_key_values=past_key_values)
+
+        stats["requests"] = 1
+        stats["new_tokens"] = output_ids.shape[1] - input_ids.shape[1]
+        for key, value in stats.items():
+            self.speculative_stats[key] += value
+        return output_ids
+
+
+    def speculative_report(self):
+
+        """
+        Return the share of draft tokens the fine-tuned model accepted and the tokens generated per pass of it
+        (1.0 without speculation), over all speculative requests so far.
+        """
+
+        stats = self.speculative_stats
+        return {
+            "acceptance_rate": stats["accepted"] / stats["drafted"] if stats["drafted"] else None,
+            "tokens_per_target_pass": stats["new_tokens"] / stats["target_passes"] if stats["target_passes"] else None,
+            **stats,
+        }
+
+
+    def generate_text(self, prompt, max_length=GENERATION_DEFAULTS["max_length"], num_beams=GENERATION_DEFAULTS["num_beams"],
+                      length_penalty=GENERATION_DEFAULTS["length_penalty"],
+                      no_repeat_ngram_size=GENERATION_DEFAULTS["no_repeat_ngram_size"],
+                      max_new_tokens=GENERATION_DEFAULTS["max_new_tokens"],
+                      stop_at_delimiter=GENERATION_DEFAULTS["stop_at_delimiter"], speculative=False, beam_margin=None,
+                      min_beams=1):
 
         """
         Generate text from the model based on the provided prompt using beam search.
 
         Parameters:
             prompt (str): The input prompt for text generation.
-            max_length (int): Maximum length of the generated text.
+            max_length (int): Maximum length of the generated text, prompt included.
             num_beams (int): Number of beams for beam search.
             length_penalty (float): Penalty to encourage longer outputs.
             no_repeat_ngram_size (int): Prevents repetition of n-grams of this size.
+            max_new_tokens (int): If given, the number of tokens to generate after the prompt, used instead of max_length.
+            stop_at_delimiter (bool): Whether to stop once the answer reaches "Question:", "User Question:" or "<SEP>",
+                                      and cut the text there.
+            speculative (bool): Whether to decode greedily with the draft model proposing tokens (see
+                                generate_speculative). Requires num_beams=1; the text is the same as without it.
+            beam_margin (float): If given, beam search drops beams trailing the top beam by more than this summed
+                                 log-probability (see adaptive_beam_search).
+            min_beams (int): The fewest beams adaptive beam search narrows to.
 
         Returns:
             str: The generated text.
         """
 
-        #Tokenize the input prompt and convert it to tensors.
-        inputs = self.tokenizer(prompt, return_tensors="pt", padding=True, truncation=True)
+        if speculative and num_beams != 1:
+            raise ValueError("speculative decoding reproduces greedy decoding; use num_beams=1")
+
+        # speculative is not part of the key: it gives the same text as plain greedy decoding.
+        params = {"max_length": max_length, "num_beams": num_beams, "length_penalty": length_penalty,
+                  "no_repeat_ngram_size": no_repeat_ngram_size, "max_new_tokens": max_new_tokens,
+                  "stop_at_delimiter": stop_at_delimiter}
+        if beam_margin is not None:
+            params.update(beam_margin=beam_margin, min_beams=min_beams)
+        if self.cache is not None:
+            cached = self.cache.get(prompt, params)
+            if cached is not None:
+                return cached
+
+        #Tokenize the input prompt and convert it to tensors, leaving room for the answer.
+        inputs = self.encode_prompt(prompt, max_length, max_new_tokens)
         input_ids = inputs.input_ids
         attention_mask = inputs.attention_mask
-                                 
-        output_ids = self.model.generate(
-            input_ids,
-            attention_mask=attention_mask,
-            max_length = max_length,
-            num_beams=num_beams,
-            length_penalty=length_penalty,     # Encourages longer outputs
-            no_repeat_ngram_size=no_repeat_ngram_size,
-            early_stopping=True,  
-            do_sample = False,
-            pad_token_id = self.tokenizer.pad_token_id
-        )
+        prompt_length = input_ids.shape[1]
+
+        # Reuse the key/value cache of a few-shot prefix so only the user-question suffix is encoded.
+        # adaptive_beam_search expands the cache to its beams itself.
+        past_key_values = self.prefix_past(prompt, input_ids, 1 if beam_margin is not None else num_beams)
+
+        # max_new_tokens bounds the answer itself; max_length also counts the prompt.
+        if max_new_tokens is not None:
+            length_kwargs = {"max_new_tokens": max_new_tokens}
+        else:
+            length_kwargs = {"max_length": max_length}
+        stopping_criteria = None
+        if stop_at_delimiter:
+            stopping_criteria = transformers.StoppingCriteriaList([AnswerDelimiterCriteria(self.tokenizer, prompt_length)])
+
+        token_budget = max_new_tokens if max_new_tokens is not None else max_length - prompt_length
+        if speculative:
+            output_ids = self.generate_speculative(input_ids, token_budget, no_repeat_ngram_size, stopping_criteria,
+                                                   past_key_values)
+        elif beam_margin is not None and num_beams > 1:
+            output_ids = self.adaptive_beam_search(input_ids, token_budget, num_beams, length_penalty,
+                                                   no_repeat_ngram_size, beam_margin, min_beams, stopping_criteria,
+                                                   past_key_values)
+        else:
+            with torch.inference_mode():
+                output_ids = self.model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    num_beams=num_beams,
+                    length_penalty=length_penalty,     # Encourages longer outputs
+                    no_repeat_ngram_size=no_repeat_ngram_size,
+                    early_stopping=True,  
+                    do_sample = False,
+                    pad_token_id = self.tokenizer.pad_token_id,
+                    stopping_criteria=stopping_criteria,
+                    **length_kwargs
+                )
         
-        #Decode the generated tokens to a human-readable string.
-        generate_txt = self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
+        #Decode the generated tokens to a human-readable string, without the start of the next turn.
+        if stop_at_delimiter:
+            generate_txt, stopped = self.cut_at_delimiter(output_ids[0], prompt_length)
+        else:
+            generate_txt, stopped = self.tokenizer.decode(output_ids[0], skip_special_tokens=True), False
+        new_tokens = int((output_ids[0, prompt_length:] != self.tokenizer.pad_token_id).sum())
+        self.record_decode(new_tokens, token_budget, stopped)
+
+        if self.cache is not None:
+            self.cache.put(prompt, params, generate_txt)
         return generate_txt
 
+
+
+    def generate_stream(self, prompt, max_length=600, num_beams=5, length_penalty=2.0, no_repeat_ngram_size=3,
+                        max_new_tokens=None, stop_at_delimiter=True, do_sample=False, **sampling_kwargs):
+
+        """
+        Streaming variant of generate_text.
+
+        With num_beams=1 (greedy) or do_sample=True, decoding runs in a background thread and the newly generated
+        text is yielded in small pieces as tokens are produced. With beam search, each finished beam is yielded as
+        soon as it ends (on EOS, or when max_length is reached), as full text like generate_text returns.
+
+        Parameters:
+            prompt (str): The input prompt for text generation.
+            max_length (int): Maximum length of the generated text.
+            num_beams (int): Number of beams for beam search.
+            length_penalty (float): Penalty to encourage longer outputs (beam search only).
+            no_repeat_ngram_size (int): Prevents repetition of n-grams of this size.
+            max_new_tokens (int): If given, the number of tokens to generate after the prompt, used instead of max_length.
+            stop_at_delimiter (bool): Whether to stop once the answer reaches an answer delimiter, and cut the text
+                                      there, as generate_text does.
+            do_sample (bool): Whether to sample instead of greedy/beam decoding.
+            sampling_kwargs: Extra generate arguments for sampling, e.g. temperature or top_p.
+
+        Yields:
+            str: New text pieces (greedy/sampling) or finished beam texts (beam search).
+        """
+
+        if num_beams > 1 and not do_sample:
+            yield from self.stream_beams(prompt, max_length, num_beams, length_penalty, no_repeat_ngram_size,
+                                         max_new_tokens, stop_at_delimiter)
+            return
+
+        inputs = self.encode_prompt(prompt, max_length, max_new_tokens)
+        streamer = transformers.TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        if max_new_tokens is not None:
+            length_kwargs = {"max_new_tokens": max_new_tokens}
+        else:
+            length_kwargs = {"max_length": max_length}
+        stopping_criteria = None
+        if stop_at_delimiter:
+            stopping_criteria = transformers.StoppingCriteriaList([AnswerDelimiterCriteria(self.tokenizer,
+                                                                                           inputs.input_ids.shape[1])])
+        generate_kwargs = dict(
+            input_ids=inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            past_key_values=self.prefix_past(prompt, inputs.input_ids, sampling_kwargs.get("num_return_sequences", 1)),
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            stopping_criteria=stopping_criteria,
+            do_sample=do_sample,
+            pad_token_id=self.tokenizer.pad_token_id,
+            streamer=streamer,
+            **length_kwargs,
+            **sampling_kwargs,
+        )
+
+        errors = []
+
+        def run_generate():
+            # inference_mode is thread-local, so it is entered inside the worker thread.
+            try:
+                with torch.inference_mode():
+                    self.model.generate(**generate_kwargs)
+            except BaseException as error:
+                # Ends the iteration below, which would otherwise wait for text forever; the error is raised there.
+                errors.append(error)
+                streamer.end()
+
+        thread = threading.Thread(target=run_generate, daemon=True)
+        thread.start()
+        pieces = (text for text in streamer if text)
+        yield from cut_stream_at_delimiter(pieces) if stop_at_delimiter else pieces
+        # After a delimiter, the little text decoded before generation stops is read and dropped.
+        for _ in pieces:
+            pass
+        thread.join()
+        if errors:
+            raise errors[0]
+
+
+    def reorder_cache(self, past_key_values, beam_idx):
+
+        """
+        Select the key/value cache rows of the given beams, for Cache objects and legacy tuples alike.
+        """
+
+        if hasattr(past_key_values, "reorder_cache"):
+            past_key_values.reorder_cache(beam_idx)
+            return past_key_values
+        return tuple(tuple(state.index_select(0, beam_idx) for state in layer) for layer in past_key_values)
+
+
+    def beam_hypotheses(self, input_ids, max_new_tokens, num_beams=5, length_penalty=2.0, no_repeat_ngram_size=3,
+                        stopping_criteria=None, past_key_values=None, beam_margin=None, min_beams=1, stats=None):
+
+        """
+        The beam search behind stream_beams and adaptive_beam_search, yielding each hypothesis as it finishes.
+        Scoring and stopping follow generate's beam search with early_stopping=True: log-probability sum divided
+        by generated length ** length_penalty, EOS only accepted from the top width candidates, and decoding
+        ends once width hypotheses have finished since the width last changed. Decoding also ends once
+        stopping_criteria holds for every beam, or when max_new_tokens run out; the open beams are then finished
+        as they stand, best first.
+
+        With beam_margin, beams whose summed log-probability trails the top beam by more than beam_margin are
+        dropped after each step (keeping at least min_beams), and the width never grows back. Hypotheses
+        finished while the beam was wider are still yielded, but do not count towards stopping: they would
+        otherwise end the search as soon as it narrows.
+
+        Parameters:
+            input_ids (torch.Tensor): Prompt token ids, shape (1, length).
+            max_new_tokens (int): Maximum number of tokens to generate.
+            num_beams (int): Starting number of beams.
+            length_penalty (float): Exponent of the generated length the scores of finished beams are divided by.
+            no_repeat_ngram_size (int): Prevents repetition of n-grams of this size.
+            stopping_criteria: Checked after every step on all beams.
+            past_key_values (DynamicCache): Cache covering a prefix of input_ids, from prefix_past with one beam.
+            beam_margin (float): Lead in summed log-probability beyond which trailing beams are dropped, or None.
+            min_beams (int): The fewest beams to keep.
+            stats (dict): If given, receives the decoding "steps", the "beam_steps" (beams advanced over them)
+                          and the "final_width".
+
+        Yields:
+            tuple: (score, sequence) of each finished hypothesis, the sequence including the prompt.
+        """
+
+        prompt_length = input_ids.shape[1]
+        eos_token_id = self.tokenizer.eos_token_id
+        no_repeat = transformers.NoRepeatNGramLogitsProcessor(no_repeat_ngram_size) if no_repeat_ngram_size else None
+
+        def score_of(sequence, sum_logprobs):
+            return sum_logprobs / (max(1, sequence.shape[-1] - prompt_length) ** length_penalty)
+
+        width = num_beams
+        finished_at_width = 0
+        stats = stats if stats is not None else {}
+        stats.update(steps=0, beam_steps=0, final_width=width)
+        with torch.inference_mode():
+            past = past_key_values
+            cached_length = past.get_seq_length() if past is not None else 0
+            outputs = self.model(input_ids=input_ids[:, cached_length:], past_key_values=past, use_cache=True)
+            past = self.reorder_cache(outputs.past_key_values, torch.zeros(num_beams, dtype=torch.long))
+            logits = outputs.logits[:, -1, :].expand(num_beams, -1)
+            sequences = input_ids.expand(num_beams, -1)
+            # Only the first beam is live at the start, so the first step does not pick duplicates.
+            beam_scores = torch.full((num_beams,), float("-inf"))
+            beam_scores[0] = 0.0
+
+            for _ in range(max_new_tokens):
+                stats["steps"] += 1
+                stats["beam_steps"] += width
+                scores = torch.log_softmax(logits.float(), dim=-1)
+                if no_repeat is not None:
+                    scores = no_repeat(sequences, scores)
+                vocab_size = scores.shape[-1]
+                next_scores, next_tokens = torch.topk((scores + beam_scores[:, None]).view(-1), 2 * width)
+
+                beam_idx, beam_tokens, new_scores = [], [], []
+                for rank, (score, flat_token) in enumerate(zip(next_scores.tolist(), next_tokens.tolist())):
+                    beam, token = divmod(flat_token, vocab_size)
+                    if eos_token_id is not None and token == eos_token_id:
+                        if rank < width:
+                            finished_at_width += 1
+                            yield score_of(sequences[beam], score), sequences[beam]
+                        continue
+                    beam_idx.append(beam)
+                    beam_tokens.append(token)
+                    new_scores.append(score)
+                    if len(beam_idx) == width:
+                        break
+
+                if finished_at_width >= width:
+                    return
+
+                if beam_margin is not None:
+                    # new_scores is sorted best first, so the beams within beam_margin of the top one form a prefix.
+                    keep = max(min_beams, sum(score >= new_scores[0] - beam_margin for score in new_scores))
+                    if keep < width:
+                        width = stats["final_width"] = keep
+                        finished_at_width = 0
+                        del beam_idx[width:], beam_tokens[width:], new_scores[width:]
+
+                beam_idx = torch.tensor(beam_idx, dtype=torch.long)
+                beam_tokens = torch.tensor(beam_tokens, dtype=torch.long)
+                beam_scores = torch.tensor(new_scores)
+                sequences = torch.cat([sequences[beam_idx], beam_tokens[:, None]], dim=-1)
+                if stopping_criteria is not None and bool(stopping_criteria(sequences, None).all()):
+                    break
+
+                past = self.reorder_cache(past, beam_idx)
+                outputs = self.model(input_ids=beam_tokens[:, None], past_key_values=past, use_cache=True)
+                past = outputs.past_key_values
+                logits = outputs.logits[:, -1, :]
+
+        # Out of tokens, or every beam reached a delimiter: the open beams are finished as they stand, best first.
+        for b in torch.argsort(beam_scores, descending=True).tolist():
+            yield score_of(sequences[b], beam_scores[b].item()), sequences[b]
+
+
+    def stream_beams(self, prompt, max_length=600, num_beams=5, length_penalty=2.0, no_repeat_ngram_size=3,
+                     max_new_tokens=None, stop_at_delimiter=True):
+
+        """
+        Beam search that yields each hypothesis as soon as it is finished, scored and stopped as generate's beam
+        search with early_stopping=True is (see beam_hypotheses). A hypothesis is only yielded while it ranks
+        among the best num_beams so far. With stop_at_delimiter, decoding also stops once every beam has reached
+        an answer delimiter, and each text is cut before its first delimiter, as in generate_text.
+
+        Yields:
+            str: The decoded text (prompt included) of each finished beam, in order of completion.
+        """
+
+        input_ids = self.encode_prompt(prompt, max_length, max_new_tokens).input_ids
+        prompt_length = input_ids.shape[1]
+        token_budget = max_new_tokens if max_new_tokens is not None else max_length - prompt_length
+        stopping_criteria = AnswerDelimiterCriteria(self.tokenizer, prompt_length) if stop_at_delimiter else None
+
+        finished = []   # scores of the best num_beams hypotheses so far
+        for score, sequence in self.beam_hypotheses(input_ids, token_budget, num_beams, length_penalty,
+                                                    no_repeat_ngram_size, stopping_criteria,
+                                                    self.prefix_past(prompt, input_ids)):
+            if len(finished) < num_beams or score > finished[-1]:
+                finished.append(score)
+                finished.sort(reverse=True)
+                del finished[num_beams:]
+                if stop_at_delimiter:
+                    yield self.cut_at_delimiter(sequence, prompt_length)[0]
+                else:
+                    yield self.tokenizer.decode(sequence, skip_special_tokens=True)
+
+
+    def adaptive_beam_search(self, input_ids, max_new_tokens, num_beams=5, length_penalty=2.0, no_repeat_ngram_size=3,
+                             beam_margin=4.0, min_beams=1, stopping_criteria=None, past_key_values=None):
+
+        """
+        Beam search that narrows the beam as the search settles. After each step, beams whose summed
+        log-probability trails the top beam by more than beam_margin are dropped (keeping at least min_beams),
+        and the width never grows back; at one beam it is greedy decoding. Scoring and stopping follow
+        generate's beam search with early_stopping=True, like stream_beams, with the current width in place of
+        num_beams (see beam_hypotheses). Decoding also ends once stopping_criteria holds for every beam.
+
+        Parameters:
+            input_ids (torch.Tensor): Prompt token ids, shape (1, length).
+            max_new_tokens (int): Maximum number of tokens to generate.
+            num_beams (int): Starting number of beams.
+            length_penalty (float): Exponent of the generated length the scores of finished beams are divided by.
+            no_repeat_ngram_size (int): Prevents repetition of n-grams of this size.
+            beam_margin (float): Lead in summed log-probability beyond which trailing beams are dropped.
+            min_beams (int): The fewest beams to keep.
+            stopping_criteria: Checked after every step on all beams.
+            past_key_values (DynamicCache): Cache covering a prefix of input_ids, from prefix_past.
+
+        Returns:
+            torch.Tensor: The best hypothesis, prompt included, shape (1, length).
+        """
+
+        stats = {}
+        hypotheses = self.beam_hypotheses(input_ids, max_new_tokens, num_beams, length_penalty, no_repeat_ngram_size,
+                                          stopping_criteria, past_key_values, beam_margin, min_beams, stats)
+        # max keeps the first of equally scored hypotheses.
+        best = max(hypotheses, key=lambda hypothesis: hypothesis[0])[1]
+
+        self.last_beam = dict(stats)
+        self.beam_stats["requests"] += 1
+        self.beam_stats["steps"] += stats["steps"]
+        self.beam_stats["beam_steps"] += stats["beam_steps"]
+        self.beam_stats["narrowed"] += int(stats["final_width"] < num_beams)
+        return best[None, :]
+
+
+    def micro_batch_size(self, max_length, num_beams, memory_fraction=0.5, limit=64):
+
+        """
+        Estimate how many prompts fit in one generate call, from the key/value cache each sequence needs
+        (layers x hidden size x max_length x beams, for keys and values) and the memory currently available.
+
+        Parameters:
+            max_length (int): Maximum total sequence length.
+            num_beams (int): Beams per prompt.
+            memory_fraction (float): Share of the available memory the cache may use.
+            limit (int): Upper bound on the micro-batch size.
+
+        Returns:
+            int: Prompts per micro-batch.
+        """
+
+        config = self.model.config
+        dtype_bytes = next(self.model.parameters()).element_size()
+        kv_cache = 2 * config.num_hidden_layers * config.hidden_size * max_length * num_beams * dtype_bytes
+        logits = num_beams * config.vocab_size * 4
+        # Intermediate activations roughly double the cache footprint.
+        bytes_per_prompt = 2 * kv_cache + logits
+
+        device = next(self.model.parameters()).device
+        if device.type == "cuda":
+            available = torch.cuda.mem_get_info(device)[0]
+        else:
+            available = None
+            try:
+                with open("/proc/meminfo", "r") as f:
+                    for line in f:
+                        if line.startswith("MemAvailable:"):
+                            available = int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                pass
+            if available is None:
+                return 8
+
+        return max(1, min(limit, int(available * memory_fraction) // bytes_per_prompt))
+
+
+    @staticmethod
+    def batch_cache_params(**params):
+
+        """
+        Result-cache parameters of generate_batch: the decoding parameters, GENERATION_DEFAULTS for any not given,
+        and a marker for the batch path. Beam search in a micro-batch can end differently from generate_text, so
+        the two never share cached results.
+        """
+
+        return {**GENERATION_DEFAULTS, **params, "batched": True}
+
+
+    def generate_batch(self, prompts, max_length=GENERATION_DEFAULTS["max_length"], num_beams=GENERATION_DEFAULTS["num_beams"],
+                       length_penalty=GENERATION_DEFAULTS["length_penalty"],
+                       no_repeat_ngram_size=GENERATION_DEFAULTS["no_repeat_ngram_size"], batch_size=None,
+                       max_new_tokens=GENERATION_DEFAULTS["max_new_tokens"],
+                       stop_at_delimiter=GENERATION_DEFAULTS["stop_at_delimiter"]):
+
+        """
+        Generate text for several prompts, left-padding them with the <PAD> token and running them through the
+        model in micro-batches. Prompts are grouped by length to keep padding low; outputs are returned in the
+        order of the prompts. Greedy outputs match generate_text; with beam search a prompt can end differently
+        because the micro-batch decodes up to the longest remaining budget.
+
+        Parameters:
+            prompts (list): The input prompts.
+            max_length (int): Maximum length of the generated text, prompt included.
+            num_beams (int): Number of beams for beam search.
+            length_penalty (float): Penalty to encourage longer outputs.
+            no_repeat_ngram_size (int): Prevents repetition of n-grams of this size.
+            batch_size (int): Prompts per micro-batch. Defaults to an estimate based on available memory.
+            max_new_tokens (int): If given, the number of tokens to generate after each prompt, used instead of max_length.
+            stop_at_delimiter (bool): Whether each sequence stops at, and is cut before, the next answer delimiter.
+
+        Returns:
+            list: The generated text for each prompt.
+        """
+
+        results = [None] * len(prompts)
+        params = self.batch_cache_params(max_length=max_length, num_beams=num_beams, length_penalty=length_penalty,
+                                         no_repeat_ngram_size=no_repeat_ngram_size, max_new_tokens=max_new_tokens,
+                                         stop_at_delimiter=stop_at_delimiter)
+        if self.cache is not None:
+            results = [self.cache.get(prompt, params) for prompt in prompts]
+
+        # Only prompts without a cached result are generated.
+        todo = [i for i, result in enumerate(results) if result is None]
+        if not todo:
+            return results
+
+        batch_size = batch_size or self.micro_batch_size(max_length, num_beams)
+        # Like encode_prompt, prompts that leave too little room for the answer are trimmed from the start.
+        limit = self.input_limit(max_length, max_new_tokens)
+        encoded = {i: ids[-limit:] for i, ids in zip(todo, self.tokenizer([prompts[i] for i in todo]).input_ids)}
+        lengths = {i: len(ids) for i, ids in encoded.items()}
+        order = sorted(todo, key=lambda i: lengths[i])
+
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"   # decoder-only models continue from the right-hand end
+        try:
+            for start in range(0, len(order), batch_size):
+                indices = order[start:start + batch_size]
+                inputs = self.tokenizer.pad({"input_ids": [encoded[i] for i in indices]}, return_tensors="pt")
+
+                # max_length would count the left padding, so decode enough new tokens for the shortest
+                # prompt and trim every row back to its own budget.
+                padded_length = inputs.input_ids.shape[1]
+                budgets = {i: max_new_tokens if max_new_tokens is not None else max(0, max_length - lengths[i])
+                           for i in indices}
+                stopping_criteria = None
+                if stop_at_delimiter:
+                    stopping_criteria = transformers.StoppingCriteriaList([AnswerDelimiterCriteria(self.tokenizer, padded_length)])
+                with torch.inference_mode():
+                    output_ids = self.model.generate(
+                        inputs.input_ids,
+                        attention_mask=inputs.attention_mask,
+                        max_new_tokens = max(1, max(budgets.values())),
+                        num_beams=num_beams,
+                        length_penalty=length_penalty,
+                        no_repeat_ngram_size=no_repeat_ngram_size,
+                        early_stopping=True,
+                        do_sample = False,
+                        pad_token_id = self.tokenizer.pad_token_id,
+                        stopping_criteria=stopping_criteria
+                    )
+
+                for row, i in enumerate(indices):
+                    row_ids = output_ids[row, :padded_length + budgets[i]]
+                    if stop_at_delimiter:
+                        results[i], stopped = self.cut_at_delimiter(row_ids, padded_length)
+                    else:
+                        results[i], stopped = self.tokenizer.decode(row_ids, skip_special_tokens=True), False
+                    new_tokens = int((row_ids[padded_length:] != self.tokenizer.pad_token_id).sum())
+                    self.record_decode(new_tokens, budgets[i], stopped)
+                    if self.cache is not None:
+                        self.cache.put(prompts[i], params, results[i])
+        finally:
+            self.tokenizer.padding_side = padding_side
+
+        return results
+
     
 if __name__ == "__main__":
 
-    generator = TextGenerator(model_dir="./GPTtrained/final_model") #create class instance
+    #create class instance; the merged checkpoint is written on the first run and loaded directly afterwards
+    generator = TextGenerator(model_dir="./GPTtrained/final_model", merged_model_dir="./GPTtrained/merged_model")
 
     #base prompt
     prompt = ("Draft a well structured introduction about employment discrimination. "
@@ -162,30 +1204,12 @@ if __name__ == "__main__":
               "Do not include any generic contact or advisory information. "
               "Avoid phrases like 'In this article' or 'in this paper'.")
 
-    #find the category that the prompt falls under
-    lower_prompt = prompt.lower()
-    if "introduction" in lower_prompt:
-        category =  "Introduction"
-    elif "definition" in lower_prompt:
-        category =  "Definition"
-    else:
-        category = None
-
-    #Retrieve the file path for the appropriate few-shot examples.
-    examples_file = generator.few_shot_files(category)
-    
-    #Load few-shot examples from the specified file.
-    examples = generator.load_few_shot_examples(examples_file)
+    #decoding settings for the prompt's category
+    profile = generator.decoding_profile(generator.detect_category(prompt))
 
-    matching_example = generator.find_closest_example(prompt, examples)
-    
-    #Construct the few-shot prompt by appending the user's question to the matching example.
-    if matching_example:
-        few_shot_prompt = matching_example + "\n\nUser Question: " + prompt + "\nAnswer:"
-    else:
-        few_shot_prompt = "User Question: " + prompt + "\nAnswer:"
+    few_shot_prompt = generator.build_few_shot_prompt(prompt, max_length=profile["max_length"])
 
-    generated_text = generator.generate_text(few_shot_prompt, max_length=400)
+    generated_text = generator.generate_text(few_shot_prompt, **profile)
     print(generated_text)
     print("\n")
  
@@ -0,0 +1,772 @@
+import argparse
+import difflib
+import os
+import random
+import re
+import json
+import subprocess
+import sys
+import time
+
+from heading_classifier import HeadingClassifier
+from few_shot_index import FewShotIndex, question_line
+
+
+def time_call(func, *args, repeat=3, **kwargs):
+
+    """
+    Run func several times and return (best elapsed seconds, last result).
+    """
+
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_docx_backends(docx_paths, repeat=3):
+
+    """
+    Compare the python-docx and streaming DOCX readers of ConvertPlainTxt on the given documents
+    and check that both produce identical text.
+    """
+
+    from convert_plain_txt import ConvertPlainTxt
+
+    converter = ConvertPlainTxt()
+    for path in docx_paths:
+        docx_time, docx_text = time_call(converter.docx_to_text, path, backend="docx", repeat=repeat)
+        stream_time, stream_text = time_call(converter.docx_to_text, path, backend="stream", repeat=repeat)
+        print(f"{path}")
+        print(f"  docx:   {docx_time:.3f}s")
+        print(f"  stream: {stream_time:.3f}s  ({docx_time / stream_time:.1f}x faster)")
+        print(f"  identical output: {docx_text == stream_text}")
+
+
+def legacy_classify_lines(lines):
+
+    """
+    Per-line heading detection as both converters did it before the shared classifier: two add_delimiter
+    passes with the plain-text patterns, then the JSON patterns with inline numbering removal.
+    """
+
+    section_heading_pattern = re.compile(r'^\d+\.\s')
+    subsection_heading_pattern = re.compile(r'^\d+\.\d+(?:\.\d+)?\.?\s')
+    section_pattern = re.compile(r'^(\d+\. )(.+)$')
+    subsection_pattern = re.compile(r'^(\d+(?:\.\d+)+\.?\s)(.+)$')
+
+    def add_delimiter(stripped):
+        if not (section_heading_pattern.match(stripped) or subsection_heading_pattern.match(stripped)):
+            return True
+        if section_heading_pattern.match(stripped):
+            return False
+        if subsection_heading_pattern.match(stripped):
+            return ":" in stripped
+        return True
+
+    results = []
+    for line in lines:
+        delimiter = add_delimiter(line) and add_delimiter(line)
+        if subsection_pattern.match(line):
+            match = subsection_pattern.match(line)
+            rest = match.group(2)
+            colon_index = rest.find(":")
+            heading = match.group(1) + rest[:colon_index].strip() if colon_index != -1 else line
+            match = re.match(r'^(\d+(?:\.\d+)+\.?\s)(.+)$', heading)
+            results.append(("subsection", match.group(2) if match else heading, delimiter))
+        elif section_pattern.match(line) and not subsection_pattern.match(line):
+            match = re.match(r'^(\d+\. )(.+)$', line)
+            results.append(("section", match.group(2), delimiter))
+        else:
+            results.append((None, line, delimiter))
+    return results
+
+
+def shared_classify_lines(lines):
+
+    """
+    The same per-line work using one HeadingClassifier match per line.
+    """
+
+    classifier = HeadingClassifier()
+    results = []
+    for line in lines:
+        heading = classifier.classify(line)
+        delimiter = heading.level is None or (heading.level > 1 and ":" in line)
+        results.append((heading.kind, heading.title if heading.kind else line, delimiter))
+    return results
+
+
+def bench_heading_classifier(num_lines=200000, repeat=3):
+
+    """
+    Microbenchmark the per-line heading classification cost before and after the shared classifier.
+    """
+
+    templates = ["{n}. Section heading {n}", "{n}.{m} Subsection heading: with trailing content",
+                 "{n}.{m}.{k}. Deep subsection", "Ordinary content sentence number {i} describing the law.",
+                 "Another paragraph of advice text {i}, mentioning 2010 and clause {m}.{k}."]
+    lines = [templates[i % len(templates)].format(i=i, n=i % 40 + 1, m=i % 7 + 1, k=i % 3 + 1) for i in range(num_lines)]
+
+    legacy_time, legacy_result = time_call(legacy_classify_lines, lines, repeat=repeat)
+    shared_time, shared_result = time_call(shared_classify_lines, lines, repeat=repeat)
+    print(f"{num_lines} lines")
+    print(f"  legacy patterns:    {legacy_time:.3f}s  ({legacy_time / num_lines * 1e6:.2f} us/line)")
+    print(f"  heading classifier: {shared_time:.3f}s  ({shared_time / num_lines * 1e6:.2f} us/line)")
+    print(f"  speedup: {legacy_time / shared_time:.1f}x, identical results: {legacy_result == shared_result}")
+
+
+def legacy_split_sections(ds, test_size, seed):
+
+    """
+    The per-section split as load_json_files did it before: one Dataset.filter per section.
+    """
+
+    from datasets import concatenate_datasets
+
+    train_groups = []
+    test_groups = []
+    for section in set(ds["Section"]):
+        ds_section = ds.filter(lambda x: x["Section"] == section)
+        if len(ds_section) < 2:
+            train_groups.append(ds_section)
+        else:
+            split_ds = ds_section.train_test_split(test_size=test_size, seed=seed)
+            train_groups.append(split_ds["train"])
+            test_groups.append(split_ds["test"])
+    return concatenate_datasets(train_groups), concatenate_datasets(test_groups)
+
+
+def bench_section_split(num_rows=5000, num_sections=80, test_size=0.05, seed=42, repeat=3):
+
+    """
+    Compare the filter-per-section split with DataPreparer.split_sections on a synthetic multi-thousand-row
+    document and check both put the same rows in each set.
+    """
+
+    from datasets import Dataset, disable_caching
+    from GPTTrainer import DataPreparer
+
+    disable_caching()
+    rows = [{"Section": f"Section {i % num_sections}" if i % 17 else None, "Content": f"row {i}"} for i in range(num_rows)]
+    ds = Dataset.from_list(rows)
+
+    # split_sections only needs the split settings, not the tokenizer loaded by __init__.
+    preparer = DataPreparer.__new__(DataPreparer)
+    preparer.test_size = test_size
+    preparer.seed = seed
+
+    legacy_time, (legacy_train, legacy_test) = time_call(legacy_split_sections, ds, test_size, seed, repeat=repeat)
+    split_time, (train, test) = time_call(preparer.split_sections, ds, repeat=repeat)
+    same = (sorted(legacy_train["Content"]) == sorted(train["Content"])
+            and sorted(legacy_test["Content"]) == sorted(test["Content"]))
+    print(f"{num_rows} rows, {num_sections + 1} sections")
+    print(f"  filter per section: {legacy_time:.3f}s")
+    print(f"  split_sections:     {split_time:.3f}s  ({legacy_time / split_time:.1f}x faster)")
+    print(f"  same train/test membership: {same}")
+
+
+def per_token_latency(generator, prompt, new_tokens=64, repeat=3):
+
+    """
+    Time greedy decoding of exactly new_tokens tokens and return (seconds per token, generated ids).
+    """
+
+    import torch
+
+    inputs = generator.tokenizer(prompt, return_tensors="pt")
+    with torch.inference_mode():
+        elapsed, output_ids = time_call(
+            generator.model.generate, inputs.input_ids, attention_mask=inputs.attention_mask,
+            max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+            pad_token_id=generator.tokenizer.pad_token_id, repeat=repeat)
+    return elapsed / new_tokens, output_ids[0].tolist()
+
+
+def bench_merged_inference(model_dir, base_model_dir, merged_model_dir, prompt, new_tokens=64, repeat=3):
+
+    """
+    Compare cold-start time and per-token latency of the PEFT-wrapped model and the merged checkpoint.
+    """
+
+    from TextGen import TextGenerator
+
+    if not os.path.isdir(merged_model_dir):
+        TextGenerator(model_dir=model_dir, base_model_dir=base_model_dir, merged_model_dir=merged_model_dir)
+
+    adapter_start, adapter_gen = time_call(TextGenerator, model_dir=model_dir, base_model_dir=base_model_dir, repeat=repeat)
+    merged_start, merged_gen = time_call(TextGenerator, model_dir=model_dir, base_model_dir=base_model_dir,
+                                         merged_model_dir=merged_model_dir, repeat=repeat)
+    adapter_latency, adapter_ids = per_token_latency(adapter_gen, prompt, new_tokens, repeat)
+    merged_latency, merged_ids = per_token_latency(merged_gen, prompt, new_tokens, repeat)
+
+    print(f"cold start:  adapter {adapter_start:.2f}s, merged {merged_start:.2f}s ({adapter_start / merged_start:.1f}x)")
+    print(f"per token:   adapter {adapter_latency * 1000:.2f}ms, merged {merged_latency * 1000:.2f}ms "
+          f"({adapter_latency / merged_latency:.1f}x)")
+    print(f"same greedy output: {adapter_ids == merged_ids}")
+
+
+def load_prompt_questions(example_files):
+
+    """
+    Read the "Question:" lines of the few-shot prompt files, to use as realistic benchmark prompts.
+    """
+
+    questions = []
+    for path in example_files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("Question:"):
+                    questions.append(line[len("Question:"):].strip())
+    return questions
+
+
+def bench_batch_generation(model_dir, merged_model_dir, example_files, max_length=200, num_beams=5, batch_size=None):
+
+    """
+    Compare prompts/min of a serial generate_text loop with generate_batch on the same prompts.
+    """
+
+    from TextGen import TextGenerator
+
+    generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir)
+    prompts = ["User Question: " + question + "\nAnswer:" for question in load_prompt_questions(example_files)]
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        generator.generate_text(prompt, max_length=max_length, num_beams=num_beams)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator.generate_batch(prompts, max_length=max_length, num_beams=num_beams, batch_size=batch_size)
+    batch_time = time.perf_counter() - start
+
+    print(f"{len(prompts)} prompts, micro-batch size {batch_size or generator.micro_batch_size(max_length, num_beams)}")
+    print(f"  serial:  {len(prompts) / serial_time * 60:.1f} prompts/min")
+    print(f"  batched: {len(prompts) / batch_time * 60:.1f} prompts/min ({serial_time / batch_time:.1f}x)")
+
+
+def bench_prefix_cache(model_dir, merged_model_dir, example_files, max_length=300, num_beams=5):
+
+    """
+    Compare generate_text on few-shot prompts with the prefix key/value cache disabled against reusing
+    the cached prefixes, and check that the outputs are the same.
+    """
+
+    from TextGen import TextGenerator
+
+    generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir)
+    questions = load_prompt_questions(example_files)
+    prompts = [generator.build_few_shot_prompt(question, max_length=max_length) for question in questions]
+
+    # Without a prefix cache every prompt is encoded in full.
+    prefix_cache_size, generator.prefix_cache_size = generator.prefix_cache_size, 0
+    cold_texts = []
+    start = time.perf_counter()
+    for prompt in prompts:
+        cold_texts.append(generator.generate_text(prompt, max_length=max_length, num_beams=num_beams))
+    cold_time = time.perf_counter() - start
+
+    # Prefixes are cached on first use; encode them before timing.
+    generator.prefix_cache_size = prefix_cache_size
+    for prompt in prompts:
+        generator.prefix_past(prompt, generator.encode_prompt(prompt, max_length).input_ids)
+    warm_texts = []
+    start = time.perf_counter()
+    for prompt in prompts:
+        warm_texts.append(generator.generate_text(prompt, max_length=max_length, num_beams=num_beams))
+    warm_time = time.perf_counter() - start
+
+    print(f"{len(prompts)} few-shot prompts, {len(generator.prefix_cache)} cached prefix(es), {num_beams} beam(s)")
+    print(f"  full prompt encoded:  {cold_time / len(prompts) * 1000:.1f}ms/prompt")
+    print(f"  cached prefix reused: {warm_time / len(prompts) * 1000:.1f}ms/prompt ({cold_time / warm_time:.2f}x)")
+    print(f"  same output: {cold_texts == warm_texts}")
+
+
+def bench_stop_delimiters(model_dir, merged_model_dir, example_files, max_length=400, num_beams=5, max_new_tokens=None):
+
+    """
+    Generate the few-shot prompt of every question in the prompt files with and without the answer-delimiter
+    stop, and compare decoded tokens and time.
+    """
+
+    from TextGen import TextGenerator
+
+    generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir)
+    prompts = [generator.build_few_shot_prompt(question, max_length=max_length)
+               for question in load_prompt_questions(example_files)]
+
+    totals = {}
+    for stop in (False, True):
+        tokens = 0
+        start = time.perf_counter()
+        for prompt in prompts:
+            generator.generate_text(prompt, max_length=max_length, num_beams=num_beams, max_new_tokens=max_new_tokens,
+                                    stop_at_delimiter=stop)
+            tokens += generator.last_decode["new_tokens"]
+            if stop:
+                print(f"  {generator.last_decode['new_tokens']:4d} of {generator.last_decode['token_budget']:4d} tokens, "
+                      f"saved {generator.last_decode['tokens_saved']:4d}  {prompt.splitlines()[-2][:60]!r}")
+        totals[stop] = (tokens, time.perf_counter() - start)
+
+    (full_tokens, full_time), (stop_tokens, stop_time) = totals[False], totals[True]
+    print(f"{len(prompts)} prompts, {num_beams} beam(s)")
+    print(f"  without stop: {full_tokens} tokens decoded, {full_time:.2f}s")
+    print(f"  with stop:    {stop_tokens} tokens decoded, {stop_time:.2f}s "
+          f"({full_tokens - stop_tokens} tokens saved, {full_time / stop_time:.2f}x)")
+
+
+def model_bytes(model):
+
+    """
+    Size of a model's weights in bytes, counting the int8 data of dynamically quantised layers.
+    """
+
+    from quantization import quantized_state
+
+    state = quantized_state(model)
+    size = sum(t.numel() * t.element_size() for t in state["tensors"].values())
+    for entry in state["linear"].values():
+        size += entry["int8"].numel() + (entry["bias"].numel() * entry["bias"].element_size() if entry["bias"] is not None else 0)
+    return size
+
+
+def bench_quantized_inference(model_dir, merged_model_dir, example_files, max_length=300, num_beams=5):
+
+    """
+    Compare the fp32 merged model with its int8 dynamically quantised copy on the few-shot prompt of every
+    question in the prompt files: overlap of the generated answers, latency per prompt and weight memory.
+    """
+
+    from TextGen import TextGenerator
+
+    fp32 = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir)
+    int8_start, int8 = time_call(TextGenerator, model_dir=model_dir, merged_model_dir=merged_model_dir,
+                                 quantize=True, repeat=1)
+    prompts = [fp32.build_few_shot_prompt(question, max_length=max_length)
+               for question in load_prompt_questions(example_files)]
+
+    outputs, latency = {}, {}
+    for name, generator in (("fp32", fp32), ("int8", int8)):
+        start = time.perf_counter()
+        outputs[name] = [generator.generate_text(prompt, max_length=max_length, num_beams=num_beams) for prompt in prompts]
+        latency[name] = (time.perf_counter() - start) / len(prompts)
+
+    overlaps = []
+    for prompt, a, b in zip(prompts, outputs["fp32"], outputs["int8"]):
+        # Word-level similarity of the answers, the prompt itself excluded.
+        overlaps.append(difflib.SequenceMatcher(None, a[len(prompt):].split(), b[len(prompt):].split()).ratio())
+    exact = sum(a == b for a, b in zip(outputs["fp32"], outputs["int8"]))
+
+    print(f"{len(prompts)} prompts, {num_beams} beam(s), int8 start-up {int8_start:.2f}s")
+    print(f"  latency: fp32 {latency['fp32'] * 1000:.0f}ms/prompt, int8 {latency['int8'] * 1000:.0f}ms/prompt "
+          f"({latency['fp32'] / latency['int8']:.2f}x)")
+    print(f"  weights: fp32 {model_bytes(fp32.model) / 2**20:.1f} MiB, int8 {model_bytes(int8.model) / 2**20:.1f} MiB")
+    print(f"  answer overlap with fp32: mean {sum(overlaps) / len(overlaps):.3f}, min {min(overlaps):.3f}, "
+          f"identical {exact}/{len(prompts)}")
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import TextGen
+module_import = time.perf_counter() - start
+generator = TextGen.TextGenerator(model_dir=sys.argv[1], merged_model_dir=sys.argv[2] or None, cache_path=None,
+                                  few_shot_poll_interval=None, quantize=sys.argv[3] == "1")
+report = generator.startup_report()
+report["module_import"] = module_import
+report["total"] = time.perf_counter() - start
+print(json.dumps(report))
+"""
+
+
+def bench_startup(model_dir, merged_model_dir, quantize=False, runs=3):
+
+    """
+    Measure a cold start in fresh interpreters: importing TextGen, importing the heavy modules, loading the
+    tokenizer and weights, and generating the first token. Reports the median of each stage over the runs.
+    """
+
+    reports = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, model_dir, merged_model_dir or "",
+                                 "1" if quantize else "0"], capture_output=True, text=True, check=True)
+        reports.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    print(f"{runs} cold start(s){' (int8)' if quantize else ''}, median seconds:")
+    for stage in ("module_import", "import", "tokenizer", "weights", "first_token", "total"):
+        values = sorted(report.get(stage, 0.0) for report in reports)
+        print(f"  {stage:<14}{values[len(values) // 2]:.2f}s")
+
+
+PRIVATE_WORKER_SCRIPT = """
+import json, sys
+from TextGen import TextGenerator
+from generation_workers import process_memory
+generator = TextGenerator(model_dir=sys.argv[1], merged_model_dir=sys.argv[2], cache_path=None, few_shot_poll_interval=None)
+generator.generate_text("User Question: What is UK law?\\nAnswer:", max_length=int(sys.argv[3]), num_beams=int(sys.argv[4]))
+print(json.dumps(process_memory()))
+"""
+
+
+def bench_shared_workers(model_dir, merged_model_dir, example_files, num_workers=2, max_length=200, num_beams=5):
+
+    """
+    Compare the memory of generator processes that each load their own weights with the workers of a
+    GenerationWorkerPool, which map one shared copy, and the time to answer every prompt question with one
+    in-process generator vs the pool. PSS splits shared pages between the processes that map them and USS
+    counts private pages only, so the pool's workers should show a USS close to their activations.
+    """
+
+    from TextGen import TextGenerator
+    from generation_workers import GenerationWorkerPool
+
+    def mib(memory, key):
+        return f"{memory.get(key, 0) / 2**20:.0f}"
+
+    private = []
+    for _ in range(num_workers):
+        result = subprocess.run([sys.executable, "-c", PRIVATE_WORKER_SCRIPT, model_dir, merged_model_dir,
+                                 str(max_length), str(num_beams)], capture_output=True, text=True, check=True)
+        private.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir)
+    prompts = [generator.build_few_shot_prompt(question, max_length=max_length)
+               for question in load_prompt_questions(example_files)]
+    start = time.perf_counter()
+    expected = generator.generate_batch(prompts, max_length=max_length, num_beams=num_beams)
+    single_time = time.perf_counter() - start
+
+    pool = GenerationWorkerPool(num_workers=num_workers, model_dir=model_dir, merged_model_dir=merged_model_dir)
+    try:
+        start = time.perf_counter()
+        outputs = pool.generate_batch(prompts, max_length=max_length, num_beams=num_beams)
+        pool_time = time.perf_counter() - start
+        shared = pool.memory_report()
+    finally:
+        pool.close()
+
+    print(f"{num_workers} worker(s), {len(prompts)} prompts, {num_beams} beam(s); memory in MiB (rss / pss / uss)")
+    for i, memory in enumerate(private):
+        print(f"  private weights worker {i}: {mib(memory, 'rss')} / {mib(memory, 'pss')} / {mib(memory, 'uss')}")
+    for worker_id, memory in sorted(shared.items()):
+        print(f"  shared weights worker {worker_id}:  {mib(memory, 'rss')} / {mib(memory, 'pss')} / {mib(memory, 'uss')}")
+    print(f"  one generator {single_time:.2f}s, pool {pool_time:.2f}s ({single_time / pool_time:.2f}x), "
+          f"identical outputs {sum(a == b for a, b in zip(expected, outputs))}/{len(prompts)}")
+
+
+def bench_speculative(model_dir, merged_model_dir, example_files, max_length=300, num_beams=5, draft_layers=4,
+                      draft_tokens=4):
+
+    """
+    Answer the few-shot prompt of every question in the prompt files with beam search, greedy decoding and
+    speculative greedy decoding with a truncated-layer draft model. Reports the draft acceptance rate, the
+    speedup over both, and whether the speculative answers match the greedy ones exactly.
+    """
+
+    from TextGen import TextGenerator
+
+    generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir, draft_layers=draft_layers,
+                              draft_tokens=draft_tokens)
+    prompts = [generator.build_few_shot_prompt(question, max_length=max_length)
+               for question in load_prompt_questions(example_files)]
+    draft_time, _ = time_call(lambda: generator.draft_model, repeat=1)
+
+    runs = (("beam", {"num_beams": num_beams}), ("greedy", {"num_beams": 1}),
+            ("speculative", {"num_beams": 1, "speculative": True}))
+    outputs, latency = {}, {}
+    for name, kwargs in runs:
+        start = time.perf_counter()
+        outputs[name] = [generator.generate_text(prompt, max_length=max_length, **kwargs) for prompt in prompts]
+        latency[name] = (time.perf_counter() - start) / len(prompts)
+
+    report = generator.speculative_report()
+    matches = sum(a == b for a, b in zip(outputs["greedy"], outputs["speculative"]))
+    print(f"{len(prompts)} prompts, draft of {draft_layers} layer(s) built in {draft_time:.2f}s, "
+          f"{draft_tokens} draft token(s) per pass")
+    print(f"  acceptance rate {report['acceptance_rate']:.1%}, "
+          f"{report['tokens_per_target_pass']:.2f} tokens per fine-tuned model pass")
+    print(f"  {num_beams}-beam:      {latency['beam'] * 1000:.0f}ms/prompt")
+    print(f"  greedy:      {latency['greedy'] * 1000:.0f}ms/prompt")
+    print(f"  speculative: {latency['speculative'] * 1000:.0f}ms/prompt "
+          f"({latency['greedy'] / latency['speculative']:.2f}x vs greedy, "
+          f"{latency['beam'] / latency['speculative']:.2f}x vs {num_beams}-beam)")
+    print(f"  same text as greedy: {matches}/{len(prompts)}")
+
+
+def bench_decoding_profiles(model_dir, merged_model_dir, example_files, num_beams=5, beam_margin=4.0):
+
+    """
+    Answer the few-shot prompt of every question in the prompt files with the original 5-beam settings, with
+    the same settings plus adaptive beam narrowing, and with the category's decoding profile. Reports latency
+    and word-level similarity to the 5-beam answers per category, and the mean beam width of adaptive search.
+    """
+
+    from TextGen import TextGenerator
+
+    generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir)
+    questions = load_prompt_questions(example_files)
+    categories = [generator.detect_category(question) for question in questions]
+    baseline = {"max_length": 600, "num_beams": num_beams, "length_penalty": 2.0, "no_repeat_ngram_size": 3}
+    modes = (("baseline", lambda category: baseline),
+             ("adaptive", lambda category: {**baseline, "beam_margin": beam_margin}),
+             ("profile", generator.decoding_profile))
+
+    results = {}   # mode -> list of (answer, seconds, beam steps per step or None), in question order
+    for name, settings in modes:
+        results[name] = []
+        for question, category in zip(questions, categories):
+            params = settings(category)
+            prompt = generator.build_few_shot_prompt(question, max_length=params["max_length"])
+            generator.last_beam = None
+            start = time.perf_counter()
+            text = generator.generate_text(prompt, **params)
+            elapsed = time.perf_counter() - start
+            beam = generator.last_beam
+            results[name].append((text[len(prompt):], elapsed, beam["beam_steps"] / beam["steps"] if beam else None))
+
+    print(f"{len(questions)} prompts, baseline {num_beams} beam(s), beam_margin {beam_margin}")
+    for category in sorted(set(categories), key=str):
+        indices = [i for i, c in enumerate(categories) if c == category]
+        base_time = sum(results["baseline"][i][1] for i in indices) / len(indices)
+        print(f"  {category or 'other'} ({len(indices)} prompts):")
+        for name, _ in modes:
+            latency = sum(results[name][i][1] for i in indices) / len(indices)
+            similarity = sum(difflib.SequenceMatcher(None, results["baseline"][i][0].split(),
+                                                     results[name][i][0].split()).ratio() for i in indices) / len(indices)
+            widths = [results[name][i][2] for i in indices if results[name][i][2] is not None]
+            width = f", mean beam width {sum(widths) / len(widths):.2f}" if widths else ""
+            print(f"    {name:9s} {latency * 1000:6.0f}ms/prompt ({base_time / latency:.2f}x), "
+                  f"similarity to baseline {similarity:.1%}{width}")
+
+
+BENCH_TOPICS = ["Tax", "Divorce", "family law", "contract law", "immigration", "employment discrimination",
+                "share capital", "trusts", "data protection", "Employment Tribunals", "criminal law",
+                "landlord and tenant", "legal aid", "company insolvency", "intellectual property", "human rights",
+                "unfair dismissal", "fixed-fee legal services"]
+
+
+def legacy_closest_example(user_prompt, examples):
+
+    """
+    The previous TextGenerator.find_closest_example: difflib ratio of the first sentence against every example.
+    """
+
+    first_sentence = user_prompt.split(".")[0].strip()
+    best_example = None
+    best_ratio = 0
+    for ex in examples:
+        for line in ex.split("\n"):
+            if line.startswith("Question:"):
+                question = line[len("Question:"):].strip()
+                ratio = difflib.SequenceMatcher(None, first_sentence.lower(), question.lower()).ratio()
+                if ratio > best_ratio:
+                    best_ratio = ratio
+                    best_example = ex
+                break
+    return best_example
+
+
+def topic_queries(questions, topics):
+
+    """
+    Build queries by putting each topic in place of the subject of each question (after "about", "of" or "for").
+    """
+
+    queries = []
+    for question in questions:
+        match = re.match(r"(.* (?:about|of|for) )", question)
+        if match:
+            queries.extend(match.group(1) + topic for topic in topics)
+    return queries
+
+
+def bench_few_shot_retrieval(example_files, library_size=5000, num_queries=200, candidates=4, seed=0):
+
+    """
+    Check that the retrieval index picks the same examples as the difflib scan on the existing prompt files,
+    then time both on a synthetic library of library_size examples.
+    """
+
+    agree = total = 0
+    for path in example_files:
+        with open(path, "r", encoding="utf-8") as f:
+            examples = f.read().strip().split("\n\n")
+        questions = [q for q in map(question_line, examples) if q]
+        index = FewShotIndex(examples)
+        for query in questions + topic_queries(questions, BENCH_TOPICS):
+            expected = legacy_closest_example(query, examples)
+            chosen = index.closest(query.split(".")[0].strip(), candidates=candidates)
+            total += 1
+            if chosen == expected:
+                agree += 1
+            else:
+                print(f"  differs for {query!r}: {question_line(expected)!r} vs {question_line(chosen)!r}")
+    print(f"agreement with difflib on {', '.join(example_files)}: {agree}/{total}")
+
+    # Synthetic library: the existing question templates with random legal topics.
+    rng = random.Random(seed)
+    words = sorted({w.strip(".,:;()").lower() for t in BENCH_TOPICS for w in t.split()} | {
+        "law", "rights", "contracts", "liability", "property", "appeals", "courts", "regulation", "compliance",
+        "negligence", "probate", "arbitration", "mediation", "licensing", "pensions", "consumer", "planning"})
+    templates = [re.match(r"(.* (?:about|of|for) )", q) for path in example_files
+                 for q in map(question_line, open(path, encoding="utf-8").read().strip().split("\n\n")) if q]
+    templates = [m.group(1) for m in templates if m]
+    library = [f"Question: {rng.choice(templates)}{' '.join(rng.sample(words, 3))}.\nAnswer: ..." for _ in range(library_size)]
+    queries = [f"{rng.choice(templates)}{' '.join(rng.sample(words, 2))}" for _ in range(num_queries)]
+
+    build_time, index = time_call(FewShotIndex, library, repeat=1)
+    start = time.perf_counter()
+    legacy = [legacy_closest_example(q, library) for q in queries]
+    legacy_time = (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    indexed = [index.closest(q, candidates=candidates) for q in queries]
+    index_time = (time.perf_counter() - start) / len(queries)
+
+    print(f"{library_size} examples, {len(queries)} queries, index built in {build_time:.2f}s")
+    print(f"  difflib scan: {legacy_time * 1000:.2f}ms/query")
+    print(f"  index:        {index_time * 1000:.3f}ms/query ({legacy_time / index_time:.0f}x), "
+          f"same pick for {sum(a == b for a, b in zip(legacy, indexed))}/{len(queries)}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the content pipeline.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    docx_parser = subparsers.add_parser("docx-backends", help="python-docx vs streaming DOCX reader")
+    docx_parser.add_argument("docx_paths", nargs="+")
+    docx_parser.add_argument("--repeat", type=int, default=3)
+
+    heading_parser = subparsers.add_parser("headings", help="legacy regexes vs shared heading classifier")
+    heading_parser.add_argument("--lines", type=int, default=200000)
+    heading_parser.add_argument("--repeat", type=int, default=3)
+
+    split_parser = subparsers.add_parser("section-split", help="filter-per-section vs vectorised train/test split")
+    split_parser.add_argument("--rows", type=int, default=5000)
+    split_parser.add_argument("--sections", type=int, default=80)
+    split_parser.add_argument("--repeat", type=int, default=3)
+
+    merged_parser = subparsers.add_parser("merged-inference", help="PEFT adapter vs merged checkpoint inference")
+    merged_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    merged_parser.add_argument("--base-model-dir", default="./GPT-2")
+    merged_parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    merged_parser.add_argument("--prompt", default="Question: Draft a well structured introduction about Tax.\nAnswer:")
+    merged_parser.add_argument("--new-tokens", type=int, default=64)
+    merged_parser.add_argument("--repeat", type=int, default=3)
+
+    batch_parser = subparsers.add_parser("batch-generation", help="serial generate_text vs generate_batch")
+    batch_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    batch_parser.add_argument("--merged-model-dir", default=None)
+    batch_parser.add_argument("--example-files", nargs="+",
+                              default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    batch_parser.add_argument("--max-length", type=int, default=200)
+    batch_parser.add_argument("--num-beams", type=int, default=5)
+    batch_parser.add_argument("--batch-size", type=int, default=None)
+
+    prefix_parser = subparsers.add_parser("prefix-cache", help="re-encoded vs cached few-shot prefixes")
+    prefix_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    prefix_parser.add_argument("--merged-model-dir", default=None)
+    prefix_parser.add_argument("--example-files", nargs="+",
+                               default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    prefix_parser.add_argument("--max-length", type=int, default=300)
+    prefix_parser.add_argument("--num-beams", type=int, default=5)
+
+    retrieval_parser = subparsers.add_parser("few-shot-retrieval", help="difflib scan vs few-shot retrieval index")
+    retrieval_parser.add_argument("--example-files", nargs="+",
+                                  default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    retrieval_parser.add_argument("--library-size", type=int, default=5000)
+    retrieval_parser.add_argument("--queries", type=int, default=200)
+    retrieval_parser.add_argument("--candidates", type=int, default=4)
+
+    stop_parser = subparsers.add_parser("stop-delimiters", help="decoding with vs without the answer-delimiter stop")
+    stop_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    stop_parser.add_argument("--merged-model-dir", default=None)
+    stop_parser.add_argument("--example-files", nargs="+",
+                             default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    stop_parser.add_argument("--max-length", type=int, default=400)
+    stop_parser.add_argument("--num-beams", type=int, default=5)
+    stop_parser.add_argument("--max-new-tokens", type=int, default=None)
+
+    quantized_parser = subparsers.add_parser("quantized-inference", help="fp32 vs int8 dynamically quantised inference")
+    quantized_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    quantized_parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    quantized_parser.add_argument("--example-files", nargs="+",
+                                  default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    quantized_parser.add_argument("--max-length", type=int, default=300)
+    quantized_parser.add_argument("--num-beams", type=int, default=5)
+
+    startup_parser = subparsers.add_parser("startup", help="cold-start time: imports, weight loading, first token")
+    startup_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    startup_parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    startup_parser.add_argument("--quantize", action="store_true")
+    startup_parser.add_argument("--runs", type=int, default=3)
+
+    workers_parser = subparsers.add_parser("shared-workers", help="private vs shared-weight generation worker memory")
+    workers_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    workers_parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    workers_parser.add_argument("--example-files", nargs="+",
+                                default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    workers_parser.add_argument("--workers", type=int, default=2)
+    workers_parser.add_argument("--max-length", type=int, default=200)
+    workers_parser.add_argument("--num-beams", type=int, default=5)
+
+    speculative_parser = subparsers.add_parser("speculative", help="beam vs greedy vs draft-model speculative decoding")
+    speculative_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    speculative_parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    speculative_parser.add_argument("--example-files", nargs="+",
+                                    default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    speculative_parser.add_argument("--max-length", type=int, default=300)
+    speculative_parser.add_argument("--num-beams", type=int, default=5)
+    speculative_parser.add_argument("--draft-layers", type=int, default=4)
+    speculative_parser.add_argument("--draft-tokens", type=int, default=4)
+
+    profiles_parser = subparsers.add_parser("decoding-profiles",
+                                            help="5-beam baseline vs adaptive beam width vs per-category profiles")
+    profiles_parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    profiles_parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    profiles_parser.add_argument("--example-files", nargs="+",
+                                 default=["./prompt resources/Intro-prompts.txt", "./prompt resources/definition-prompts.txt"])
+    profiles_parser.add_argument("--num-beams", type=int, default=5)
+    profiles_parser.add_argument("--beam-margin", type=float, default=4.0)
+
+    args = parser.parse_args()
+    if args.benchmark == "docx-backends":
+        bench_docx_backends(args.docx_paths, repeat=args.repeat)
+    elif args.benchmark == "headings":
+        bench_heading_classifier(num_lines=args.lines, repeat=args.repeat)
+    elif args.benchmark == "section-split":
+        bench_section_split(num_rows=args.rows, num_sections=args.sections, repeat=args.repeat)
+    elif args.benchmark == "merged-inference":
+        bench_merged_inference(args.model_dir, args.base_model_dir, args.merged_model_dir, args.prompt,
+                               new_tokens=args.new_tokens, repeat=args.repeat)
+    elif args.benchmark == "batch-generation":
+        bench_batch_generation(args.model_dir, args.merged_model_dir, args.example_files,
+                               max_length=args.max_length, num_beams=args.num_beams, batch_size=args.batch_size)
+    elif args.benchmark == "prefix-cache":
+        bench_prefix_cache(args.model_dir, args.merged_model_dir, args.example_files,
+                           max_length=args.max_length, num_beams=args.num_beams)
+    elif args.benchmark == "few-shot-retrieval":
+        bench_few_shot_retrieval(args.example_files, library_size=args.library_size, num_queries=args.queries,
+                                 candidates=args.candidates)
+    elif args.benchmark == "stop-delimiters":
+        bench_stop_delimiters(args.model_dir, args.merged_model_dir, args.example_files, max_length=args.max_length,
+                              num_beams=args.num_beams, max_new_tokens=args.max_new_tokens)
+    elif args.benchmark == "quantized-inference":
+        bench_quantized_inference(args.model_dir, args.merged_model_dir, args.example_files,
+                                  max_length=args.max_length, num_beams=args.num_beams)
+    elif args.benchmark == "startup":
+        bench_startup(args.model_dir, args.merged_model_dir, quantize=args.quantize, runs=args.runs)
+    elif args.benchmark == "shared-workers":
+        bench_shared_workers(args.model_dir, args.merged_model_dir, args.example_files, num_workers=args.workers,
+                             max_length=args.max_length, num_beams=args.num_beams)
+    elif args.benchmark == "speculative":
+        bench_speculative(args.model_dir, args.merged_model_dir, args.example_files, max_length=args.max_length,
+                          num_beams=args.num_beams, draft_layers=args.draft_layers, draft_tokens=args.draft_tokens)
+    elif args.benchmark == "decoding-profiles":
+        bench_decoding_profiles(args.model_dir, args.merged_model_dir, args.example_files, num_beams=args.num_beams,
+                                beam_margin=args.beam_margin)
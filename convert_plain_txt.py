@@ -1,20 +1,40 @@
 import os
+import posixpath
+import zipfile
 from docx import Document
 from docx.oxml.ns import qn
-import re
+from docx.styles import BabelFish
+from lxml import etree
+from heading_classifier import HeadingClassifier
+
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+OFFICE_DOCUMENT_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+STYLES_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+
+# Text equivalents of run inner-content elements, matching python-docx's paragraph.text.
+RUN_TEXT_TAGS = {
+    W_NS + "tab": "\t",
+    W_NS + "ptab": "\t",
+    W_NS + "cr": "\n",
+    W_NS + "noBreakHyphen": "-",
+}
 
 class ConvertPlainTxt:
 
-    def __init__(self):
+    def __init__(self, heading_classifier=None):
 
         """
-        Initialize the converter with regular expression patterns for section and 
+        Initialize the converter with the shared classifier for section and
         subsection headings.
-        
+
+        Parameters:
+            heading_classifier (HeadingClassifier): Classifier to use, e.g. one shared with a ConvertToJson.
+                                                    A new one by default.
         """
 
-        self.section_heading_pattern = re.compile(r'^\d+\.\s')
-        self.subsection_heading_pattern = re.compile(r'^\d+\.\d+(?:\.\d+)?\.?\s')
+        self.heading_classifier = heading_classifier or HeadingClassifier()
         
 
     def get_list_level(self, paragraph):
@@ -30,16 +50,31 @@ class ConvertPlainTxt:
             int: The list level (indentation) if found, or 0 as a fallback.
         """
 
-        p = paragraph._element
-        pPr = p.find(qn("w:pPr"))
+        return self.list_level_from_pPr(paragraph._element.find(qn("w:pPr")))
+
+
+    def list_level_from_pPr(self, pPr):
+
+        """
+        Return the list level stored in a paragraph properties (<w:pPr>) element.
+
+        Parameters:
+            pPr: The <w:pPr> XML element of a paragraph, or None.
+
+        Returns:
+            int or None: The list level, 0 if <w:ilvl> has no numeric val, or None if the paragraph is not a list item.
+        """
+
         if pPr is None:
             return None
         numPr = pPr.find(qn("w:numPr"))
         if numPr is None:
             return None
         ilvl = numPr.find(qn("w:ilvl"))
-        if ilvl is not None and ilvl.get(qn("w:val")).isdigit():
-            return int(ilvl.get(qn("w:val")))
+        if ilvl is not None:
+            val = ilvl.get(qn("w:val"))
+            if val is not None and val.isdigit():
+                return int(val)
         return 0  # fallback if <w:ilvl> has no val
 
 
@@ -54,22 +89,22 @@ class ConvertPlainTxt:
         Collapse consecutive blank lines into a single blank line.
         
         Parameters:
-            lines (list): A list of text lines.
+            lines (iterable): Text lines.
         
-        Returns:
-            list: A new list of text lines with consecutive blanks collapsed.
+        Yields:
+            str: The text lines with consecutive blanks collapsed.
         """
         
-        cleaned_lines = [] #intialise list 
+        previous_blank = False
         for line in lines:
             if not line.strip():
-                if cleaned_lines and not cleaned_lines[-1].strip():
-                        continue
-                else:
-                    cleaned_lines.append("")
+                if previous_blank:
+                    continue
+                previous_blank = True
+                yield ""
             else:
-                cleaned_lines.append(line)
-        return cleaned_lines
+                previous_blank = False
+                yield line
 
 
     def finalize_bullet_list(self, explicit_intro, bullet_entries):
@@ -123,22 +158,183 @@ class ConvertPlainTxt:
         if not stripped:
             return False
 
-        if not (self.section_heading_pattern.match(stripped) or self.subsection_heading_pattern.match(stripped)):
+        level = self.heading_classifier.classify(stripped).level
+        if level is None:
             return True
 
-        if self.section_heading_pattern.match(stripped):
+        if level == 1:
             return False
         
-        if self.subsection_heading_pattern.match(stripped):
-            if ":" in stripped:
-                return True
-            else:
-                return False
-            
-        return True
+        # Subsection headings carrying content after a colon are delimited like content.
+        return ":" in stripped
 
      
-    def docx_to_text(self, docx_path):
+    def read_paragraphs(self, docx_path):
+
+        """
+        Yield (style name, text, list level) for each body paragraph using the python-docx object model.
+
+        Parameters:
+            docx_path (str): The file path of the .docx document.
+        """
+
+        document = Document(docx_path)
+        for para in document.paragraphs:
+            style_name = para.style.name if para.style else None
+            yield style_name, para.text, self.get_list_level(para)
+
+
+    def read_document_part_names(self, archive):
+
+        """
+        Resolve the names of the main document part and its styles part inside the DOCX zip.
+
+        Returns:
+            tuple: (document part name, styles part name or None)
+        """
+
+        document_part = "word/document.xml"
+        rels = etree.fromstring(archive.read("_rels/.rels"))
+        for rel in rels.iter(REL_NS + "Relationship"):
+            if rel.get("Type") == OFFICE_DOCUMENT_REL:
+                document_part = rel.get("Target").lstrip("/")
+                break
+
+        base_dir, file_name = posixpath.split(document_part)
+        rels_name = posixpath.join(base_dir, "_rels", file_name + ".rels")
+        if rels_name not in archive.namelist():
+            return document_part, None
+
+        for rel in etree.fromstring(archive.read(rels_name)).iter(REL_NS + "Relationship"):
+            if rel.get("Type") == STYLES_REL:
+                target = rel.get("Target")
+                if target.startswith("/"):
+                    return document_part, target.lstrip("/")
+                return document_part, posixpath.normpath(posixpath.join(base_dir, target))
+        return document_part, None
+
+
+    def read_paragraph_styles(self, archive, styles_part):
+
+        """
+        Map paragraph style ids to their UI names (e.g. "Heading 1").
+
+        Returns:
+            tuple: (dict of style id to name, name of the default paragraph style or None)
+        """
+
+        styles = {}
+        default_name = None
+        if styles_part is None or styles_part not in archive.namelist():
+            return styles, default_name
+
+        root = etree.fromstring(archive.read(styles_part))
+        for style in root.iter(W_NS + "style"):
+            if style.get(W_NS + "type", "paragraph") != "paragraph":
+                continue
+            name_el = style.find(W_NS + "name")
+            name = None
+            if name_el is not None and name_el.get(W_NS + "val") is not None:
+                name = BabelFish.internal2ui(name_el.get(W_NS + "val"))
+            style_id = style.get(W_NS + "styleId")
+            if style_id not in styles:
+                styles[style_id] = name
+            if style.get(W_NS + "default") in ("1", "true", "on"):
+                default_name = name
+        return styles, default_name
+
+
+    def paragraph_text(self, p):
+
+        """
+        Return the text of a <w:p> element the same way python-docx's paragraph.text does:
+        runs and hyperlink runs only, with tabs and line breaks translated.
+        """
+
+        parts = []
+        for child in p:
+            if child.tag == W_NS + "r":
+                runs = (child,)
+            elif child.tag == W_NS + "hyperlink":
+                runs = child.iterfind(W_NS + "r")
+            else:
+                continue
+            for run in runs:
+                for el in run:
+                    tag = el.tag
+                    if tag == W_NS + "t":
+                        parts.append(el.text or "")
+                    elif tag == W_NS + "br":
+                        if el.get(W_NS + "type", "textWrapping") == "textWrapping":
+                            parts.append("\n")
+                    elif tag in RUN_TEXT_TAGS:
+                        parts.append(RUN_TEXT_TAGS[tag])
+        return "".join(parts)
+
+
+    def stream_paragraphs(self, docx_path):
+
+        """
+        Yield (style name, text, list level) for each body paragraph by streaming the document XML
+        out of the zip, without building the python-docx object model. Each paragraph is inspected
+        once and discarded, so memory stays bounded for large documents.
+
+        Parameters:
+            docx_path (str): The file path of the .docx document.
+        """
+
+        with zipfile.ZipFile(docx_path) as archive:
+            document_part, styles_part = self.read_document_part_names(archive)
+            styles, default_style = self.read_paragraph_styles(archive, styles_part)
+
+            with archive.open(document_part) as xml_file:
+                depth = 0
+                body = None
+                for event, elem in etree.iterparse(xml_file, events=("start", "end")):
+                    if event == "start":
+                        depth += 1
+                        if depth == 2 and elem.tag == W_NS + "body":
+                            body = elem
+                        continue
+
+                    depth -= 1
+                    # Only direct children of <w:body> are paragraphs of the document (not table cells).
+                    if depth != 2 or body is None:
+                        continue
+
+                    if elem.tag == W_NS + "p":
+                        pPr = elem.find(W_NS + "pPr")
+                        style_name = default_style
+                        if pPr is not None:
+                            pStyle = pPr.find(W_NS + "pStyle")
+                            if pStyle is not None:
+                                style_name = styles.get(pStyle.get(W_NS + "val"), default_style)
+                        yield style_name, self.paragraph_text(elem), self.list_level_from_pPr(pPr)
+
+                    # Drop processed body children to keep memory bounded.
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del body[0]
+
+
+    def read_paragraph_source(self, docx_path, backend):
+
+        """
+        Return the (style name, text, list level) paragraph iterator for the requested backend.
+
+        Parameters:
+            docx_path (str): The file path of the .docx document.
+            backend (str): "docx" to read through python-docx, or "stream" to stream the XML directly.
+        """
+
+        if backend == "docx":
+            return self.read_paragraphs(docx_path)
+        if backend == "stream":
+            return self.stream_paragraphs(docx_path)
+        raise ValueError(f"Unknown backend '{backend}'")
+
+
+    def docx_to_text(self, docx_path, backend="docx"):
 
         """     
         The method reads the .docx file, processes paragraphs to handle bullet lists 
@@ -147,27 +343,73 @@ class ConvertPlainTxt:
         
         Parameters:
             docx_path (str): The file path of the .docx document.
+            backend (str): "docx" to read through python-docx, or "stream" to stream the XML
+                directly (faster, bounded memory, identical output).
         
         Returns:
             str: The processed plain text output.
         """
-        
-        document = Document(docx_path)
-        paragraphs = document.paragraphs
 
+        return self.paragraphs_to_text(self.read_paragraph_source(docx_path, backend))
+
+
+    def docx_to_lines(self, docx_path, backend="stream"):
+
+        """
+        Yield the processed lines of a .docx file one at a time, with "<SEP>" delimiters
+        already applied. Joining them with newlines gives the output of docx_to_text.
+
+        Parameters:
+            docx_path (str): The file path of the .docx document.
+            backend (str): "stream" (default) or "docx".
+
+        Yields:
+            str: Processed lines.
+        """
+
+        yield from self.delimit_lines(self.collapse_blank_lines(
+            self.merge_bullet_lists(self.read_paragraph_source(docx_path, backend))))
+
+
+    def paragraphs_to_text(self, paragraphs):
+
+        """
+        Build the processed plain text from an iterable of (style name, text, list level) tuples.
+
+        Parameters:
+            paragraphs (iterable): Paragraph tuples as produced by read_paragraphs or stream_paragraphs.
+
+        Returns:
+            str: The processed plain text output.
+        """
+
+        return "\n".join(self.delimit_lines(self.collapse_blank_lines(self.merge_bullet_lists(paragraphs))))
+
+
+    def merge_bullet_lists(self, paragraphs):
+
+        """
+        Turn paragraphs into output lines, skipping Heading 1 paragraphs and merging each bullet
+        list block (with its optional colon-ending intro) into a single line.
+
+        Parameters:
+            paragraphs (iterable): (style name, text, list level) tuples.
+
+        Yields:
+            str: Output lines.
+        """
 
-        output_lines = []
         in_list = False
         explicit_intro = None   # If a bullet list starts with an explicit intro (a colon-ending paragraph)
         current_bullets = []    # List of dictionaries: each is {"text": <top bullet>, "nested": [<nested bullet texts>]}
         
-        for para in paragraphs:
+        for style_name, text, lvl in paragraphs:
 
             # Skip Heading 1 lines
-            if para.style and para.style.name == "Heading 1":
+            if style_name == "Heading 1":
                 continue
 
-            text = para.text.strip()
+            text = text.strip()
 
             if not in_list:
                 #Check if the paragraph ends with a colon (explicit intro)
@@ -177,22 +419,20 @@ class ConvertPlainTxt:
                     current_bullets = []
                     continue
                 
-                elif self.is_list_paragraph(para):
+                elif lvl is not None:
                     
                     in_list = True
                     explicit_intro = None
                     current_bullets = []
 
-                    lvl = self.get_list_level(para)
                     current_bullets.append({"text": text, "nested": []})
                     continue
                 else:
-                    output_lines.append(text)
+                    yield text
                     continue
                 
             # If already in a bullet list block:
-            if self.is_list_paragraph(para):
-                lvl = self.get_list_level(para)
+            if lvl is not None:
                 if lvl == 0:
                     # Top-level bullet.
                     current_bullets.append({"text": text, "nested": []})
@@ -206,8 +446,7 @@ class ConvertPlainTxt:
                         current_bullets.append({"text": text, "nested": []})
             else:
                 if in_list:
-                    merged = self.finalize_bullet_list(explicit_intro, current_bullets)
-                    output_lines.append(merged)
+                    yield self.finalize_bullet_list(explicit_intro, current_bullets)
                    
                     in_list = False
                     explicit_intro = None
@@ -218,33 +457,38 @@ class ConvertPlainTxt:
                     in_list = True
                     current_bullets = []
                 else:
-                    output_lines.append(text)
+                    yield text
 
                     
         #Finalize any remaining bullet list block.
         if in_list:
-            merged = self.finalize_bullet_list(explicit_intro, current_bullets)
-            output_lines.append(merged)
-            
-
-        final_lines = self.collapse_blank_lines(output_lines)
-                       
-        #Determine indices for non-heading lines where delimiters should be added.
-        non_heading_indices = [
-            i for i, line in enumerate(final_lines)
-            if line.strip() and self.add_delimiter(line)
-            ]
-        
-        processed_lines = []
-        for i, line in enumerate(final_lines):
-            if line.strip() and self.add_delimiter(line):
-                if non_heading_indices and i != non_heading_indices[-1]:
-                    processed_lines.append(line + "<SEP>")
-                else:
-                    processed_lines.append(line)
+            yield self.finalize_bullet_list(explicit_intro, current_bullets)
+
+
+    def delimit_lines(self, lines):
+
+        """
+        Append "<SEP>" to every line that needs a delimiter except the last such line.
+        Lines after the most recent delimited line are held back until the next delimited
+        line (or the end) is seen, so only a short run of headings is ever buffered.
+
+        Parameters:
+            lines (iterable): Output lines with blank runs collapsed.
+
+        Yields:
+            str: Lines with delimiters applied.
+        """
+
+        pending = []    # The last delimited line seen so far, followed by any lines after it.
+        for line in lines:
+            if self.add_delimiter(line):
+                if pending:
+                    yield pending[0] + "<SEP>"
+                    yield from pending[1:]
+                pending = [line]
+            elif pending:
+                pending.append(line)
             else:
-                processed_lines.append(line)
-        
-        full_text = "\n".join(processed_lines)
-         
-        return full_text
+                yield line
+
+        yield from pending
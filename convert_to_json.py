@@ -1,53 +1,21 @@
-import re
 import json
 import os
+from heading_classifier import HeadingClassifier
 
 
 class ConvertToJson:
 
-    def __init__(self):
+    def __init__(self, heading_classifier=None):
         
         """
-        Initialize the ConvertToJson instance with regex patterns for detecting section and subsection headings.
-        """
-
-        #patterns for headings
-        self.section_pattern = re.compile(r'^(\d+\. )(.+)$')           
-        self.subsection_pattern = re.compile(r'^(\d+(?:\.\d+)+\.?\s)(.+)$')
-
-    def parse_heading_line(self, line, pattern, split=True):
+        Initialize the ConvertToJson instance with the shared classifier for section and subsection headings.
 
-        """      
-        If 'split' is True and a colon is present in the line, the heading is split at the colon
-        into a heading part and extra content.
-        
         Parameters:
-            line (str): The heading line to parse.
-            pattern (re.Pattern): The regex pattern to match the heading.
-            split (bool): Determines whether to split the heading at a colon.
-        
-        Returns:
-            tuple: A tuple (heading, extra_content) where extra_content is an empty string if not applicable.
+            heading_classifier (HeadingClassifier): Classifier to use, e.g. the one of a ConvertPlainTxt, so lines
+                                                    it has already classified are cache hits. A new one by default.
         """
 
-        match = pattern.match(line)
-        if not match:
-            return line, ""
-
-        if not split:
-            return line, ""
-
-        prefix = match.group(1)
-        rest = match.group(2)
-
-        colon_index = rest.find(":")
-        if colon_index != -1:
-            heading = prefix + rest[:colon_index].strip()
-            extra_content = rest[colon_index+1:].strip()
-            return heading, extra_content
-
-        else:
-            return line, ""
+        self.heading_classifier = heading_classifier or HeadingClassifier()
 
 
     def parse_document(self, text):
@@ -64,67 +32,80 @@ class ConvertToJson:
             list: A list of dictionaries containing parsed document structure.
         """
 
-        lines = text.splitlines()
-        data = []
+        return list(self.iter_records(text.splitlines()))
+
+
+    def iter_records(self, lines):
+
+        """
+        Generator form of parse_document that consumes lines one at a time, so records can be produced
+        straight from ConvertPlainTxt.docx_to_lines without building the whole document string.
+        Lines containing embedded line breaks are split the same way str.splitlines would.
+
+        Parameters:
+            lines (iterable): Lines of the processed document.
+
+        Yields:
+            dict: Records with keys "Section", "Subsection" and "Content".
+        """
+
         current_section = None
         current_subsection = None
         content_lines = []
         
 
-        def flush_group():
+        def make_group():
             """
-            Helper function to flush the current group of content lines into the data list.
+            Helper function that turns the current group of content lines into a record, or None if it is empty.
             """
-            nonlocal current_section, current_subsection, content_lines
             if content_lines:
-                group = {
+                return {
                     "Section": current_section,
                     "Subsection": current_subsection,
                     "Content": " ".join(content_lines).strip()
                     }
-                data.append(group)
-                content_lines = []
-
-
-        for line in lines:
-
-            line = line.strip()
-            if not line:
-                continue
-
-            #Process subsection headings.
-            if self.subsection_pattern.match(line):
-                flush_group()
+            return None
+
+
+        for raw_line in lines:
+            for line in raw_line.splitlines():
+
+                line = line.strip()
+                if not line:
+                    continue
+
+                heading = self.heading_classifier.classify(line)
+
+                #Process subsection headings; the heading is split at a colon and numbering removed.
+                if heading.kind == "subsection":
+                    group = make_group()
+                    if group:
+                        yield group
+                        content_lines = []
+                    
+                    current_subsection = heading.title
+                    if heading.content:
+                        content_lines.append(heading.content)
+                    continue
+
+                # Process section headings with numbering removed.
+                if heading.kind == "section":
+                    group = make_group()
+                    if group:
+                        yield group
+                        content_lines = []
+                    
+                    current_section = heading.title
+                    current_subsection = None
+                    continue
                 
-                current_subsection, extra = self.parse_heading_line(line, self.subsection_pattern, split=True)
-                # Remove numbering from the subsection heading.
-                match = re.match(r'^(\d+(?:\.\d+)+\.?\s)(.+)$', current_subsection)
-                if match:
-                    current_subsection = match.group(2)
-                if extra:
-                    content_lines.append(extra)
-                continue
-
-            # Process section headings (only if not a subsection).
-            if self.section_pattern.match(line) and not self.subsection_pattern.match(line):
-                flush_group()
-                
-                current_section, extra = self.parse_heading_line(line, self.section_pattern, split=False)
-                #Remove numbering from the section heading.
-                match = re.match(r'^(\d+\. )(.+)$', current_section)
-                if match:
-                    current_section = match.group(2)
-                current_subsection = None
-                if extra:
-                    content_lines.append(extra)
-                continue
-            
-            #Regular content lines are appended to the current content group.
-            content_lines.append(line)
+                #Regular content lines are appended to the current content group.
+                content_lines.append(line)
 
         #Flush any remaining content after processing all lines.
-        flush_group()
-        return data
+        group = make_group()
+        if group:
+            yield group
 
 
     def parse_and_save(self, text, output_file):
@@ -137,7 +118,20 @@ class ConvertToJson:
             output_file (str): The file path to save the JSON output.
         """
 
-        data = self.parse_document(text)
+        self.save_records(self.parse_document(text), output_file)
+
+
+    def save_records(self, records, output_file):
+
+        """
+        Save structured records as a JSON file, in the same format as parse_and_save.
+
+        Parameters:
+            records (iterable): Records with keys "Section", "Subsection" and "Content".
+            output_file (str): The file path to save the JSON output.
+        """
+
+        data = list(records)
 
         with open(output_file, "w", encoding ='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
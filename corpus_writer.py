@@ -0,0 +1,141 @@
+import os
+import json
+
+
+CORPUS_COLUMNS = ["Document", "Section", "Subsection", "Content", "Source"]
+
+
+def document_name(file_path):
+
+    """
+    Derive the document name from a file name, e.g. "Practical Advice Note - Domestic Abuse.json" -> "Domestic Abuse".
+
+    Parameters:
+        file_path (str): Path or name of the source file.
+
+    Returns:
+        str: The document name.
+    """
+
+    file_name_no_ext = os.path.splitext(os.path.basename(file_path))[0]
+    if "-" in file_name_no_ext:
+        return file_name_no_ext.split("-")[-1].strip()
+    return file_name_no_ext
+
+
+class CorpusWriter:
+
+    def __init__(self, corpus_dir, corpus_format="jsonl", shard_size=50000):
+
+        """
+        Write records from many documents into one sharded corpus that load_dataset can read in a single call.
+
+        Each row has the columns Document, Section, Subsection, Content and Source (the path of the source
+        document relative to the ingestion root), filled in at write time.
+
+        Parameters:
+            corpus_dir (str): Directory that receives the shard files. Existing shards of either format are removed,
+                              so the directory only holds the corpus being written.
+            corpus_format (str): "jsonl" or "parquet".
+            shard_size (int): Maximum number of rows per shard.
+        """
+
+        if corpus_format not in ("jsonl", "parquet"):
+            raise ValueError(f"Unknown corpus format '{corpus_format}'")
+
+        self.corpus_dir = corpus_dir
+        self.corpus_format = corpus_format
+        self.shard_size = shard_size
+
+        self.shard_paths = []
+        self.num_rows = 0
+        self._rows = []
+        self._jsonl_file = None
+        self._shard_rows = 0
+
+        os.makedirs(corpus_dir, exist_ok=True)
+        for file in os.listdir(corpus_dir):
+            if file.startswith("corpus-") and file.endswith((".jsonl", ".parquet")):
+                os.remove(os.path.join(corpus_dir, file))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def _next_shard_path(self):
+        path = os.path.join(self.corpus_dir, f"corpus-{len(self.shard_paths):05d}.{self.corpus_format}")
+        self.shard_paths.append(path)
+        return path
+
+
+    def write_document(self, records, source):
+
+        """
+        Append the records of one document to the corpus.
+
+        Parameters:
+            records (iterable): Records with keys "Section", "Subsection" and "Content".
+            source (str): Path of the source document, used for the Document and Source columns.
+        """
+
+        doc = document_name(source)
+        for record in records:
+            self.write_row({
+                "Document": doc,
+                "Section": record.get("Section"),
+                "Subsection": record.get("Subsection"),
+                "Content": record.get("Content"),
+                "Source": source,
+            })
+
+
+    def write_row(self, row):
+
+        """
+        Append a single row, starting a new shard once the current one is full.
+        """
+
+        self.num_rows += 1
+        if self.corpus_format == "jsonl":
+            if self._jsonl_file is None:
+                self._jsonl_file = open(self._next_shard_path(), "w", encoding="utf-8")
+            self._jsonl_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self._shard_rows += 1
+            if self._shard_rows >= self.shard_size:
+                self._jsonl_file.close()
+                self._jsonl_file = None
+                self._shard_rows = 0
+        else:
+            self._rows.append(row)
+            if len(self._rows) >= self.shard_size:
+                self._flush_parquet()
+
+
+    def _flush_parquet(self):
+        if not self._rows:
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(column, pa.string()) for column in CORPUS_COLUMNS])
+        pq.write_table(pa.Table.from_pylist(self._rows, schema=schema), self._next_shard_path())
+        self._rows = []
+
+
+    def close(self):
+
+        """
+        Flush any buffered rows and close the current shard.
+        """
+
+        if self._jsonl_file is not None:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+            self._shard_rows = 0
+        self._flush_parquet()
@@ -0,0 +1,187 @@
+import math
+import difflib
+from collections import Counter
+
+import numpy as np
+
+
+def question_line(example):
+
+    """
+    Return the text after "Question:" on the first question line of a few-shot example, or None if it has none.
+    """
+
+    for line in example.split("\n"):
+        if line.startswith("Question:"):
+            return line[len("Question:"):].strip()
+    return None
+
+
+def char_ngrams(text, ngram_range=(3, 5)):
+
+    """
+    Count the character n-grams of a lower-cased text, padded with a space at both ends so that
+    word starts and ends get their own n-grams.
+
+    Returns:
+        Counter: n-gram -> number of occurrences.
+    """
+
+    text = " " + " ".join(text.lower().split()) + " "
+    low, high = ngram_range
+    return Counter(text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1))
+
+
+class FewShotIndex:
+
+    def __init__(self, examples, ngram_range=(3, 5), dense_fraction=0.05):
+
+        """
+        Character n-gram TF-IDF index over the "Question:" lines of few-shot examples, built once so lookups
+        do not rescan or re-split the examples.
+
+        Rare n-grams are stored as an inverted index (n-gram -> example ids and weights), so a query only
+        touches their postings. N-grams shared by many examples, such as those of a common question template,
+        are stored as dense rows and scored with one matrix-vector product.
+
+        Parameters:
+            examples (list): Few-shot example strings. Examples without a "Question:" line are never returned.
+            ngram_range (tuple): Smallest and largest n-gram length.
+            dense_fraction (float): N-grams found in more than this share of the examples get a dense row.
+        """
+
+        self.ngram_range = ngram_range
+        self.examples = [ex for ex in examples if question_line(ex) is not None]
+        self.questions = [question_line(ex).lower() for ex in self.examples]
+        counts = [char_ngrams(question, ngram_range) for question in self.questions]
+
+        document_frequency = Counter(gram for count in counts for gram in count)
+        num_examples = len(self.examples)
+        # Smoothed idf, as in scikit-learn's TfidfVectorizer.
+        self.idf = {gram: math.log((1 + num_examples) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+
+        postings = {}
+        for doc_id, count in enumerate(counts):
+            weights = {gram: tf * self.idf[gram] for gram, tf in count.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, w in weights.items():
+                postings.setdefault(gram, []).append((doc_id, w / norm))
+
+        # Dense n-grams: gram_rows maps each to its row of the dense matrix.
+        # Sparse n-grams: gram_slices maps each to its range in the flat doc_ids/weights arrays.
+        dense_grams = [gram for gram, entries in postings.items() if len(entries) > dense_fraction * num_examples]
+        self.gram_rows = {gram: row for row, gram in enumerate(dense_grams)}
+        self.dense = np.zeros((len(dense_grams), num_examples), dtype=np.float32)
+        self.gram_slices = {}
+        doc_ids, weights = [], []
+        for gram, entries in postings.items():
+            if gram in self.gram_rows:
+                row = self.dense[self.gram_rows[gram]]
+                for doc_id, w in entries:
+                    row[doc_id] = w
+                continue
+            self.gram_slices[gram] = (len(doc_ids), len(doc_ids) + len(entries))
+            for doc_id, w in entries:
+                doc_ids.append(doc_id)
+                weights.append(w)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+
+    def __len__(self):
+        return len(self.examples)
+
+
+    def scores(self, query):
+
+        """
+        Cosine similarity between the query and every indexed question.
+
+        Returns:
+            numpy.ndarray: One score per example, in index order.
+        """
+
+        query_weights = {gram: tf * self.idf[gram] for gram, tf in char_ngrams(query, self.ngram_range).items()
+                         if gram in self.idf}
+        if not query_weights or not self.examples:
+            return np.zeros(len(self.examples))
+
+        norm = math.sqrt(sum(w * w for w in query_weights.values()))
+        scores = np.zeros(len(self.examples), dtype=np.float32)
+
+        dense = [(self.gram_rows[gram], w / norm) for gram, w in query_weights.items() if gram in self.gram_rows]
+        if dense:
+            rows, values = zip(*dense)
+            scores += np.asarray(values, dtype=np.float32) @ self.dense[list(rows)]
+
+        sparse = [(self.gram_slices[gram], w / norm) for gram, w in query_weights.items() if gram in self.gram_slices]
+        if sparse:
+            positions = np.concatenate([np.arange(start, end) for (start, end), _ in sparse])
+            query_values = np.concatenate([np.full(end - start, w, dtype=np.float32) for (start, end), w in sparse])
+            scores += np.bincount(self.doc_ids[positions], weights=self.weights[positions] * query_values,
+                                  minlength=len(self.examples)).astype(np.float32)
+        return scores
+
+
+    def top_ids(self, query, k=1):
+
+        """
+        Return the positions of the k best-scoring examples, best first; ties keep the order of the examples
+        and examples with a score of 0 are left out.
+        """
+
+        scores = self.scores(query)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            # argpartition does not keep ties in order, so include every example tied with the k-th score.
+            candidates = np.flatnonzero(scores >= scores[candidates].min())
+        else:
+            candidates = np.arange(len(scores))
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")][:k]
+        return [int(i) for i in ranked if scores[i] > 0], scores
+
+
+    def search(self, query, k=1):
+
+        """
+        Return the k examples whose questions are most similar to the query.
+
+        Parameters:
+            query (str): The text to match, e.g. the first sentence of the user prompt.
+            k (int): Number of examples to return.
+
+        Returns:
+            list: (example, score) tuples, best first.
+        """
+
+        ids, scores = self.top_ids(query, k)
+        return [(self.examples[i], float(scores[i])) for i in ids]
+
+
+    def closest(self, query, candidates=4):
+
+        """
+        Return the example most similar to the query. The index shortlists the best candidates and the
+        shortlist is ranked with the same difflib ratio the linear scan used, so the pick agrees with the
+        scan whenever its choice is in the shortlist; candidates=1 uses the TF-IDF ranking alone.
+
+        Parameters:
+            query (str): The text to match, e.g. the first sentence of the user prompt.
+            candidates (int): Size of the shortlist.
+
+        Returns:
+            str or None: The closest example, or None if no example shares an n-gram with the query.
+        """
+
+        ids, _ = self.top_ids(query, candidates)
+        if len(ids) <= 1:
+            return self.examples[ids[0]] if ids else None
+
+        query = query.lower()
+        best_id, best_ratio = None, -1.0
+        # Visit the shortlist in example order so ties resolve like the linear scan.
+        for i in sorted(ids):
+            ratio = difflib.SequenceMatcher(None, query, self.questions[i]).ratio()
+            if ratio > best_ratio:
+                best_id, best_ratio = i, ratio
+        return self.examples[best_id]
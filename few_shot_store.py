@@ -0,0 +1,159 @@
+import os
+import threading
+
+from few_shot_index import FewShotIndex
+
+
+def category_name(file_name):
+
+    """
+    Derive the category key of a few-shot file, e.g. "Intro-prompts.txt" -> "intro", "definition-prompts.txt" -> "definition".
+    """
+
+    stem = os.path.splitext(file_name)[0].lower()
+    if stem.endswith("-prompts"):
+        stem = stem[:-len("-prompts")]
+    return stem
+
+
+class FewShotCategory:
+
+    def __init__(self, path, examples, stat):
+
+        """
+        The parsed examples of one few-shot file, with the retrieval index over them.
+
+        Parameters:
+            path (str): Path of the few-shot file.
+            examples (list): Example strings, separated by blank lines in the file.
+            stat (os.stat_result): File status at load time, used to notice changes.
+        """
+
+        self.path = path
+        self.examples = tuple(examples)
+        self.index = FewShotIndex(self.examples)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        # Example -> token count, filled in by the prompt builder; a reload starts with an empty cache.
+        self.token_lengths = {}
+
+
+class FewShotStore:
+
+    def __init__(self, resource_dir="./prompt resources", poll_interval=2.0):
+
+        """
+        Load every "*.txt" few-shot file under resource_dir once and keep the parsed examples and their
+        retrieval indexes in memory. A background thread checks the files' modification times every
+        poll_interval seconds and reloads only the categories whose file changed, so lookups never touch the disk.
+
+        Parameters:
+            resource_dir (str): Directory containing the few-shot files.
+            poll_interval (float): Seconds between checks for changed files, or None to disable reloading.
+        """
+
+        self.resource_dir = resource_dir
+        self.poll_interval = poll_interval
+        self.categories = {}
+        self.reloads = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.refresh()
+
+        self.watcher = None
+        if poll_interval:
+            self.watcher = threading.Thread(target=self.watch, daemon=True)
+            self.watcher.start()
+
+
+    def load_category(self, path, stat):
+
+        """
+        Read and split one few-shot file. Examples are expected to be separated by two newlines.
+        """
+
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        return FewShotCategory(path, content.split("\n\n") if content else [], stat)
+
+
+    def refresh(self):
+
+        """
+        Reload the categories whose file was added, changed or removed since the last check.
+
+        Returns:
+            list: Names of the categories that were reloaded or removed.
+        """
+
+        try:
+            files = [f for f in os.listdir(self.resource_dir) if f.lower().endswith(".txt")]
+        except OSError:
+            files = []
+
+        categories = dict(self.categories)
+        changed = []
+        seen = set()
+        for file in sorted(files):
+            path = os.path.join(self.resource_dir, file)
+            name = category_name(file)
+            seen.add(name)
+            try:
+                stat = os.stat(path)
+                current = categories.get(name)
+                if current is not None and current.signature == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                categories[name] = self.load_category(path, stat)
+            except (OSError, UnicodeDecodeError) as e:
+                # Keep serving the previous version of a file that is being rewritten.
+                print(f"Could not load few-shot file {path}: {e}")
+                continue
+            changed.append(name)
+
+        for name in set(categories) - seen:
+            del categories[name]
+            changed.append(name)
+
+        if changed:
+            # Readers see either the old or the new mapping, never a partly updated one.
+            with self.lock:
+                self.categories = categories
+                self.reloads += 1
+        return changed
+
+
+    def watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            self.refresh()
+
+
+    def get(self, category):
+
+        """
+        Return the loaded few-shot category for a detected prompt category.
+
+        The category matches a file when its lower-cased name starts with the file's category key,
+        so "Introduction" finds "Intro-prompts.txt" and "Definition" finds "definition-prompts.txt".
+
+        Parameters:
+            category (str): The category of the prompt, e.g. "Introduction".
+
+        Returns:
+            FewShotCategory or None: The category's examples and index, or None if there is no matching file.
+        """
+
+        if not category:
+            return None
+        with self.lock:
+            categories = self.categories
+        category = category.lower()
+        if category in categories:
+            return categories[category]
+        for name in sorted(categories, key=len, reverse=True):
+            if name and category.startswith(name):
+                return categories[name]
+        return None
+
+
+    def stop(self):
+        self.stopped.set()
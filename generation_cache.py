@@ -0,0 +1,159 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+
+def normalise_prompt(prompt):
+
+    """
+    Normalise a prompt for cache lookups: Unicode NFC, runs of whitespace collapsed to one space, ends stripped.
+    Case and punctuation are kept because they change what the model generates.
+    """
+
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", prompt)).strip()
+
+
+def checkpoint_fingerprint(model_dir):
+
+    """
+    Hash the adapter checkpoint in model_dir (adapter weights and config) so cached results are invalidated
+    when the model is retrained. Falls back to the names, sizes and modification times of the weight files.
+
+    Parameters:
+        model_dir (str): Directory of the fine-tuned adapter or merged model.
+
+    Returns:
+        str: Hex digest identifying the checkpoint.
+    """
+
+    digest = hashlib.sha256()
+    files = sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []
+    adapter_files = [f for f in files if f.startswith("adapter_")]
+
+    if adapter_files:
+        for file in adapter_files:
+            digest.update(file.encode("utf-8"))
+            with open(os.path.join(model_dir, file), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    else:
+        for file in files:
+            if file.endswith((".safetensors", ".bin", ".json")):
+                stat = os.stat(os.path.join(model_dir, file))
+                digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class GenerationCache:
+
+    def __init__(self, path, checkpoint="", max_entries=10000, ttl=None):
+
+        """
+        Persistent cache of generated text in SQLite, bounded in size with least-recently-used eviction
+        and an optional time to live.
+
+        Parameters:
+            path (str): SQLite database file.
+            checkpoint (str): Fingerprint of the model checkpoint, part of every key.
+            max_entries (int): Maximum number of cached results.
+            ttl (float): Seconds a result stays valid, or None for no expiry.
+        """
+
+        self.path = path
+        self.checkpoint = checkpoint
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS generations_last_access ON generations (last_access)")
+        self.connection.commit()
+
+
+    def make_key(self, prompt, params):
+
+        """
+        Build the cache key from the normalised prompt, the decoding parameters and the checkpoint fingerprint.
+        """
+
+        payload = json.dumps([normalise_prompt(prompt), sorted(params.items()), self.checkpoint], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+    def get(self, prompt, params):
+
+        """
+        Return the cached text for a prompt and decoding parameters, or None on a miss or an expired entry.
+        """
+
+        key = self.make_key(prompt, params)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT text, created FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.connection.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.connection.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+
+    def put(self, prompt, params, text):
+
+        """
+        Store a generated text and evict the least recently used entries beyond max_entries.
+        """
+
+        key = self.make_key(prompt, params)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO generations (key, text, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, text, now, now),
+            )
+            self.connection.execute(
+                "DELETE FROM generations WHERE key IN ("
+                "SELECT key FROM generations ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+
+    def stats(self):
+
+        """
+        Return hit/miss counts for this process, the hit rate and the number of stored entries.
+        """
+
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "entries": entries,
+        }
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
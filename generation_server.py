@@ -0,0 +1,295 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from TextGen import TextGenerator
+
+
+DECODING_DEFAULTS = {"max_length": 600, "num_beams": 5, "length_penalty": 2.0, "no_repeat_ngram_size": 3}
+
+
+class GenerationRequest:
+
+    def __init__(self, prompt, params):
+
+        """
+        A queued generation request.
+
+        Parameters:
+            prompt (str): The full prompt passed to the model.
+            params (dict): Decoding parameters; requests with equal params can share a batch.
+        """
+
+        self.prompt = prompt
+        self.params = params
+        self.batch_key = tuple(sorted(params.items()))
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.latency = None
+
+
+class GenerationServer:
+
+    def __init__(self, generator, batch_window=0.02, max_batch_size=16, latency_history=1000, request_timeout=None):
+
+        """
+        Keep one TextGenerator loaded and serve queued requests from a background worker, grouping requests
+        with the same decoding parameters that arrive within batch_window seconds into one generate_batch call.
+
+        Parameters:
+            generator (TextGenerator): The loaded generator.
+            batch_window (float): Seconds to wait for more compatible requests after the first one of a batch.
+            max_batch_size (int): Maximum number of requests per batch.
+            latency_history (int): Number of recent request latencies kept for the metrics.
+            request_timeout (float): Seconds submit waits for a result by default, or None to wait indefinitely.
+        """
+
+        self.generator = generator
+        self.request_timeout = request_timeout
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.latencies = deque(maxlen=latency_history)
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.stopped = False
+
+        self.worker = threading.Thread(target=self.run_worker, daemon=True)
+        self.worker.start()
+
+
+    def submit(self, prompt, params, timeout=None):
+
+        """
+        Queue a request and wait for its result, at most timeout seconds (request_timeout if None).
+
+        Returns:
+            GenerationRequest: The request, with result or error set unless it timed out.
+        """
+
+        request = GenerationRequest(prompt, params)
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify()
+        request.done.wait(timeout if timeout is not None else self.request_timeout)
+        return request
+
+
+    def next_batch(self):
+
+        """
+        Block until a request is queued, then collect compatible requests that arrive within the batch window.
+        Requests with other decoding parameters stay queued in order for a later batch.
+        """
+
+        with self.condition:
+            while not self.pending and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return []
+
+            first = self.pending.popleft()
+            batch = [first]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                for request in list(self.pending):
+                    if request.batch_key == first.batch_key:
+                        self.pending.remove(request)
+                        batch.append(request)
+                        if len(batch) == self.max_batch_size:
+                            break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or len(batch) == self.max_batch_size:
+                    break
+                self.condition.wait(remaining)
+            return batch
+
+
+    def run_worker(self):
+
+        """
+        Worker loop: run each batch through TextGenerator.generate_batch and hand results back to the waiting requests.
+        """
+
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+
+            try:
+                texts = self.generator.generate_batch([request.prompt for request in batch],
+                                                      batch_size=len(batch), **batch[0].params)
+            except Exception as e:
+                texts = None
+                error = str(e)
+
+            finished = time.perf_counter()
+            with self.condition:
+                self.batches += 1
+                for i, request in enumerate(batch):
+                    request.latency = finished - request.enqueued
+                    if texts is None:
+                        request.error = error
+                        self.failed += 1
+                    else:
+                        request.result = texts[i]
+                        self.completed += 1
+                        self.latencies.append(request.latency)
+                    request.done.set()
+
+
+    def metrics(self):
+
+        """
+        Return queue depth, request counts, average batch size and recent latency percentiles.
+        """
+
+        with self.condition:
+            latencies = sorted(self.latencies)
+            queue_depth = len(self.pending)
+            completed, failed, batches = self.completed, self.failed, self.batches
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+
+        metrics = {
+            "queue_depth": queue_depth,
+            "completed": completed,
+            "failed": failed,
+            "batches": batches,
+            "mean_batch_size": (completed + failed) / batches if batches else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+        metrics["decoding"] = dict(self.generator.decode_stats)
+        if hasattr(self.generator, "memory_report"):
+            metrics["workers"] = self.generator.memory_report()
+        if self.generator.cache is not None:
+            metrics["cache"] = self.generator.cache.stats()
+        return metrics
+
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+
+    """
+    HTTP front-end: POST /generate with {"prompt": ..., "few_shot": true, <decoding params>, "max_new_tokens": optional}
+    and GET /metrics.
+    """
+
+    server_version = "LawContentGenerator/1.0"
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.server.generation_server.metrics())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            prompt = payload["prompt"]
+            params = {key: type(default)(payload.get(key, default)) for key, default in DECODING_DEFAULTS.items()}
+            if payload.get("max_new_tokens") is not None:
+                params["max_new_tokens"] = int(payload["max_new_tokens"])
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {"error": f"invalid request: {e}"})
+            return
+
+        generation_server = self.server.generation_server
+        if payload.get("few_shot", True):
+            prompt = generation_server.generator.build_few_shot_prompt(prompt, max_length=params["max_length"])
+
+        request = generation_server.submit(prompt, params)
+        if request.error is not None:
+            self.send_json(500, {"error": request.error})
+        elif request.result is None:
+            self.send_json(504, {"error": "generation timed out"})
+        else:
+            self.send_json(200, {"text": request.result, "latency": request.latency})
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8000, model_dir="./GPTtrained/final_model", merged_model_dir="./GPTtrained/merged_model",
+          batch_window=0.02, max_batch_size=16, cache_path="./generation_cache.sqlite", quantize=False, workers=1,
+          request_timeout=600.0):
+
+    """
+    Load the model once and serve generation requests over HTTP until interrupted. With workers > 1 each batch is
+    split between that many worker processes sharing one memory-mapped copy of the weights.
+    """
+
+    if workers > 1:
+        if quantize:
+            raise ValueError("--quantize is not supported with several workers; the shared weights are fp32")
+        from generation_workers import GenerationWorkerPool
+        generator = GenerationWorkerPool(num_workers=workers, model_dir=model_dir, merged_model_dir=merged_model_dir,
+                                         cache_path=cache_path)
+    else:
+        generator = TextGenerator(model_dir=model_dir, merged_model_dir=merged_model_dir, cache_path=cache_path,
+                                  quantize=quantize)
+    httpd = ThreadingHTTPServer((host, port), GenerationRequestHandler)
+    httpd.generation_server = GenerationServer(generator, batch_window=batch_window, max_batch_size=max_batch_size,
+                                               request_timeout=request_timeout)
+    print(f"Serving generation on http://{host}:{port} (POST /generate, GET /metrics)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting.")
+    finally:
+        httpd.generation_server.stop()
+        httpd.server_close()
+        if workers > 1:
+            generator.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Persistent text generation server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model-dir", default="./GPTtrained/final_model")
+    parser.add_argument("--merged-model-dir", default="./GPTtrained/merged_model")
+    parser.add_argument("--batch-window", type=float, default=0.02)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--cache-path", default="./generation_cache.sqlite", help="SQLite result cache; empty to disable")
+    parser.add_argument("--quantize", action="store_true", help="serve an int8 dynamically quantised model on the CPU")
+    parser.add_argument("--workers", type=int, default=1, help="generation processes sharing one copy of the weights")
+    parser.add_argument("--request-timeout", type=float, default=600.0,
+                        help="seconds a request waits for its result before a 504; 0 to wait indefinitely")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.model_dir, args.merged_model_dir, args.batch_window, args.max_batch_size,
+          args.cache_path or None, args.quantize, args.workers, args.request_timeout or None)
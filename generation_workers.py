@@ -0,0 +1,296 @@
+import os
+import queue
+import itertools
+import threading
+import multiprocessing
+
+from TextGen import TextGenerator
+from generation_cache import GenerationCache, checkpoint_fingerprint
+
+
+def process_memory():
+
+    """
+    Return the memory of the current process in bytes: rss (resident), pss (resident, with shared pages divided
+    between the processes sharing them) and uss (private pages only). Empty on systems without /proc.
+    """
+
+    fields = {"Rss": "rss", "Pss": "pss", "Private_Clean": "uss", "Private_Dirty": "uss"}
+    memory = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    memory[fields[key]] = memory.get(fields[key], 0) + int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
+
+
+def run_worker(worker_id, generator_kwargs, num_threads, tasks, results):
+
+    """
+    Worker process: load a TextGenerator on the shared weights, report readiness, then run generate_batch
+    for every task until it receives None.
+    """
+
+    import torch
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    try:
+        generator = TextGenerator(**generator_kwargs)
+    except Exception as e:
+        results.put(("ready", worker_id, None, str(e), None))
+        return
+    results.put(("ready", worker_id, None, None, process_memory()))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, prompts, params = task
+        try:
+            texts, error = generator.generate_batch(prompts, **params), None
+        except Exception as e:
+            texts, error = None, str(e)
+        results.put((task_id, worker_id, texts, error, {"memory": process_memory(),
+                                                         "decode_stats": dict(generator.decode_stats)}))
+
+
+class GenerationWorkerPool:
+
+    def __init__(self, num_workers=2, model_dir="./GPTtrained/final_model", base_model_dir="./GPT-2",
+                 merged_model_dir="./GPTtrained/merged_model", cache_path=None, cache_size=10000, cache_ttl=None,
+                 few_shot_dir="./prompt resources", num_threads=None, liveness_interval=1.0):
+
+        """
+        Run generation in several worker processes that share one copy of the model weights.
+
+        The parent loads (and if needed merges) the model once and writes its weights to a file in the merged
+        checkpoint directory; each worker memory-maps that file read-only, so the weights stay in the OS page
+        cache once and a worker's private memory is roughly its activations. Workers are started with "spawn",
+        so no torch thread pools are forked. The parent keeps the tokenizer for prompt building and the result
+        cache; it does not hold the model.
+
+        Parameters:
+            num_workers (int): Number of worker processes.
+            model_dir (str): Directory containing the fine-tuned model and adapter.
+            base_model_dir (str): Directory containing the base language model (e.g., GPT-2).
+            merged_model_dir (str): Directory of the merged checkpoint; the shared weight file is written there.
+            cache_path (str): SQLite file for caching generated text, or None to disable the cache.
+            cache_size (int): Maximum number of cached results.
+            cache_ttl (float): Seconds a cached result stays valid, or None for no expiry.
+            few_shot_dir (str): Directory of the few-shot files.
+            num_threads (int): Torch threads per worker. Defaults to the CPU count divided between the workers.
+            liveness_interval (float): Seconds between checks that the workers are still running.
+        """
+
+        from shared_weights import shared_weights_path, save_shared_weights
+
+        self.num_workers = num_workers
+        self.liveness_interval = liveness_interval
+        # Set once a worker has died; every later request fails with it.
+        self.failure = None
+        self.closing = False
+        # Builds prompts and counts tokens in the parent; its weights are only loaded to write the shared file.
+        self.prompt_builder = TextGenerator(model_dir=model_dir, base_model_dir=base_model_dir,
+                                            merged_model_dir=merged_model_dir, few_shot_dir=few_shot_dir, lazy_load=True)
+
+        if not self.prompt_builder.merged_checkpoint_current():
+            # The first load (or the first after retraining) merges the adapter and saves the merged checkpoint there.
+            self.prompt_builder.load()
+        self.weights_path = shared_weights_path(merged_model_dir)
+        if not os.path.exists(self.weights_path):
+            # The merged checkpoint is read once more, from safetensors, and written out in the mappable format.
+            save_shared_weights(self.prompt_builder.model, self.weights_path)
+        # The parent's copy is not needed once the workers can map the file.
+        self.prompt_builder.unload()
+
+        # Results are cached in the parent, so workers never write the SQLite file concurrently.
+        self.cache = None
+        if cache_path:
+            checkpoint = checkpoint_fingerprint(model_dir if os.path.isdir(model_dir) else merged_model_dir)
+            self.cache = GenerationCache(cache_path, checkpoint=checkpoint, max_entries=cache_size, ttl=cache_ttl)
+
+        generator_kwargs = {"model_dir": model_dir, "base_model_dir": base_model_dir, "merged_model_dir": merged_model_dir,
+                            "few_shot_dir": few_shot_dir, "few_shot_poll_interval": None,
+                            "shared_weights_path": self.weights_path}
+        num_threads = num_threads or max(1, (os.cpu_count() or 1) // num_workers)
+
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.workers = [context.Process(target=run_worker, args=(worker_id, generator_kwargs, num_threads,
+                                                                 self.tasks, self.results), daemon=True)
+                        for worker_id in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+        # worker id -> latest memory and decode counters reported by that worker.
+        self.worker_memory = {}
+        self.worker_decode_stats = {}
+        while len(self.worker_memory) < len(self.workers):
+            try:
+                _, worker_id, _, error, memory = self.results.get(timeout=liveness_interval)
+            except queue.Empty:
+                failure = self.dead_worker()
+                if failure is None:
+                    continue
+                self.close()
+                raise RuntimeError(f"{failure} while starting")
+            if error is not None:
+                self.close()
+                raise RuntimeError(f"generation worker {worker_id} failed to start: {error}")
+            self.worker_memory[worker_id] = memory
+
+        self.task_ids = itertools.count()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.collector = threading.Thread(target=self.collect_results, daemon=True)
+        self.collector.start()
+
+
+    def collect_results(self):
+
+        """
+        Background thread: hand each finished task back to the call waiting for it, and fail the waiting calls
+        if a worker process dies (e.g. killed for running out of memory) and so never reports back.
+        """
+
+        while not self.closing:
+            try:
+                message = self.results.get(timeout=self.liveness_interval)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                task_id, worker_id, texts, error, report = message
+                with self.lock:
+                    self.worker_memory[worker_id] = report["memory"]
+                    self.worker_decode_stats[worker_id] = report["decode_stats"]
+                    # A task failed after a worker died may still finish on a live worker.
+                    waiter = self.pending.pop(task_id, None)
+                if waiter is not None:
+                    done, outcome = waiter
+                    outcome.extend([texts, error])
+                    done.set()
+            self.check_workers()
+
+
+    def dead_worker(self):
+
+        """
+        Return a description of the first worker process that has exited, or None while all are running.
+        """
+
+        for worker_id, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                return f"generation worker {worker_id} exited with code {worker.exitcode}"
+        return None
+
+
+    def check_workers(self):
+
+        """
+        If a worker has died, fail every pending task and every later request. The queue does not record which
+        worker took which task, and a worker killed while writing a result can leave the result queue locked for
+        the others, so no pending task can be relied on to finish.
+        """
+
+        if self.closing or self.failure is not None:
+            return
+        failure = self.dead_worker()
+        if failure is not None:
+            self.fail_pending(failure)
+
+
+    def fail_pending(self, failure):
+        with self.lock:
+            self.failure = self.failure or failure
+            pending, self.pending = self.pending, {}
+        for done, outcome in pending.values():
+            outcome.extend([None, failure])
+            done.set()
+
+
+    def build_few_shot_prompt(self, prompt, **kwargs):
+        return self.prompt_builder.build_few_shot_prompt(prompt, **kwargs)
+
+
+    def generate_text(self, prompt, **params):
+        return self.generate_batch([prompt], **params)[0]
+
+
+    def generate_batch(self, prompts, batch_size=None, **params):
+
+        """
+        Generate text for several prompts, split evenly between the workers. Takes the decoding parameters of
+        TextGenerator.generate_batch; outputs are returned in the order of the prompts.
+        """
+
+        results = [None] * len(prompts)
+        cache_params = TextGenerator.batch_cache_params(**params)
+        if self.cache is not None:
+            results = [self.cache.get(prompt, cache_params) for prompt in prompts]
+        todo = [i for i, result in enumerate(results) if result is None]
+
+        tasks = []
+        for worker in range(min(self.num_workers, len(todo))):
+            # Every worker takes every num_workers-th prompt, so long and short prompts are spread out.
+            indices = todo[worker::self.num_workers]
+            done, outcome = threading.Event(), []
+            with self.lock:
+                if self.failure is not None:
+                    raise RuntimeError(self.failure)
+                task_id = next(self.task_ids)
+                self.pending[task_id] = (done, outcome)
+            self.tasks.put((task_id, [prompts[i] for i in indices], {"batch_size": batch_size, **params}))
+            tasks.append((indices, done, outcome))
+
+        for indices, done, outcome in tasks:
+            done.wait()
+            texts, error = outcome
+            if error is not None:
+                raise RuntimeError(error)
+            for i, text in zip(indices, texts):
+                results[i] = text
+                if self.cache is not None:
+                    self.cache.put(prompts[i], cache_params, text)
+        return results
+
+
+    @property
+    def decode_stats(self):
+        with self.lock:
+            reports = list(self.worker_decode_stats.values())
+        totals = {}
+        for stats in reports:
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+    def memory_report(self):
+
+        """
+        Return the latest memory figures of every worker (see process_memory), keyed by worker id.
+        """
+
+        with self.lock:
+            return {worker_id: dict(memory) for worker_id, memory in self.worker_memory.items()}
+
+
+    def close(self):
+        # The collector stops on this flag rather than a message, as the result queue may be locked by a dead worker.
+        self.closing = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.fail_pending("generation worker pool closed")
+        # Nothing reads the queues any more; do not wait at exit for data to be flushed into them.
+        self.tasks.cancel_join_thread()
+        self.results.cancel_join_thread()
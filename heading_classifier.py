@@ -0,0 +1,72 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+# kind:    "section", "subsection" or None for a content line.
+# number:  the numbering prefix as written, including its trailing whitespace (e.g. "1.2. "), or None.
+# title:   the heading text without numbering (subsections are cut at the first colon), or None.
+# content: trailing content after a subsection's colon, or the line itself for content lines.
+# level:   outline level used when placing "<SEP>" delimiters (1 for "1. ", 2 for "1.1 ", 3 for "1.1.1 "), or None.
+Heading = namedtuple("Heading", ["kind", "number", "title", "content", "level"])
+
+
+class HeadingClassifier:
+
+    def __init__(self, cache_size=4096):
+
+        """
+        Initialize the classifier with a single regex matching numbered headings such as "1. ", "1.2 " or "1.2.3. ".
+
+        Parameters:
+            cache_size (int): Number of classified lines to keep in the LRU cache.
+        """
+
+        # digits, ".digits" groups, optional trailing dot, one whitespace character, rest of the line
+        self.heading_pattern = re.compile(r'(\d+)((?:\.\d+)*)(\.?)(\s)(.*)', re.DOTALL)
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+
+    def _classify(self, line):
+
+        """
+        Classify a stripped line with one regex match.
+
+        A subsection is a number with at least one ".digits" group followed by text; a section is "N. " followed
+        by text. The level is looser: "N." followed by any whitespace, or up to three number groups, even without text.
+
+        Parameters:
+            line (str): A stripped line of text.
+
+        Returns:
+            Heading: The classification of the line.
+        """
+
+        match = self.heading_pattern.match(line)
+        if not match:
+            return Heading(None, None, None, line, None)
+
+        sub_numbers, trailing_dot, space, rest = match.group(2, 3, 4, 5)
+        depth = sub_numbers.count(".")
+        number = line[:match.start(5)]
+
+        if depth == 0:
+            level = 1 if trailing_dot else None
+        else:
+            level = depth + 1 if depth <= 2 else None
+
+        # Headings need text after the numbering on the same line.
+        if not rest or "\n" in rest:
+            return Heading(None, None, None, line, level)
+
+        if depth > 0:
+            colon_index = rest.find(":")
+            if colon_index == -1:
+                return Heading("subsection", number, rest, "", level)
+            title = rest[:colon_index].strip()
+            return Heading("subsection", number, title or number, rest[colon_index + 1:].strip(), level)
+
+        if trailing_dot and space == " ":
+            return Heading("section", number, rest, "", level)
+
+        return Heading(None, None, None, line, level)
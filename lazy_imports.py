@@ -0,0 +1,52 @@
+import time
+import importlib
+import threading
+
+
+# Module name -> seconds spent importing it through a LazyModule, for start-up reports.
+IMPORT_TIMES = {}
+_import_lock = threading.Lock()
+
+
+class LazyModule:
+
+    def __init__(self, name):
+
+        """
+        Stand-in for a heavy module (torch, transformers, peft, ...) that is imported on first attribute access,
+        so importing a module that uses it stays cheap until the heavy code is actually needed.
+
+        Parameters:
+            name (str): Full module name, e.g. "transformers" or "matplotlib.pyplot".
+        """
+
+        self._name = name
+        self._module = None
+
+
+    def _load(self):
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    IMPORT_TIMES[self._name] = time.perf_counter() - start
+                    self._module = module
+        return self._module
+
+
+    def __getattr__(self, attr):
+        module = self._load()
+        # Packages such as transformers import their submodules on attribute access, which counts as import time too.
+        start = time.perf_counter()
+        value = getattr(module, attr)
+        with _import_lock:
+            IMPORT_TIMES[self._name] += time.perf_counter() - start
+        # Later lookups find the attribute directly and skip __getattr__.
+        self.__dict__[attr] = value
+        return value
+
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
@@ -1,19 +1,76 @@
 import os
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from convert_plain_txt import ConvertPlainTxt
 from convert_to_json import ConvertToJson
+from corpus_writer import CorpusWriter
 import json
 
 
-def main():
+MANIFEST_NAME = ".ingest_manifest.json"
 
-    #Determine the root directory for processing
-    root_dir = os.path.join(os.getcwd(), "legal resources")
 
-    #Instantiate objects for DOCX to plain text and plain text to JSON
-    txt_converter = ConvertPlainTxt()
-    json_parser = ConvertToJson()
+def file_hash(path, chunk_size=1 << 20):
+
+    """
+    Compute the SHA-256 hash of a file's content, reading it in chunks.
+
+    Parameters:
+        path (str): Path of the file to hash.
+        chunk_size (int): Number of bytes read per chunk.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+
+    """
+    Load the manifest written by the previous ingestion run.
+
+    Returns:
+        dict: Mapping of DOCX path (relative to the root directory) to {"mtime", "hash"}; empty if missing or unreadable.
+    """
+
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_path, manifest):
+
+    """
+    Atomically write the manifest for the next ingestion run.
+    """
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
 
-    # Walk through all directories and files under the root directory
+
+def find_docx_files(root_dir):
+
+    """
+    Walk through all directories under root_dir and collect DOCX files with their JSON output paths.
+
+    Returns:
+        list: A list of (docx_file_path, json_file_path) tuples.
+    """
+
+    jobs = []
     for subdir, dirs, files in os.walk(root_dir):
         for file in files:
 
@@ -24,10 +81,188 @@ def main():
             if file.lower().endswith(".docx"):
                 docx_file_path = os.path.join(subdir, file)
                 json_file_path = os.path.join(subdir, os.path.splitext(file)[0] + ".json")
+                jobs.append((docx_file_path, json_file_path))
+    return jobs
+
+
+def docx_to_records(docx_file_path, backend="stream", txt_converter=None, json_parser=None):
+
+    """
+    Yield {"Section", "Subsection", "Content"} records straight from a DOCX file's paragraph stream,
+    without building the intermediate "<SEP>" text document and re-parsing it. The records are the
+    same as ConvertToJson().parse_document(ConvertPlainTxt().docx_to_text(docx_file_path)).
+
+    Parameters:
+        docx_file_path (str): Path of the DOCX file.
+        backend (str): DOCX reader backend passed to ConvertPlainTxt.
+        txt_converter (ConvertPlainTxt): Optional converter instance to reuse.
+        json_parser (ConvertToJson): Optional parser instance to reuse.
+    """
+
+    # Both stages use one classifier, so lines classified while delimiting are cache hits when building records.
+    if txt_converter is None:
+        txt_converter = ConvertPlainTxt(json_parser.heading_classifier if json_parser else None)
+    json_parser = json_parser or ConvertToJson(txt_converter.heading_classifier)
+    yield from json_parser.iter_records(txt_converter.docx_to_lines(docx_file_path, backend=backend))
+
+
+def convert_file(docx_file_path, json_file_path, backend="stream"):
+
+    """
+    Convert a single DOCX file to JSON. Runs inside a worker process.
+
+    Parameters:
+        docx_file_path (str): Path of the DOCX file to convert.
+        json_file_path (str): Path of the JSON file to write.
+        backend (str): DOCX reader backend passed to ConvertPlainTxt.docx_to_text.
+
+    Returns:
+        tuple: (docx_file_path, elapsed seconds, size of the DOCX in bytes)
+    """
+
+    start = time.perf_counter()
+    json_parser = ConvertToJson()
+    json_parser.save_records(docx_to_records(docx_file_path, backend=backend, json_parser=json_parser), json_file_path)
+    return docx_file_path, time.perf_counter() - start, os.path.getsize(docx_file_path)
+
+
+def is_up_to_date(docx_file_path, json_file_path, entry, stat):
+
+    """
+    Check a DOCX file against its manifest entry. The mtime is compared first; the content hash
+    is only computed when the mtime differs (e.g. the file was touched or copied without changes).
+
+    Returns:
+        tuple: (up_to_date (bool), content hash or None if it was not computed)
+    """
+
+    if entry is None or not os.path.exists(json_file_path):
+        return False, None
+    if entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+        return True, entry.get("hash")
+    digest = file_hash(docx_file_path)
+    return digest == entry.get("hash"), digest
+
+
+def write_corpus(root_dir, jobs, corpus_dir, corpus_format="jsonl", shard_size=50000):
+
+    """
+    Consolidate the JSON output of every converted document into one sharded JSONL or Parquet corpus.
+
+    Parameters:
+        root_dir (str): Ingestion root; Source columns are stored relative to it.
+        jobs (list): (docx_file_path, json_file_path) tuples to include, in a stable order.
+        corpus_dir (str): Directory that receives the shards.
+        corpus_format (str): "jsonl" or "parquet".
+        shard_size (int): Maximum number of rows per shard.
+
+    Returns:
+        CorpusWriter: The closed writer, for its shard_paths and num_rows.
+    """
+
+    with CorpusWriter(corpus_dir, corpus_format=corpus_format, shard_size=shard_size) as writer:
+        for docx_file_path, json_file_path in jobs:
+            with open(json_file_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+            writer.write_document(records, os.path.relpath(json_file_path, root_dir))
+    return writer
+
+
+def main(root_dir=None, workers=None, incremental=True, backend="stream",
+         corpus_dir=None, corpus_format="jsonl", shard_size=50000):
+
+    """
+    Convert every DOCX file under root_dir to JSON using a process pool.
+
+    Files whose mtime or content hash matches the manifest from the last run (and whose JSON output
+    still exists) are skipped. Per-file timing and overall throughput are printed at the end.
+
+    Parameters:
+        root_dir (str): Directory to process. Defaults to "legal resources" in the working directory.
+        workers (int): Number of worker processes. Defaults to the number of CPUs.
+        incremental (bool): Whether to skip files that are unchanged since the last run.
+        backend (str): DOCX reader backend, "stream" (default) or "docx".
+        corpus_dir (str): If given, also write every document's records into one sharded corpus in this directory.
+        corpus_format (str): Corpus shard format, "jsonl" or "parquet".
+        shard_size (int): Maximum number of rows per corpus shard.
+    """
+
+    #Determine the root directory for processing
+    if root_dir is None:
+        root_dir = os.path.join(os.getcwd(), "legal resources")
+
+    manifest_path = os.path.join(root_dir, MANIFEST_NAME)
+    old_manifest = load_manifest(manifest_path) if incremental else {}
+    new_manifest = {}
+
+    jobs = sorted(find_docx_files(root_dir))
+    pending = []
+    skipped = 0
+    for docx_file_path, json_file_path in jobs:
+        key = os.path.relpath(docx_file_path, root_dir)
+        stat = os.stat(docx_file_path)
+        up_to_date, digest = is_up_to_date(docx_file_path, json_file_path, old_manifest.get(key), stat)
+        entry = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": digest}
+        if up_to_date:
+            new_manifest[key] = entry
+            skipped += 1
+        else:
+            pending.append((key, docx_file_path, json_file_path, entry))
+
+    timings = []
+    failed = 0
+    start = time.perf_counter()
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(convert_file, docx_file_path, json_file_path, backend): (key, docx_file_path, json_file_path, entry)
+                for key, docx_file_path, json_file_path, entry in pending
+            }
+            for future in as_completed(futures):
+                key, docx_file_path, json_file_path, entry = futures[future]
+                try:
+                    _, elapsed, size = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Error converting {docx_file_path}: {e}")
+                    continue
+
+                if entry["hash"] is None:
+                    entry["hash"] = file_hash(docx_file_path)
+                new_manifest[key] = entry
+                timings.append((docx_file_path, elapsed, size))
+                print(f"Saved JSON to {json_file_path} ({elapsed:.2f}s)\n")
+
+    wall_time = time.perf_counter() - start
+    save_manifest(manifest_path, new_manifest)
+    report(timings, skipped, failed, wall_time)
+
+    if corpus_dir:
+        start = time.perf_counter()
+        converted = [job for job in jobs if os.path.relpath(job[0], root_dir) in new_manifest]
+        writer = write_corpus(root_dir, converted, corpus_dir, corpus_format=corpus_format, shard_size=shard_size)
+        print(f"Wrote {writer.num_rows} rows to {len(writer.shard_paths)} {corpus_format} shard(s) in {corpus_dir} "
+              f"({time.perf_counter() - start:.2f}s)")
+
+
+def report(timings, skipped, failed, wall_time):
+
+    """
+    Print per-file timing and overall throughput for an ingestion run.
+    """
+
+    if timings:
+        print("Per-file timing:")
+        for docx_file_path, elapsed, size in sorted(timings, key=lambda t: t[1], reverse=True):
+            print(f"  {elapsed:8.3f}s  {size / 1024:9.1f} KiB  {docx_file_path}")
 
-                plain_txt = txt_converter.docx_to_text(docx_file_path)
-                json_parser.parse_and_save(plain_txt, json_file_path)
-                print(f"Saved JSON to {json_file_path}\n")
+    converted = len(timings)
+    total_bytes = sum(size for _, _, size in timings)
+    print(f"\nConverted {converted} file(s), skipped {skipped} unchanged, {failed} failed.")
+    if converted and wall_time > 0:
+        print(f"Wall time {wall_time:.2f}s: {converted / wall_time:.2f} files/s, "
+              f"{total_bytes / (1024 * 1024) / wall_time:.2f} MiB/s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+import os
+import glob
+
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+from transformers.pytorch_utils import Conv1D
+
+from generation_cache import checkpoint_fingerprint
+
+
+def conv1d_to_linear(model):
+
+    """
+    Replace the Conv1D layers of a GPT-2 model (attention and MLP projections) with equivalent nn.Linear layers,
+    in place, so dynamic quantisation can handle them. Conv1D stores its weight as (in_features, out_features),
+    so the weight is transposed.
+
+    Returns:
+        int: Number of layers replaced.
+    """
+
+    replaced = 0
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features, bias=child.bias is not None)
+                linear.weight = nn.Parameter(child.weight.detach().t().contiguous())
+                if child.bias is not None:
+                    linear.bias = nn.Parameter(child.bias.detach().clone())
+                setattr(module, child_name, linear)
+                replaced += 1
+    return replaced
+
+
+def quantize_int8(model):
+
+    """
+    Apply dynamic int8 quantisation to every linear layer of a model for CPU inference: weights are stored as
+    int8 and activations are quantised on the fly per batch. The embeddings and layer norms stay in fp32.
+
+    Parameters:
+        model: A causal language model on the CPU, in eval mode.
+
+    Returns:
+        The quantised model.
+    """
+
+    from torch.ao.quantization import quantize_dynamic
+
+    conv1d_to_linear(model)
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_skeleton(model_dir):
+
+    """
+    Build the module structure of the int8 model of model_dir without computing any weights: the fp32 model is
+    created on the meta device, its linear layers are swapped for placeholder dynamic int8 layers and the remaining
+    tensors are allocated uninitialised. restore_quantized_state then fills in the cached weights.
+    """
+
+    import torch.ao.nn.quantized.dynamic as nnqd
+
+    config = AutoConfig.from_pretrained(model_dir)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config)
+        conv1d_to_linear(model)
+
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if type(child) is nn.Linear:
+                # Packing weights is the slow part, so the placeholder is 1x1 and only the real weight gets packed.
+                layer = nnqd.Linear(1, 1, bias_=child.bias is not None, dtype=torch.qint8)
+                layer.in_features, layer.out_features = child.in_features, child.out_features
+                setattr(module, child_name, layer)
+    model = model.to_empty(device="cpu")
+
+    if os.path.exists(os.path.join(model_dir, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(model_dir)
+    return model
+
+
+def quantized_cache_path(model_dir):
+
+    """
+    Return the file the quantised weights of model_dir are cached in. The name includes the checkpoint
+    fingerprint and the torch version, since the int8 kernels depend on both.
+    """
+
+    fingerprint = checkpoint_fingerprint(model_dir)[:16]
+    return os.path.join(model_dir, f"quantized-int8-{fingerprint}-torch{torch.__version__.split('+')[0]}.pt")
+
+
+def quantized_state(model):
+
+    """
+    Collect the weights of a quantised model as plain tensors: the int8 values, scales and zero points of every
+    dynamic int8 layer, plus every other parameter and buffer (including non-persistent ones such as attention
+    masks). Quantised tensors themselves are not pickled, since unpickling them depends on torch internals.
+
+    Returns:
+        dict: {"linear": {layer name: int8 weight data and bias}, "tensors": {name: tensor}, "persistent": [names]}
+    """
+
+    import torch.ao.nn.quantized.dynamic as nnqd
+
+    linear = {}
+    for name, module in model.named_modules():
+        if isinstance(module, nnqd.Linear):
+            weight, bias = module._weight_bias()
+            entry = {"int8": weight.int_repr(), "bias": bias}
+            if weight.qscheme() in (torch.per_channel_affine, torch.per_channel_symmetric):
+                entry.update(scales=weight.q_per_channel_scales(), zero_points=weight.q_per_channel_zero_points(),
+                             axis=weight.q_per_channel_axis())
+            else:
+                entry.update(scale=weight.q_scale(), zero_point=weight.q_zero_point())
+            linear[name] = entry
+
+    persistent = [name for name in model.state_dict() if "_packed_params" not in name]
+    tensors = dict(model.named_parameters())
+    tensors.update(model.named_buffers())
+    return {"linear": linear, "tensors": tensors, "persistent": persistent}
+
+
+def restore_quantized_state(model, state):
+
+    """
+    Load the output of quantized_state into quantized_skeleton.
+    """
+
+    persistent = set(state["persistent"])
+    for name, tensor in state["tensors"].items():
+        module_name, _, attr = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attr in module._parameters:
+            module._parameters[attr] = nn.Parameter(tensor, requires_grad=False)
+        else:
+            module.register_buffer(attr, tensor, persistent=name in persistent)
+
+    for name, entry in state["linear"].items():
+        if "axis" in entry:
+            weight = torch._make_per_channel_quantized_tensor(entry["int8"], entry["scales"], entry["zero_points"],
+                                                              entry["axis"])
+        else:
+            weight = torch._make_per_tensor_quantized_tensor(entry["int8"], entry["scale"], entry["zero_point"])
+        model.get_submodule(name).set_weight_bias(weight, entry["bias"])
+    return model
+
+
+def load_quantized(model_dir, load_model):
+
+    """
+    Load the int8 model of model_dir from its on-disk cache, or build it with load_model and quantize_int8
+    and write the cache (replacing caches of older checkpoints) for the next start. A cached start neither
+    reads the fp32 weights nor quantises them.
+
+    Parameters:
+        model_dir (str): Directory of the merged fp32 checkpoint.
+        load_model (callable): Returns the fp32 model when the cache is missing.
+
+    Returns:
+        The quantised model, in eval mode.
+    """
+
+    cache_path = quantized_cache_path(model_dir)
+    if os.path.exists(cache_path):
+        try:
+            state = torch.load(cache_path, weights_only=True)
+            return restore_quantized_state(quantized_skeleton(model_dir), state).eval()
+        except Exception as e:
+            print(f"Could not load quantised model from {cache_path}, rebuilding: {e}")
+
+    model = quantize_int8(load_model().eval()).eval()
+    for stale in glob.glob(os.path.join(model_dir, "quantized-int8-*.pt")):
+        os.remove(stale)
+    tmp_path = cache_path + ".tmp"
+    torch.save(quantized_state(model), tmp_path)
+    os.replace(tmp_path, cache_path)
+    return model
@@ -0,0 +1,84 @@
+import os
+import glob
+
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+from generation_cache import checkpoint_fingerprint
+
+
+def shared_weights_path(model_dir):
+
+    """
+    Return the file the shared weights of model_dir are written to. The name includes the checkpoint fingerprint
+    and the torch version, so a retrained checkpoint or a torch upgrade writes a new file.
+    """
+
+    fingerprint = checkpoint_fingerprint(model_dir)[:16]
+    return os.path.join(model_dir, f"shared-weights-{fingerprint}-torch{torch.__version__.split('+')[0]}.pt")
+
+
+def save_shared_weights(model, path):
+
+    """
+    Write every parameter and buffer of a loaded (merged) model, with its config, to one file that workers can
+    memory-map. Tied weights are stored once. Older shared-weight files in the same directory are removed.
+
+    Parameters:
+        model: The merged causal language model.
+        path (str): Output file, usually shared_weights_path(merged_model_dir).
+    """
+
+    tensors = {name: tensor.detach() for name, tensor in model.named_parameters()}
+    tensors.update(model.named_buffers())
+    state = {
+        "config": model.config.to_dict(),
+        "generation_config": model.generation_config.to_dict(),
+        "tensors": tensors,
+        "persistent": list(model.state_dict()),
+    }
+
+    for stale in glob.glob(os.path.join(os.path.dirname(path) or ".", "shared-weights-*.pt")):
+        if stale != path:
+            os.remove(stale)
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_shared_model(path):
+
+    """
+    Build a model whose weights are read-only views of the memory-mapped file written by save_shared_weights.
+    The file's pages live in the OS page cache, so every process that loads the same file shares one copy of
+    the weights and only its activations are private.
+
+    Parameters:
+        path (str): File written by save_shared_weights.
+
+    Returns:
+        The model, in eval mode.
+    """
+
+    state = torch.load(path, mmap=True, weights_only=True)
+    config = AutoConfig.for_model(**state["config"])
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config)
+
+    persistent = set(state["persistent"])
+    for name, tensor in state["tensors"].items():
+        module_name, _, attr = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attr in module._parameters:
+            module._parameters[attr] = nn.Parameter(tensor, requires_grad=False)
+        else:
+            module.register_buffer(attr, tensor, persistent=name in persistent)
+
+    # Tied weights (GPT-2's output layer and token embeddings) are stored once; point the copies back at them.
+    model.tie_weights()
+    generation_config = GenerationConfig.from_dict(state["generation_config"])
+    # from_pretrained records this hash too; generate reads it to tell whether the config was edited since loading.
+    generation_config._original_object_hash = hash(generation_config)
+    model.generation_config = generation_config
+    return model.eval()
@@ -0,0 +1,116 @@
+import torch
+from transformers import AutoModelForCausalLM, DynamicCache
+
+
+def build_draft_model(base_model_dir, num_layers=4, vocab_size=None):
+
+    """
+    Build a small draft model from the base GPT-2 checkpoint by keeping only its first num_layers transformer
+    blocks. It keeps the base model's embeddings and output layer, so the draft speaks the same
+    vocabulary, and nothing has to be trained or downloaded.
+
+    Parameters:
+        base_model_dir (str): Directory of the base GPT-2 checkpoint.
+        num_layers (int): Number of transformer blocks to keep.
+        vocab_size (int): Vocabulary size of the target model (the tokenizer adds <PAD>), if it differs.
+
+    Returns:
+        The draft model, in eval mode.
+    """
+
+    model = AutoModelForCausalLM.from_pretrained(base_model_dir, local_files_only=True, low_cpu_mem_usage=True)
+    num_layers = min(num_layers, len(model.transformer.h))
+    model.transformer.h = model.transformer.h[:num_layers]
+    model.config.n_layer = num_layers
+    if vocab_size is not None and vocab_size != model.get_input_embeddings().num_embeddings:
+        model.resize_token_embeddings(vocab_size)
+    return model.eval()
+
+
+def next_token(logits, sequence, logits_processor):
+
+    """
+    Greedy choice for the position after sequence, with the logits processors generate would apply.
+    """
+
+    scores = logits.float()
+    if logits_processor is not None:
+        scores = logits_processor(sequence, scores)
+    return scores.argmax(dim=-1)
+
+
+def speculative_greedy(target, draft, input_ids, max_new_tokens, num_draft_tokens=4, logits_processor=None,
+                       stopping_criteria=None, eos_token_id=None, past_key_values=None):
+
+    """
+    Greedy decoding of target, sped up by a draft model: the draft proposes up to num_draft_tokens tokens, the
+    target scores all of them in one forward pass, and the proposals are kept up to the first one the target
+    would not have chosen, followed by the target's own token. Every token is the target's greedy choice, so the
+    output is the target's greedy output; only the number of target forward passes changes.
+
+    Parameters:
+        target: The model whose greedy output is produced.
+        draft: A smaller model with the same vocabulary.
+        input_ids (torch.Tensor): Prompt token ids, shape (1, length).
+        max_new_tokens (int): Maximum number of tokens to generate.
+        num_draft_tokens (int): Tokens proposed by the draft per target pass.
+        logits_processor: Applied to the scores of both models, e.g. a LogitsProcessorList with no-repeat n-grams.
+        stopping_criteria: Checked after every token, as generate does.
+        eos_token_id (int or list): Token id(s) that end the sequence.
+        past_key_values (DynamicCache): Target cache covering a prefix of input_ids, e.g. a cached few-shot prefix.
+
+    Returns:
+        tuple: (output ids including the prompt, shape (1, length), stats dict with "drafted" and "accepted"
+               draft tokens and "target_passes")
+    """
+
+    eos_token_ids = set([eos_token_id] if isinstance(eos_token_id, int) else eos_token_id or [])
+    target_cache = past_key_values if past_key_values is not None else DynamicCache()
+    draft_cache = DynamicCache()
+    sequence = input_ids
+    prompt_length = input_ids.shape[1]
+    stats = {"drafted": 0, "accepted": 0, "target_passes": 0}
+
+    def forward(model, cache, ids):
+        # The cache covers a prefix of ids; only the rest is fed in.
+        return model(input_ids=ids[:, cache.get_seq_length():], past_key_values=cache, use_cache=True).logits
+
+    finished = max_new_tokens <= 0
+    while not finished:
+        length = sequence.shape[1]
+        remaining = max_new_tokens - (length - prompt_length)
+
+        # The draft proposes tokens greedily; one target token is always added, so it proposes at most remaining - 1.
+        proposal = sequence
+        for _ in range(min(num_draft_tokens, remaining - 1)):
+            logits = forward(draft, draft_cache, proposal)[:, -1]
+            proposal = torch.cat([proposal, next_token(logits, proposal, logits_processor)[:, None]], dim=-1)
+        drafted = proposal.shape[1] - length
+
+        # One target pass scores the position after the current sequence and after every proposed token.
+        logits = forward(target, target_cache, proposal)[:, -(drafted + 1):]
+        stats["target_passes"] += 1
+        stats["drafted"] += drafted
+
+        new_tokens = []
+        for j in range(drafted + 1):
+            token = next_token(logits[:, j], proposal[:, :length + j], logits_processor)
+            new_tokens.append(token)
+            if j == drafted or token.item() != proposal[0, length + j].item():
+                break
+        stats["accepted"] += len(new_tokens) - 1
+
+        # Append token by token so the stop checks see the same sequences as in generate.
+        for token in new_tokens:
+            sequence = torch.cat([sequence, token[:, None]], dim=-1)
+            if (token.item() in eos_token_ids or sequence.shape[1] - prompt_length >= max_new_tokens
+                    or (stopping_criteria is not None and bool(stopping_criteria(sequence, None).any()))):
+                finished = True
+                break
+
+        # Drop the cached keys/values of rejected proposals; both caches then cover a prefix of the sequence.
+        kept = sequence.shape[1] - 1
+        for cache in (target_cache, draft_cache):
+            if cache.get_seq_length() > kept:
+                cache.crop(kept)
+    return sequence, stats
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+VOCAB = ["<|endoftext|>", "<PAD>", "<unk>", "User", "Question:", "Answer:", "<SEP>", "law", "the", "is", "a",
+         "contract", "tax", "court", "rule", "of", "and", "."]
+
+
+INTRO_EXAMPLES = """Question: Draft a well structured introduction about tax law .
+Answer: the law of tax is a rule .
+
+Question: Draft a well structured introduction about the court .
+Answer: a court is the rule of law and the law of a court .
+
+Question: Draft a well structured introduction about contract law .
+Answer: contract law is a law of contract and a rule .
+"""
+
+
+def make_tokenizer():
+
+    """
+    A word-level tokenizer over VOCAB, built in memory so the tests need no model files.
+    """
+
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.WordLevel({word: i for i, word in enumerate(VOCAB)}, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>", pad_token="<PAD>",
+                                   unk_token="<unk>", clean_up_tokenization_spaces=False)
+
+
+def make_model(seed=0, n_layer=2):
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=len(VOCAB), n_positions=128, n_embd=32, n_layer=n_layer, n_head=2,
+                        bos_token_id=0, eos_token_id=0)
+    return GPT2LMHeadModel(config).eval()
+
+
+@pytest.fixture
+def generator(tmp_path):
+
+    """
+    A TextGenerator with the in-memory tokenizer and a small randomly initialised GPT-2 in place of the checkpoint.
+    """
+
+    from TextGen import TextGenerator
+
+    (tmp_path / "Intro-prompts.txt").write_text(INTRO_EXAMPLES, encoding="utf-8")
+    generator = TextGenerator(lazy_load=True, few_shot_dir=str(tmp_path), few_shot_poll_interval=None)
+    generator._tokenizer = make_tokenizer()
+    generator._model = make_model()
+    return generator
@@ -0,0 +1,212 @@
+import os
+
+import datasets
+import pytest
+
+from GPTTrainer import DataPreparer
+
+
+def make_preparer(**attributes):
+    # Skips __init__, which loads the GPT-2 tokenizer from ./GPT-2.
+    preparer = DataPreparer.__new__(DataPreparer)
+    preparer.num_proc = 1
+    preparer.__dict__.update(attributes)
+    return preparer
+
+
+def make_records(documents):
+    rows = {"Document": [], "Section": [], "Subsection": [], "Content": []}
+    for document, sections in documents.items():
+        for section, contents in sections.items():
+            for content in contents:
+                rows["Document"].append(document)
+                rows["Section"].append(section)
+                rows["Subsection"].append(None)
+                rows["Content"].append(content)
+    return datasets.Dataset.from_dict(rows)
+
+
+def fake_tokenize(calls):
+    def tokenize_function(example):
+        calls.append(len(example["Content"]))
+        input_ids = [[len(word) for word in content.split()] for content in example["Content"]]
+        return {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids],
+                "length": [len(ids) for ids in input_ids]}
+    return tokenize_function
+
+
+def test_tokenize_cached_reuses_source_entries(tmp_path):
+    preparer = make_preparer()
+    ds = make_records({"a.docx": {"1": ["one two", "three"]}, "b.docx": {"1": ["four five six"]}})
+    calls = []
+
+    first = preparer.tokenize_cached(ds, fake_tokenize(calls), str(tmp_path))
+    rows = sum(calls)
+    second = preparer.tokenize_cached(ds, fake_tokenize(calls), str(tmp_path))
+
+    assert rows == 3 and sum(calls) == 3
+    assert second["input_ids"] == first["input_ids"] == [[3, 3], [5], [4, 4, 3]]
+    assert sorted(name.split("-")[0] for name in os.listdir(tmp_path)) == ["source", "source"]
+
+
+def test_tokenize_cached_ignores_interrupted_save(tmp_path, monkeypatch):
+    preparer = make_preparer()
+    ds = make_records({"a.docx": {"1": ["one two"]}, "b.docx": {"1": ["three"]}})
+    save_to_disk = datasets.Dataset.save_to_disk
+
+    def interrupted_save(self, path, *args, **kwargs):
+        save_to_disk(self, path, *args, **kwargs)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(datasets.Dataset, "save_to_disk", interrupted_save)
+    with pytest.raises(KeyboardInterrupt):
+        preparer.tokenize_cached(ds, fake_tokenize([]), str(tmp_path))
+    monkeypatch.undo()
+
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("source-")]
+    calls = []
+    result = preparer.tokenize_cached(ds, fake_tokenize(calls), str(tmp_path))
+    assert sum(calls) == 2
+    assert result["input_ids"] == [[3, 3], [5]]
+
+
+class StubTokenizer:
+    eos_token_id = 0
+    pad_token_id = 99
+
+
+def test_pack_data_chunks_records_with_continuous_positions():
+    train = datasets.Dataset.from_dict({"input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9]]})
+    preparer = make_preparer(tokenizer=StubTokenizer(), max_length=4, seed=0,
+                             train_dataset_tokenized=train, test_dataset_tokenized=train.select([]))
+
+    packed = preparer.pack_data()["train"]
+
+    assert packed["input_ids"] == [[1, 2, 3, 0], [4, 5, 0, 6], [7, 8, 9, 0]]
+    assert "position_ids" not in packed.column_names
+    assert packed["attention_mask"] == [[1, 1, 1, 1]] * 3
+    assert packed["length"] == [4, 4, 4]
+
+
+def test_pack_data_leaves_the_last_block_to_the_collator():
+    import transformers
+    from conftest import make_tokenizer
+
+    tokenizer = make_tokenizer()
+    train = datasets.Dataset.from_dict({"input_ids": [[7, 8, 9, 10], [11]]})
+    preparer = make_preparer(tokenizer=tokenizer, max_length=4, seed=0,
+                             train_dataset_tokenized=train, test_dataset_tokenized=train.select([]))
+
+    packed = preparer.pack_data()["train"]
+    assert packed["input_ids"] == [[7, 8, 9, 10], [0, 11, 0]]
+
+    collator = transformers.DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    batch = collator([{"input_ids": row["input_ids"], "attention_mask": row["attention_mask"]} for row in packed])
+    assert batch["attention_mask"].tolist() == [[1, 1, 1, 1], [1, 1, 1, 0]]
+    assert batch["labels"].tolist() == [[7, 8, 9, 10], [0, 11, 0, -100]]
+
+
+@pytest.mark.parametrize("test_size", [0.05, 0.3])
+def test_split_sections_matches_train_test_split(test_size):
+    sections = {"1": [f"a{i}" for i in range(25)], "2": [f"b{i}" for i in range(7)], None: ["c0", "c1"], "3": ["d0"]}
+    ds = make_records({"doc.docx": sections})
+    preparer = make_preparer(test_size=test_size, seed=42)
+
+    train, test = preparer.split_sections(ds)
+
+    expected_train, expected_test = set(), set()
+    for section in sections:
+        rows = ds.filter(lambda row: row["Section"] == section)
+        if len(rows) < 2:
+            expected_train.update(rows["Content"])
+            continue
+        split = rows.train_test_split(test_size=test_size, seed=42)
+        expected_train.update(split["train"]["Content"])
+        expected_test.update(split["test"]["Content"])
+    assert set(train["Content"]) == expected_train
+    assert set(test["Content"]) == expected_test
+    assert len(train) + len(test) == len(ds)
+
+
+def test_corpus_writer_replaces_shards_of_either_format(tmp_path):
+    from corpus_writer import CorpusWriter
+
+    records = [{"Section": "1", "Subsection": None, "Content": "old"}, {"Section": "1", "Subsection": None, "Content": "old"}]
+    with CorpusWriter(str(tmp_path), corpus_format="parquet") as writer:
+        writer.write_document(records, "old.docx")
+    with CorpusWriter(str(tmp_path), corpus_format="jsonl") as writer:
+        writer.write_document([dict(record, Content="new") for record in records], "new.docx")
+
+    assert os.listdir(tmp_path) == ["corpus-00000.jsonl"]
+    splits = make_preparer(corpus_dir=str(tmp_path), test_size=0.5, seed=0).load_corpus()
+    assert splits["train"]["Content"] + splits["test"]["Content"] == ["new", "new"]
+
+
+def test_load_corpus_rejects_mixed_shard_formats(tmp_path):
+    from corpus_writer import CorpusWriter
+
+    with CorpusWriter(str(tmp_path), corpus_format="jsonl") as writer:
+        writer.write_document([{"Section": "1", "Subsection": None, "Content": "text"}], "a.docx")
+    (tmp_path / "corpus-00000.parquet").write_bytes(b"")
+
+    with pytest.raises(ValueError, match="both JSONL and Parquet"):
+        make_preparer(corpus_dir=str(tmp_path), test_size=0.5, seed=0).load_corpus()
+
+
+def test_load_corpus_splits_like_each_document_on_its_own(tmp_path):
+    from corpus_writer import CorpusWriter
+
+    documents = {f"doc{d}.docx": [{"Section": str(s), "Subsection": None, "Content": f"doc{d} s{s} r{r}"}
+                                  for s in range(3) for r in range(2 + d + s)] for d in range(4)}
+    with CorpusWriter(str(tmp_path), corpus_format="jsonl") as writer:
+        for source, records in documents.items():
+            writer.write_document(records, source)
+    preparer = make_preparer(corpus_dir=str(tmp_path), test_size=0.3, seed=7)
+
+    splits = preparer.load_corpus()
+
+    expected_train, expected_test = [], []
+    for source, records in documents.items():
+        train, test = preparer.split_sections(datasets.Dataset.from_list(records))
+        expected_train += train["Content"]
+        expected_test += test["Content"]
+    assert sorted(splits["train"]["Content"]) == sorted(expected_train)
+    assert sorted(splits["test"]["Content"]) == sorted(expected_test)
+
+
+def test_hardware_profile_uses_every_core_whatever_num_proc_is(monkeypatch):
+    import torch
+    import GPTTrainer
+
+    monkeypatch.setattr(GPTTrainer, "available_cores", lambda: 16)
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    threads = torch.get_num_threads()
+    try:
+        profile = make_preparer(num_proc=2).hardware_profile()
+        assert torch.get_num_threads() == 14
+    finally:
+        torch.set_num_threads(threads)
+    assert profile["dataloader_num_workers"] == 2
+
+
+def test_prune_tokenized_cache_keeps_only_entries_in_use(tmp_path):
+    preparer = make_preparer()
+    cache_root = tmp_path / "0123456789abcdef"
+    other_root = tmp_path / "fedcba9876543210"
+    (other_root / "source-old").mkdir(parents=True)
+    (tmp_path / "notes").mkdir()
+
+    def run(train_docs, test_docs):
+        train = preparer.tokenize_cached(make_records(train_docs), fake_tokenize([]), str(cache_root))
+        test = preparer.tokenize_cached(make_records(test_docs), fake_tokenize([]), str(cache_root))
+        preparer.prune_tokenized_cache(str(cache_root), [train, test])
+        return train, test
+
+    run({"a.docx": {"1": ["one"]}, "b.docx": {"1": ["two"]}}, {"a.docx": {"1": ["three"]}})
+    assert len(os.listdir(cache_root)) == 3
+
+    # b.docx is edited: its old entry goes, the others stay and are still readable.
+    train, test = run({"a.docx": {"1": ["one"]}, "b.docx": {"1": ["two two"]}}, {"a.docx": {"1": ["three"]}})
+    assert len(os.listdir(cache_root)) == 3
+    assert train["input_ids"] == [[3], [3, 3]] and test["input_ids"] == [[5]]
+    assert sorted(os.listdir(tmp_path)) == ["0123456789abcdef", "notes"]
@@ -0,0 +1,40 @@
+import difflib
+
+import pytest
+
+from few_shot_index import FewShotIndex, question_line
+
+
+TOPICS = ["Tax", "Divorce", "family law", "contract law", "immigration", "employment discrimination", "share capital",
+          "trusts", "data protection", "Employment Tribunals", "criminal law", "landlord and tenant"]
+EXAMPLES = [f"Question: Draft a well structured introduction about {topic}.\nAnswer: {topic} matters." for topic in TOPICS]
+
+
+def scan_closest(query, examples):
+    # The linear difflib scan the index replaced.
+    best, best_ratio = None, 0
+    for example in examples:
+        question = question_line(example)
+        if question:
+            ratio = difflib.SequenceMatcher(None, query.lower(), question.lower()).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = example, ratio
+    return best
+
+
+@pytest.mark.parametrize("query", ["Draft a well structured introduction about divorce",
+                                   "Write an introduction about contract law",
+                                   "Draft an introduction on data protection rules",
+                                   "introduction about landlord and tenant disputes"])
+def test_closest_matches_the_difflib_scan(query):
+    assert FewShotIndex(EXAMPLES).closest(query) == scan_closest(query, EXAMPLES)
+
+
+def test_closest_ignores_examples_without_a_question():
+    examples = ["Answer: only an answer about tax law", EXAMPLES[0]]
+    assert FewShotIndex(examples).closest("tax law") == EXAMPLES[0]
+
+
+def test_closest_returns_none_without_shared_ngrams():
+    assert FewShotIndex(EXAMPLES).closest("zzz") is None
+    assert FewShotIndex([]).closest("Tax") is None
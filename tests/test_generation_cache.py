@@ -0,0 +1,54 @@
+import pytest
+
+import generation_cache
+from generation_cache import GenerationCache
+
+
+PARAMS = {"max_length": 600, "num_beams": 5}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(generation_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_normalised_prompts_share_an_entry(tmp_path, clock):
+    cache = GenerationCache(str(tmp_path / "cache.db"))
+    cache.put("What is  tax law?\n", PARAMS, "answer")
+    assert cache.get(" What is tax law?", PARAMS) == "answer"
+    assert cache.get("What is tax law?", {**PARAMS, "num_beams": 1}) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = GenerationCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("a", PARAMS, "A")
+    clock[0] += 1
+    cache.put("b", PARAMS, "B")
+    clock[0] += 1
+    assert cache.get("a", PARAMS) == "A"
+    clock[0] += 1
+    cache.put("c", PARAMS, "C")
+
+    assert cache.get("b", PARAMS) is None
+    assert cache.get("a", PARAMS) == "A" and cache.get("c", PARAMS) == "C"
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = GenerationCache(str(tmp_path / "cache.db"), ttl=10)
+    cache.put("a", PARAMS, "A")
+    clock[0] += 5
+    assert cache.get("a", PARAMS) == "A"
+    clock[0] += 6
+    assert cache.get("a", PARAMS) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_checkpoint_is_part_of_the_key(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    GenerationCache(path, checkpoint="v1").put("a", PARAMS, "A")
+    assert GenerationCache(path, checkpoint="v2").get("a", PARAMS) is None
+    assert GenerationCache(path, checkpoint="v1").get("a", PARAMS) == "A"
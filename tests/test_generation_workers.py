@@ -0,0 +1,47 @@
+import os
+import signal
+
+import pytest
+
+from conftest import make_model, make_tokenizer
+from test_text_generator import PROMPT, run_with_timeout
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    # A merged checkpoint on disk, so the pool loads it like a real one.
+    model_dir = tmp_path / "final_model"
+    merged_model_dir = tmp_path / "merged_model"
+    make_tokenizer().save_pretrained(model_dir)
+    make_model().save_pretrained(merged_model_dir)
+    return {"model_dir": str(model_dir), "merged_model_dir": str(merged_model_dir),
+            "few_shot_dir": str(tmp_path), "num_threads": 1, "liveness_interval": 0.2}
+
+
+def test_pool_matches_in_process_generation(checkpoint):
+    from TextGen import TextGenerator
+    from generation_workers import GenerationWorkerPool
+
+    expected = TextGenerator(model_dir=checkpoint["model_dir"], merged_model_dir=checkpoint["merged_model_dir"],
+                             few_shot_dir=checkpoint["few_shot_dir"], few_shot_poll_interval=None)
+    pool = GenerationWorkerPool(num_workers=1, **checkpoint)
+    try:
+        assert pool.generate_text(PROMPT, max_length=20, num_beams=2) == \
+            expected.generate_text(PROMPT, max_length=20, num_beams=2)
+    finally:
+        pool.close()
+
+
+def test_dead_worker_fails_requests_instead_of_hanging(checkpoint):
+    from generation_workers import GenerationWorkerPool
+
+    pool = GenerationWorkerPool(num_workers=1, **checkpoint)
+    try:
+        os.kill(pool.workers[0].pid, signal.SIGKILL)
+        first = run_with_timeout(lambda: pool.generate_text(PROMPT, max_length=20, num_beams=2))
+        later = run_with_timeout(lambda: pool.generate_text(PROMPT, max_length=20, num_beams=1))
+    finally:
+        pool.close()
+
+    assert isinstance(first.get("error"), RuntimeError)
+    assert "exited with code" in str(later.get("error"))
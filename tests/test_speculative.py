@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import make_model
+
+
+@pytest.mark.parametrize("num_draft_tokens", [1, 4])
+@pytest.mark.parametrize("draft_seed", [0, 1])
+def test_speculative_greedy_matches_greedy_generate(num_draft_tokens, draft_seed):
+    import torch
+    from transformers import LogitsProcessorList, NoRepeatNGramLogitsProcessor
+    from speculative import speculative_greedy
+
+    target = make_model(seed=0)
+    # Seed 0 gives a draft that shares the target's first layer; seed 1 a draft that is mostly rejected.
+    draft = make_model(seed=draft_seed, n_layer=1)
+    input_ids = torch.tensor([[3, 4, 8, 7, 15, 11, 5]])
+
+    expected = target.generate(input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=40,
+                               do_sample=False, num_beams=1, no_repeat_ngram_size=3, pad_token_id=1)
+    output, stats = speculative_greedy(target, draft, input_ids, 40, num_draft_tokens,
+                                       LogitsProcessorList([NoRepeatNGramLogitsProcessor(3)]), eos_token_id=0)
+
+    assert output.tolist() == expected.tolist()
+    assert stats["accepted"] <= stats["drafted"]
+
+
+def test_generate_text_speculative_matches_greedy(generator):
+    from test_text_generator import QUESTION
+
+    generator._draft_model = make_model(seed=0, n_layer=1)
+    prompt = generator.build_few_shot_prompt(QUESTION, max_length=100)
+    expected = generator.generate_text(prompt, max_length=100, num_beams=1)
+    assert generator.generate_text(prompt, max_length=100, num_beams=1, speculative=True) == expected
+    assert generator.speculative_stats["requests"] == 1
@@ -0,0 +1,258 @@
+import threading
+
+import pytest
+
+from TextGen import ANSWER_DELIMITERS
+
+
+PROMPT = "User Question: the law of contract . Answer:"
+
+
+def run_with_timeout(func, timeout=30):
+    result = {}
+
+    def target():
+        try:
+            result["value"] = func()
+        except BaseException as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "timed out"
+    return result
+
+
+def test_generate_stream_yields_text(generator):
+    result = run_with_timeout(lambda: "".join(generator.generate_stream(PROMPT, max_length=20, num_beams=1)))
+    assert "error" not in result
+
+
+def test_generate_stream_raises_generate_errors(generator, monkeypatch):
+    def failing_generate(**kwargs):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(generator._model, "generate", failing_generate)
+    result = run_with_timeout(lambda: list(generator.generate_stream(PROMPT, max_length=20, num_beams=1)))
+    assert isinstance(result.get("error"), RuntimeError)
+
+
+QUESTION = "Draft a well structured introduction about tax and contract law ."
+
+
+def test_building_prompts_does_not_load_weights(generator):
+    generator._model = None
+    prompt = generator.build_few_shot_prompt(QUESTION, max_length=100)
+
+    assert "\n\nUser Question: " + QUESTION in prompt
+    assert generator._model is None and not generator.prefix_cache
+
+
+def test_prefix_cache_is_filled_on_generation_and_keeps_output(generator):
+    prompt = generator.build_few_shot_prompt(QUESTION, max_length=100)
+    generator.prefix_cache_size = 0
+    expected = generator.generate_text(prompt, max_length=100, num_beams=3)
+    assert not generator.prefix_cache
+
+    generator.prefix_cache_size = 2
+    assert generator.generate_text(prompt, max_length=100, num_beams=3) == expected
+    assert len(generator.prefix_cache) == 1
+    assert generator.generate_text(prompt, max_length=100, num_beams=3) == expected
+
+
+def test_prefix_cache_is_safe_across_threads(generator):
+    generator.prefix_cache_size = 2
+    prompts = [f"{'the law . ' * (i + 1)}\n\nUser Question: tax ?\nAnswer:" for i in range(8)]
+    encoded = [generator.tokenizer(prompt, return_tensors="pt").input_ids for prompt in prompts]
+    errors = []
+
+    def worker(offset):
+        try:
+            for round in range(20):
+                i = (offset + round) % len(prompts)
+                assert generator.prefix_past(prompts[i], encoded[i]) is not None
+        except BaseException as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(generator.prefix_cache) <= 2
+
+
+def test_answer_delimiter_flag_follows_the_beam(generator):
+    import torch
+    from TextGen import AnswerDelimiterCriteria
+
+    ids = generator.tokenizer.convert_tokens_to_ids
+    prompt = [ids("Answer:")]
+    criteria = AnswerDelimiterCriteria(generator.tokenizer, prompt_length=1)
+
+    # Step 1: only the first of three beams reaches a delimiter.
+    step1 = torch.tensor([prompt + [ids("law"), ids("Question:")],
+                          prompt + [ids("law"), ids("tax")],
+                          prompt + [ids("the"), ids("court")]])
+    assert criteria(step1, None).tolist() == [True, False, False]
+
+    # Step 2: the beams are reordered; the continuation of the first beam is still stopped.
+    step2 = torch.tensor([prompt + [ids("the"), ids("court"), ids("law")],
+                          prompt + [ids("law"), ids("Question:"), ids("tax")],
+                          prompt + [ids("law"), ids("tax"), ids("User")]])
+    assert criteria(step2, None).tolist() == [False, True, False]
+
+    # Step 3: another beam reaches a delimiter, so every beam is stopped.
+    step3 = torch.tensor([prompt + [ids("law"), ids("Question:"), ids("tax"), ids("the")],
+                          prompt + [ids("law"), ids("tax"), ids("User"), ids("Question:")],
+                          prompt + [ids("law"), ids("Question:"), ids("tax"), ids("law")]])
+    assert criteria(step3, None).all()
+
+
+def test_delimiter_is_not_found_in_the_prompt(generator):
+    import torch
+    from TextGen import AnswerDelimiterCriteria
+
+    input_ids = generator.tokenizer("User Question: tax law Answer: the law", return_tensors="pt").input_ids
+    criteria = AnswerDelimiterCriteria(generator.tokenizer, prompt_length=input_ids.shape[1] - 2)
+    assert criteria(input_ids, None).tolist() == [False]
+
+
+class PeakedModel:
+
+    """
+    Always gives token 1 logit 10 and EOS logit 6, so EOS is the runner-up at every step but never the best.
+    """
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+
+    def __call__(self, input_ids, past_key_values=None, use_cache=True):
+        import torch
+        from types import SimpleNamespace
+
+        logits = torch.zeros(input_ids.shape[0], input_ids.shape[1], self.vocab_size)
+        logits[..., 1] = 10.0
+        logits[..., 0] = 6.0
+        past = ((torch.zeros(input_ids.shape[0], 1),),)
+        return SimpleNamespace(logits=logits, past_key_values=past)
+
+
+@pytest.mark.parametrize("beam_margin", [4.0, 1e9])
+def test_adaptive_beam_search_does_not_stop_on_hypotheses_from_wider_beams(generator, beam_margin):
+    import torch
+
+    generator._model = PeakedModel(len(generator.tokenizer))
+    input_ids = torch.zeros(1, 3, dtype=torch.long)
+    output = generator.adaptive_beam_search(input_ids, max_new_tokens=4, num_beams=5, no_repeat_ngram_size=0,
+                                            beam_margin=beam_margin)
+    assert output.tolist() == [[0, 0, 0, 1, 1, 1, 1]]
+
+
+@pytest.mark.parametrize("num_beams", [2, 5])
+def test_adaptive_beam_search_without_narrowing_matches_generate(generator, num_beams):
+    from conftest import make_model
+
+    prompt = generator.build_few_shot_prompt(QUESTION, max_length=100)
+    for seed in range(3):
+        generator._model = make_model(seed)
+        expected = generator.generate_text(prompt, max_length=100, num_beams=num_beams, stop_at_delimiter=False)
+        assert generator.generate_text(prompt, max_length=100, num_beams=num_beams, stop_at_delimiter=False,
+                                       beam_margin=1e9) == expected
+        assert generator.last_beam["final_width"] == num_beams
+
+
+def test_merged_checkpoint_is_rebuilt_after_retraining(tmp_path):
+    from peft import LoraConfig, get_peft_model
+    from conftest import make_model, make_tokenizer
+    from TextGen import TextGenerator
+
+    base_model_dir, model_dir, merged_model_dir = (str(tmp_path / name) for name in ("base", "adapter", "merged"))
+    make_model().save_pretrained(base_model_dir)
+
+    def train_adapter(seed):
+        import torch
+
+        model = make_model()
+        # Random LoRA weights stand in for training; the seed decides them.
+        torch.manual_seed(seed)
+        config = LoraConfig(r=4, target_modules=["c_attn"], fan_in_fan_out=True, init_lora_weights=False)
+        get_peft_model(model, config).save_pretrained(model_dir)
+        make_tokenizer().save_pretrained(model_dir)
+
+    def generate():
+        generator = TextGenerator(model_dir=model_dir, base_model_dir=base_model_dir, merged_model_dir=merged_model_dir,
+                                  few_shot_dir=str(tmp_path), few_shot_poll_interval=None)
+        return generator.generate_text(PROMPT, max_length=20, num_beams=1), generator
+
+    train_adapter(seed=1)
+    first, generator = generate()
+    assert generator.merged_checkpoint_current()
+    assert generate()[0] == first
+
+    train_adapter(seed=2)
+    assert not generator.merged_checkpoint_current()
+    retrained, generator = generate()
+    assert generator.merged_checkpoint_current()
+
+    # The rebuilt merged checkpoint gives the same text as the adapter applied without merging.
+    unmerged = TextGenerator(model_dir=model_dir, base_model_dir=base_model_dir, few_shot_dir=str(tmp_path),
+                             few_shot_poll_interval=None)
+    assert retrained == unmerged.generate_text(PROMPT, max_length=20, num_beams=1)
+    assert retrained != first
+
+
+def test_batch_and_single_prompt_results_are_cached_apart(generator, tmp_path):
+    from generation_cache import GenerationCache
+    from TextGen import GENERATION_DEFAULTS, TextGenerator
+
+    generator.cache = GenerationCache(str(tmp_path / "cache.sqlite"))
+    generator.cache.put(PROMPT, dict(GENERATION_DEFAULTS, max_length=20), "from generate_text")
+
+    batch = generator.generate_batch([PROMPT], max_length=20)
+    assert batch != ["from generate_text"]
+    assert generator.generate_text(PROMPT, max_length=20) == "from generate_text"
+    # The worker pool looks batch results up with the same parameters.
+    assert generator.cache.get(PROMPT, TextGenerator.batch_cache_params(max_length=20)) == batch[0]
+
+
+@pytest.mark.parametrize("pieces, expected", [
+    (["the law", " Ques", "tion: tax"], "the law"),
+    (["a ", "User", " Question:", " b"], "a"),
+    (["tax <S", "EP> rule"], "tax"),
+    (["the Ques", "t law  "], "the Quest law  "),
+])
+def test_cut_stream_at_delimiter(pieces, expected):
+    from TextGen import cut_stream_at_delimiter
+
+    assert "".join(cut_stream_at_delimiter(iter(pieces))) == expected
+
+
+def test_generate_stream_stops_at_delimiter(generator):
+    from conftest import make_model
+
+    generator._model = make_model(seed=5)   # its greedy answer reaches a delimiter within the budget
+    kwargs = {"max_length": 100, "max_new_tokens": 40, "num_beams": 1}
+    cut = generator.generate_text(PROMPT, **kwargs)
+    streamed = run_with_timeout(lambda: "".join(generator.generate_stream(PROMPT, **kwargs)))["value"]
+    uncut = run_with_timeout(lambda: "".join(generator.generate_stream(PROMPT, stop_at_delimiter=False,
+                                                                       **kwargs)))["value"]
+
+    assert cut.endswith(" " + streamed)
+    assert any(d in uncut for d in ANSWER_DELIMITERS) and uncut.startswith(streamed)
+    assert len(generator.tokenizer(uncut).input_ids) <= 40
+
+
+def test_stream_beams_stops_at_delimiter(generator):
+    kwargs = {"max_length": 100, "max_new_tokens": 30, "num_beams": 3}
+    prompt_length = len(generator.tokenizer(PROMPT).input_ids)
+
+    texts = list(generator.generate_stream(PROMPT, **kwargs))
+    uncut = list(generator.generate_stream(PROMPT, stop_at_delimiter=False, **kwargs))
+
+    assert texts and not any(d in text[len(PROMPT):] for text in texts for d in ANSWER_DELIMITERS)
+    assert any(d in text[len(PROMPT):] for text in uncut for d in ANSWER_DELIMITERS)
+    assert all(len(generator.tokenizer(text).input_ids) <= prompt_length + 30 for text in uncut)